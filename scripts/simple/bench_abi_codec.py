@@ -0,0 +1,106 @@
+"""Per call cost of web3's generic ABI handling against eth_abi_codec
+
+Encodes and decodes the hot ERC20, pool, factory, router and Multicall3 calls
+once through web3 contract objects and eth_abi, the way the swap scripts did
+it, and once through the precompiled codec. No RPC endpoint is needed.
+
+Usage: python bench_abi_codec.py [iterations]
+"""
+import json
+import sys
+import timeit
+
+from eth_abi import decode, encode
+from web3 import Web3
+
+import eth_abi_codec as codec
+from uniswap_multicall import FACTORY_ABI, MULTICALL3_ABI, MULTICALL3_ADDRESS, POOL_STATE_ABI
+
+TOKEN = "0x833589fCD6eDb6E08f4c7C32D4f71b54bdA02913"
+WETH = "0x4200000000000000000000000000000000000006"
+OWNER = "0x1111111111111111111111111111111111111111"
+POOL = "0xd0b53D9277642d899DF5C87A3966A349A798F224"
+FACTORY = "0x33128a8fC17869897dcE68Ed026d694621f6FDfD"
+ROUTER = "0x2626664c2603336E57B271c5C0b26F421741e481"
+SWAP_PARAMS = {
+    "tokenIn": WETH,
+    "tokenOut": TOKEN,
+    "fee": 500,
+    "recipient": OWNER,
+    "amountIn": 10**15,
+    "amountOutMinimum": 2 * 10**6,
+    "sqrtPriceLimitX96": 0,
+}
+SLOT0_TYPES = ["uint160", "int24", "uint16", "uint16", "uint16", "uint8", "bool"]
+SLOT0_DATA = encode(SLOT0_TYPES, [4 * 10**24, -198000, 12, 100, 100, 0, True])
+UINT_DATA = encode(["uint256"], [10**21])
+# ERC20 ABI as a JSON string, the way the swap classes parsed it per call
+ERC20_ABI_JSON = json.dumps(codec.ERC20_ABI)
+
+
+def web3_cases(w3):
+    token = w3.eth.contract(address=TOKEN, abi=codec.ERC20_ABI)
+    router = w3.eth.contract(address=ROUTER, abi=codec.SWAP_ROUTER_ABI)
+    factory = w3.eth.contract(address=FACTORY, abi=FACTORY_ABI)
+    pool = w3.eth.contract(address=POOL, abi=POOL_STATE_ABI)
+    multicall = w3.eth.contract(address=MULTICALL3_ADDRESS, abi=MULTICALL3_ABI)
+    calls = [(TOKEN, True, token.encode_abi("balanceOf", [OWNER]))] * 8
+    aggregate_data = encode(["(bool,bytes)[]"], [[(True, UINT_DATA)] * 8])
+    return {
+        "contract object": lambda: w3.eth.contract(
+            address=TOKEN, abi=json.loads(ERC20_ABI_JSON)
+        ),
+        "balanceOf encode": lambda: token.encode_abi("balanceOf", [OWNER]),
+        "allowance encode": lambda: token.encode_abi("allowance", [OWNER, ROUTER]),
+        "approve encode": lambda: token.encode_abi("approve", [ROUTER, 10**18]),
+        "transfer encode": lambda: token.encode_abi("transfer", [OWNER, 10**6]),
+        "getPool encode": lambda: factory.encode_abi("getPool", [WETH, TOKEN, 500]),
+        "exactInputSingle encode": lambda: router.encode_abi(
+            "exactInputSingle", [SWAP_PARAMS]
+        ),
+        "slot0 encode": lambda: pool.encode_abi("slot0"),
+        "uint256 decode": lambda: decode(["uint256"], UINT_DATA),
+        "slot0 decode": lambda: decode(SLOT0_TYPES, SLOT0_DATA),
+        "aggregate3 encode (8)": lambda: multicall.encode_abi("aggregate3", [calls]),
+        "aggregate3 decode (8)": lambda: decode(["(bool,bytes)[]"], aggregate_data),
+    }
+
+
+def codec_cases(w3):
+    calls = [(TOKEN, True, codec.encode_balance_of(OWNER))] * 8
+    aggregate_data = encode(["(bool,bytes)[]"], [[(True, UINT_DATA)] * 8])
+    return {
+        "contract object": lambda: codec.get_contract(w3, TOKEN, codec.ERC20_ABI),
+        "balanceOf encode": lambda: codec.encode_balance_of(OWNER),
+        "allowance encode": lambda: codec.encode_allowance(OWNER, ROUTER),
+        "approve encode": lambda: codec.encode_approve(ROUTER, 10**18),
+        "transfer encode": lambda: codec.encode_transfer(OWNER, 10**6),
+        "getPool encode": lambda: codec.encode_get_pool(WETH, TOKEN, 500),
+        "exactInputSingle encode": lambda: codec.encode_exact_input_single(SWAP_PARAMS),
+        "slot0 encode": codec.encode_slot0,
+        "uint256 decode": lambda: codec.decode_uint(UINT_DATA),
+        "slot0 decode": lambda: codec.decode_slot0(SLOT0_DATA),
+        "aggregate3 encode (8)": lambda: codec.encode_aggregate3(calls),
+        "aggregate3 decode (8)": lambda: codec.decode_aggregate3(aggregate_data),
+    }
+
+
+def per_call_us(fn, iterations):
+    return min(timeit.repeat(fn, number=iterations, repeat=3)) / iterations * 1e6
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    w3 = Web3()
+    before = web3_cases(w3)
+    after = codec_cases(w3)
+
+    print(f"{'call':<26} {'web3 us':>10} {'codec us':>10} {'speedup':>8}")
+    for name, fn in before.items():
+        slow = per_call_us(fn, max(iterations // 20, 10) if name == "contract object" else iterations)
+        fast = per_call_us(after[name], iterations)
+        print(f"{name:<26} {slow:10.2f} {fast:10.2f} {slow / fast:7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""End-to-end RPC cost and latency of every script flow, offline
+
+Runs each flow a number of times against the local JSON-RPC stand-in
+(rpc_standin.py), one fresh funded wallet per run, and reports per flow:
+RPC calls per method, HTTP round trips, failed runs, p50/p99 wall-clock
+latency and throughput. One warm-up run per flow is left out, so caches
+(token metadata, pools, gas limits, fees, blockhash) are warm as in a long
+running process.
+
+Flows:
+    swap_eth_for_token    UniswapV3.swap_eth_for_token, ETH -> USDC
+    swap                  BaseUniswapV3.swap, USDC -> WETH with an approval
+    transfer_all_balance  eth_transfer.transfer_all_balance
+    transfer_usdc         eth_token_transfer.transfer_usdc
+    sol_transfer          sol_transfer.transfer_sol
+
+The transfer scripts keep their Web3 in a module global, it is pointed at the
+stand-in. The run takes place in a temporary directory, also used as the cache
+directory, so on-disk caches of the scripts start empty and are left behind
+there.
+
+Save a run with --save and compare a later one against it with --compare to
+get a before/after number for a change.
+
+Usage:
+    python bench_flows.py [--runs 20] [--latency-ms 50] [--error-rate 0.01] [--flows swap sol_transfer]
+    python bench_flows.py --save before.json
+    python bench_flows.py --compare before.json
+    python bench_flows.py --metrics metrics.prom   # per-method and per-phase histograms
+"""
+from decimal import Decimal
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import tempfile
+import time
+
+from eth_account import Account
+from solana.rpc.api import Client
+from solders.keypair import Keypair
+from web3 import Web3
+
+import eth_token_transfer
+import eth_transfer
+from bench_uniswap_async import CHAIN_ID, USDC_ADDRESS, WETH_ADDRESS, build_world
+from eth_batching_provider import get_batching_web3
+from eth_confirmation_tracker import get_confirmation_tracker
+from eth_gas_model import GasModel
+from eth_token_cache import CACHE_DIR_ENV, TokenMetadataCache
+from rpc_metrics import get_metrics
+from rpc_standin import RpcStandIn, SolanaWorld
+from sol_transfer import transfer_sol
+from uniswap_eth_for_token import UniswapV3
+from uniswap_pool_index import PoolIndex
+from uniswap_token_to_token import BaseUniswapV3
+
+# Block poll interval of the shared confirmation tracker
+RECEIPT_POLL_LATENCY = 0.1
+LAMPORTS_PER_SOL = 10**9
+
+
+def percentile(values, q):
+    """Nearest-rank percentile, q in [0, 1]"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(math.ceil(q * len(ordered)) - 1, 0))]
+
+
+class EvmFlows:
+    def __init__(self, world, url):
+        self.world = world
+        self.url = url
+        self.token_cache = TokenMetadataCache(":memory:")
+        self.pool_index = PoolIndex(path=None)
+        self.gas_model = GasModel(":memory:")
+        # The transfer scripts use their module's Web3
+        eth_transfer.w3 = get_batching_web3(url)
+        eth_token_transfer.w3 = get_batching_web3(url)
+
+    def new_wallet(self, usdc=0):
+        wallet = Account.create()
+        self.world.fund(wallet.address, amount=10**18)
+        if usdc:
+            self.world.fund(wallet.address, USDC_ADDRESS, usdc)
+        return wallet
+
+    def swap_eth_for_token(self):
+        wallet = self.new_wallet()
+        UniswapV3(
+            self.url,
+            CHAIN_ID,
+            WETH_ADDRESS,
+            wallet.key,
+            self.token_cache,
+            self.pool_index,
+            gas_model=self.gas_model,
+        ).swap_eth_for_token(0.001, USDC_ADDRESS)
+
+    def swap(self):
+        wallet = self.new_wallet(usdc=1000 * 10**6)
+        BaseUniswapV3(
+            self.url,
+            CHAIN_ID,
+            wallet.key,
+            self.token_cache,
+            self.pool_index,
+            gas_model=self.gas_model,
+        ).swap(USDC_ADDRESS, WETH_ADDRESS, 10)
+
+    def transfer_all_balance(self):
+        wallet = self.new_wallet()
+        eth_transfer.transfer_all_balance(wallet.key, Account.create().address)
+
+    def transfer_usdc(self):
+        wallet = self.new_wallet(usdc=1000 * 10**6)
+        eth_token_transfer.transfer_usdc(wallet.key, Account.create().address, 1.0)
+
+
+class SolanaFlows:
+    def __init__(self, world, url):
+        self.world = world
+        self.url = url
+        self.client = Client(url)
+
+    def sol_transfer(self):
+        sender = Keypair()
+        self.world.fund(sender.pubkey(), LAMPORTS_PER_SOL)
+        transfer_sol(self.url, sender, Keypair().pubkey(), Decimal("0.001"), self.client)
+
+
+EVM_FLOWS = ["swap_eth_for_token", "swap", "transfer_all_balance", "transfer_usdc"]
+SOLANA_FLOWS = ["sol_transfer"]
+
+
+def run_flow(flows, name, runs, error_rate=0.0):
+    """Warm up once, then time `runs` runs of a flow
+
+    Errors are only injected into the timed runs.
+
+    Returns:
+        dict of the flow's numbers
+    """
+    flow = getattr(flows, name)
+    world = flows.world
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            flow()
+        except Exception:
+            pass
+
+        world.reset_counts()
+        world.error_rate = error_rate
+        latencies = []
+        errors = []
+        started = time.perf_counter()
+        for _ in range(runs):
+            run_started = time.perf_counter()
+            try:
+                flow()
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            latencies.append(time.perf_counter() - run_started)
+        elapsed = time.perf_counter() - started
+        world.error_rate = 0.0
+
+    return {
+        "runs": runs,
+        "failed": len(errors),
+        "first_error": errors[0] if errors else None,
+        "p50_ms": percentile(latencies, 0.5) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+        "runs_per_second": len(latencies) / elapsed if elapsed else 0,
+        "requests_per_run": sum(world.request_counts.values()) / runs,
+        "round_trips_per_run": world.http_requests / runs,
+        "methods_per_run": {
+            method: count / runs for method, count in world.request_counts.most_common()
+        },
+        "injected_errors": sum(world.error_counts.values()),
+    }
+
+
+def _ms(value):
+    return f"{value:8.1f}" if value is not None else f"{'-':>8}"
+
+
+def print_results(results, baseline=None):
+    print(
+        f"{'flow':<22} {'ok/runs':>8} {'p50 ms':>8} {'p99 ms':>8} {'runs/s':>8}"
+        f" {'req/run':>8} {'trips/run':>9}"
+    )
+    for name, result in results.items():
+        print(
+            f"{name:<22} {result['runs'] - result['failed']:>3}/{result['runs']:<4}"
+            f" {_ms(result['p50_ms'])} {_ms(result['p99_ms'])} {result['runs_per_second']:8.2f}"
+            f" {result['requests_per_run']:8.1f} {result['round_trips_per_run']:9.1f}"
+        )
+        before = (baseline or {}).get(name)
+        if before and before["p50_ms"] and result["p50_ms"]:
+            print(
+                f"{'  vs baseline':<22} {'':>8}"
+                f" {result['p50_ms'] / before['p50_ms'] - 1:+8.0%}"
+                f" {(result['p99_ms'] / before['p99_ms'] - 1) if before['p99_ms'] else 0:+8.0%}"
+                f" {'':>8}"
+                f" {result['requests_per_run'] - before['requests_per_run']:+8.1f}"
+                f" {result['round_trips_per_run'] - before['round_trips_per_run']:+9.1f}"
+            )
+        methods = ", ".join(
+            f"{method} {count:g}" for method, count in result["methods_per_run"].items()
+        )
+        print(f"  {methods}")
+        if result["injected_errors"]:
+            print(f"  injected errors answered: {result['injected_errors']}")
+        if result["first_error"]:
+            print(f"  first error: {result['first_error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RPC cost and latency of every script flow, offline")
+    parser.add_argument("--runs", type=int, default=20, help="timed runs per flow")
+    parser.add_argument("--latency-ms", type=float, default=50, help="latency of every RPC request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered with an error")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the injected errors")
+    parser.add_argument("--slot-ms", type=float, default=400, help="Solana slot time")
+    parser.add_argument("--flows", nargs="*", choices=EVM_FLOWS + SOLANA_FLOWS, help="default: every flow")
+    parser.add_argument("--evm-script", help="JSON Lines of scripted/recorded EVM answers")
+    parser.add_argument("--solana-script", help="JSON Lines of scripted/recorded Solana answers")
+    parser.add_argument("--save", help="write the results as JSON")
+    parser.add_argument("--compare", help="JSON of an earlier run to compare against")
+    parser.add_argument("--metrics", help="write RPC and phase histograms (.prom or .jsonl)")
+    args = parser.parse_args()
+
+    names = args.flows or EVM_FLOWS + SOLANA_FLOWS
+    latency = args.latency_ms / 1000
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["flows"]
+    save_path = os.path.abspath(args.save) if args.save else None
+    metrics_path = os.path.abspath(args.metrics) if args.metrics else None
+    os.chdir(tempfile.mkdtemp(prefix="bench_flows_"))
+    os.environ[CACHE_DIR_ENV] = os.getcwd()
+
+    evm_world = build_world(latency)
+    evm_world.random.seed(args.seed)
+    solana_world = SolanaWorld(latency=latency, slot_time=args.slot_ms / 1000, seed=args.seed)
+    for world, script in ((evm_world, args.evm_script), (solana_world, args.solana_script)):
+        if script:
+            world.load_script(script)
+
+    print(
+        f"{args.runs} runs per flow, {args.latency_ms:.0f} ms per RPC request, "
+        f"{args.error_rate:.1%} injected errors"
+    )
+    results = {}
+    with RpcStandIn(evm_world) as evm_standin, RpcStandIn(solana_world) as solana_standin:
+        get_confirmation_tracker(
+            Web3(Web3.HTTPProvider(evm_standin.url)), poll_interval=RECEIPT_POLL_LATENCY
+        )
+        flows = {}
+        if any(name in EVM_FLOWS for name in names):
+            flows.update(dict.fromkeys(EVM_FLOWS, EvmFlows(evm_world, evm_standin.url)))
+        if any(name in SOLANA_FLOWS for name in names):
+            flows.update(dict.fromkeys(SOLANA_FLOWS, SolanaFlows(solana_world, solana_standin.url)))
+        for name in names:
+            results[name] = run_flow(flows[name], name, args.runs, args.error_rate)
+
+    print_results(results, baseline)
+    if metrics_path:
+        get_metrics().write(metrics_path)
+    if save_path:
+        with open(save_path, "w") as f:
+            json.dump({"args": vars(args), "flows": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
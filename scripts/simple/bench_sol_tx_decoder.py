@@ -0,0 +1,81 @@
+"""Transactions per second (and per core) of sol_tx_decoder
+
+Signs a set of synthetic transactions (System transfers, SPL Token Transfer
+and Token-2022 TransferChecked), then decodes them in one process and on a
+process pool of every core. No RPC endpoint is needed.
+
+Usage: python bench_sol_tx_decoder.py [transactions] [workers]
+"""
+import base64
+import os
+import sys
+import time
+
+from solders.hash import Hash
+from solders.instruction import AccountMeta, Instruction
+from solders.keypair import Keypair
+from solders.message import Message
+from solders.pubkey import Pubkey
+from solders.system_program import TransferParams, transfer
+from solders.transaction import Transaction
+
+from sol_tx_decoder import (
+    TOKEN_2022_PROGRAM_ID,
+    TOKEN_PROGRAM_ID,
+    TOKEN_TRANSFER,
+    TOKEN_TRANSFER_CHECKED,
+    decode_stream,
+)
+
+
+def token_transfer(program_id, source, destination, owner, amount, mint=None):
+    if mint is None:
+        data = bytes([TOKEN_TRANSFER]) + amount.to_bytes(8, "little")
+        keys = [source, destination, owner]
+    else:
+        data = bytes([TOKEN_TRANSFER_CHECKED]) + amount.to_bytes(8, "little") + bytes([6])
+        keys = [source, mint, destination, owner]
+    metas = [AccountMeta(key, is_signer=key == owner, is_writable=key != owner) for key in keys]
+    return Instruction(Pubkey.from_string(program_id), data, metas)
+
+
+def build_transactions(count):
+    """base64 lines of count signed transactions, 3 transfers each"""
+    payers = [Keypair() for _ in range(16)]
+    mint = Keypair().pubkey()
+    blockhash = Hash.new_unique()
+    lines = []
+    for i in range(count):
+        payer = payers[i % len(payers)]
+        source, destination = Keypair().pubkey(), Keypair().pubkey()
+        instructions = [
+            transfer(TransferParams(from_pubkey=payer.pubkey(), to_pubkey=destination, lamports=i + 1)),
+            token_transfer(TOKEN_PROGRAM_ID, source, destination, payer.pubkey(), i),
+            token_transfer(TOKEN_2022_PROGRAM_ID, source, destination, payer.pubkey(), i, mint),
+        ]
+        tx = Transaction([payer], Message(instructions, payer.pubkey()), blockhash)
+        lines.append(base64.b64encode(bytes(tx)).decode())
+    return lines
+
+
+def run(lines, workers):
+    started = time.time()
+    decoded = 0
+    for txs, _ in decode_stream(lines, workers=workers):
+        decoded += len(txs["index"])
+    return decoded / (time.time() - started)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    lines = build_transactions(count)
+
+    print(f"{'workers':>8} {'tx/s':>10} {'tx/s per core':>14}")
+    for n in sorted({1, workers}):
+        rate = run(lines, n)
+        print(f"{n:>8} {rate:10.0f} {rate / n:14.0f}")
+
+
+if __name__ == "__main__":
+    main()
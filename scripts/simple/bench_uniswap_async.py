@@ -0,0 +1,131 @@
+"""Swaps per minute of the sync and asyncio Uniswap clients
+
+Runs the same ETH -> USDC swap for a number of wallets against the local
+JSON-RPC stand-in (rpc_standin.py), first one wallet after another with
+UniswapV3, then one thread per wallet with UniswapV3, then every wallet on one
+event loop with AsyncUniswapV3.
+
+Usage: python bench_uniswap_async.py [wallets] [latency_ms]
+"""
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextlib
+import io
+import sys
+import time
+
+from eth_account import Account
+from web3 import AsyncWeb3, Web3
+
+from eth_confirmation_tracker import get_confirmation_tracker
+from eth_token_cache import TokenMetadataCache
+from rpc_standin import EvmWorld, RpcStandIn
+from uniswap_async import AsyncUniswapV3
+from uniswap_eth_for_token import FACTORY_ADDRESS, UniswapV3
+from uniswap_pool_index import PoolIndex
+
+CHAIN_ID = 8453
+WETH_ADDRESS = "0x4200000000000000000000000000000000000006"
+USDC_ADDRESS = "0x833589fCD6eDb6E08f4c7C32D4f71b54bdA02913"
+ETH_AMOUNT = 0.001
+# Block poll interval of the shared confirmation tracker
+RECEIPT_POLL_LATENCY = 0.1
+
+
+def build_world(latency):
+    world = EvmWorld(chain_id=CHAIN_ID, latency=latency)
+    world.add_token(WETH_ADDRESS, "Wrapped Ether", "WETH", 18)
+    world.add_token(USDC_ADDRESS, "USD Coin", "USDC", 6)
+    # 3000 USDC per WETH, WETH is token0
+    world.add_pool(FACTORY_ADDRESS, WETH_ADDRESS, USDC_ADDRESS, 500, 3000e-12, 10**18, 10)
+    return world
+
+
+def new_wallets(world, count):
+    wallets = [Account.create() for _ in range(count)]
+    for wallet in wallets:
+        world.fund(wallet.address, amount=10**18)
+    return wallets
+
+
+def run_sync_sequential(url, wallets, token_cache, pool_index):
+    for wallet in wallets:
+        UniswapV3(
+            url, CHAIN_ID, WETH_ADDRESS, wallet.key, token_cache, pool_index
+        ).swap_eth_for_token(ETH_AMOUNT, USDC_ADDRESS)
+
+
+def run_sync_threads(url, wallets, token_cache, pool_index):
+    def swap(wallet):
+        UniswapV3(
+            url, CHAIN_ID, WETH_ADDRESS, wallet.key, token_cache, pool_index
+        ).swap_eth_for_token(ETH_AMOUNT, USDC_ADDRESS)
+
+    with ThreadPoolExecutor(max_workers=len(wallets)) as executor:
+        list(executor.map(swap, wallets))
+
+
+def run_async(url, wallets, token_cache, pool_index):
+    async def swap_all():
+        w3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(url))
+        clients = [
+            AsyncUniswapV3(
+                url,
+                CHAIN_ID,
+                WETH_ADDRESS,
+                wallet.key,
+                token_cache,
+                pool_index,
+                receipt_poll_latency=RECEIPT_POLL_LATENCY,
+                w3=w3,
+            )
+            for wallet in wallets
+        ]
+        await asyncio.gather(
+            *(client.swap_eth_for_token(ETH_AMOUNT, USDC_ADDRESS) for client in clients)
+        )
+        await w3.provider.disconnect()
+
+    asyncio.run(swap_all())
+
+
+def main():
+    wallet_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1000
+
+    world = build_world(latency)
+    token_cache = TokenMetadataCache(":memory:")
+    pool_index = PoolIndex(path=None)
+    runs = [
+        ("sync, sequential", run_sync_sequential),
+        ("sync, thread per wallet", run_sync_threads),
+        ("async, one event loop", run_async),
+    ]
+
+    print(f"{wallet_count} ETH -> USDC swaps, {latency * 1000:.0f} ms per RPC request")
+    with RpcStandIn(world) as standin:
+        get_confirmation_tracker(
+            Web3(Web3.HTTPProvider(standin.url)), poll_interval=RECEIPT_POLL_LATENCY
+        )
+        # Warm the token cache, pool index and tick hints so every run is warm
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_sync_sequential(standin.url, new_wallets(world, 1), token_cache, pool_index)
+
+        for label, run in runs:
+            wallets = new_wallets(world, wallet_count)
+            world.request_counts.clear()
+            world.http_requests = 0
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                run(standin.url, wallets, token_cache, pool_index)
+            elapsed = time.perf_counter() - start
+            requests = sum(world.request_counts.values())
+            print(
+                f"{label:<26} {elapsed:7.2f} s  {wallet_count / elapsed * 60:9.1f} swaps/min"
+                f"  {requests / wallet_count:5.1f} requests/swap"
+                f"  {world.http_requests / wallet_count:5.1f} round trips/swap"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+import threading
+
+from eth_utils import keccak
+from eth_utils.abi import collapse_if_tuple
+from web3 import Web3
+
+# Parsed once at import, shared by every script instead of json.loads per call
+
+ERC20_ABI = [
+    {"constant": True, "inputs": [], "name": "name", "outputs": [{"name": "", "type": "string"}], "payable": False, "stateMutability": "view", "type": "function"},
+    {"constant": True, "inputs": [], "name": "symbol", "outputs": [{"name": "", "type": "string"}], "payable": False, "stateMutability": "view", "type": "function"},
+    {"constant": True, "inputs": [], "name": "decimals", "outputs": [{"name": "", "type": "uint8"}], "payable": False, "stateMutability": "view", "type": "function"},
+    {"constant": True, "inputs": [{"name": "_owner", "type": "address"}], "name": "balanceOf", "outputs": [{"name": "balance", "type": "uint256"}], "payable": False, "stateMutability": "view", "type": "function"},
+    {"constant": True, "inputs": [{"name": "_owner", "type": "address"}, {"name": "_spender", "type": "address"}], "name": "allowance", "outputs": [{"name": "remaining", "type": "uint256"}], "payable": False, "stateMutability": "view", "type": "function"},
+    {"constant": False, "inputs": [{"name": "_spender", "type": "address"}, {"name": "_value", "type": "uint256"}], "name": "approve", "outputs": [{"name": "success", "type": "bool"}], "payable": False, "stateMutability": "nonpayable", "type": "function"},
+    {"constant": False, "inputs": [{"name": "_to", "type": "address"}, {"name": "_value", "type": "uint256"}], "name": "transfer", "outputs": [{"name": "", "type": "bool"}], "payable": False, "stateMutability": "nonpayable", "type": "function"},
+]
+
+SWAP_ROUTER_ABI = [
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"internalType": "address", "name": "tokenIn", "type": "address"},
+                    {"internalType": "address", "name": "tokenOut", "type": "address"},
+                    {"internalType": "uint24", "name": "fee", "type": "uint24"},
+                    {"internalType": "address", "name": "recipient", "type": "address"},
+                    {"internalType": "uint256", "name": "amountIn", "type": "uint256"},
+                    {"internalType": "uint256", "name": "amountOutMinimum", "type": "uint256"},
+                    {"internalType": "uint160", "name": "sqrtPriceLimitX96", "type": "uint160"},
+                ],
+                "internalType": "struct ISwapRouter.ExactInputSingleParams",
+                "name": "params",
+                "type": "tuple",
+            }
+        ],
+        "name": "exactInputSingle",
+        "outputs": [{"internalType": "uint256", "name": "amountOut", "type": "uint256"}],
+        "stateMutability": "payable",
+        "type": "function",
+    }
+]
+
+
+def selector(signature):
+    """4 byte function selector of a canonical signature, e.g. "balanceOf(address)" """
+    return keccak(text=signature)[:4]
+
+
+BALANCE_OF = selector("balanceOf(address)")
+ALLOWANCE = selector("allowance(address,address)")
+APPROVE = selector("approve(address,uint256)")
+TRANSFER = selector("transfer(address,uint256)")
+DECIMALS = selector("decimals()")
+SLOT0 = selector("slot0()")
+LIQUIDITY = selector("liquidity()")
+TICK_BITMAP = selector("tickBitmap(int16)")
+TICKS = selector("ticks(int24)")
+GET_POOL = selector("getPool(address,address,uint24)")
+EXACT_INPUT_SINGLE = selector(
+    "exactInputSingle((address,address,uint24,address,uint256,uint256,uint160))"
+)
+EXACT_INPUT = selector("exactInput((bytes,address,uint256,uint256))")
+AGGREGATE3 = selector("aggregate3((address,bool,bytes)[])")
+MULTICALL = selector("multicall(bytes[])")
+
+# Topics of the UniswapV3Pool events that change its swap state
+SWAP_EVENT = "0x" + keccak(text="Swap(address,address,int256,int256,uint160,uint128,int24)").hex()
+MINT_EVENT = "0x" + keccak(text="Mint(address,address,int24,int24,uint128,uint256,uint256)").hex()
+BURN_EVENT = "0x" + keccak(text="Burn(address,int24,int24,uint128,uint256,uint256)").hex()
+
+UINT256_MAX = (1 << 256) - 1
+
+
+# Encoding, every argument is one 32 byte word
+
+
+def _uint(value):
+    if not 0 <= value <= UINT256_MAX:
+        raise ValueError(f"{value} does not fit in uint256")
+    return value.to_bytes(32, "big")
+
+
+def _int(value):
+    if not -(1 << 255) <= value < (1 << 255):
+        raise ValueError(f"{value} does not fit in int256")
+    return (value & UINT256_MAX).to_bytes(32, "big")
+
+
+def _address(address):
+    raw = bytes.fromhex(address[2:] if address[:2] in ("0x", "0X") else address)
+    if len(raw) != 20:
+        raise ValueError(f"{address} is not a 20 byte address")
+    return bytes(12) + raw
+
+
+def encode_balance_of(owner):
+    return BALANCE_OF + _address(owner)
+
+
+def encode_allowance(owner, spender):
+    return ALLOWANCE + _address(owner) + _address(spender)
+
+
+def encode_approve(spender, amount):
+    return APPROVE + _address(spender) + _uint(amount)
+
+
+def encode_transfer(to_address, amount):
+    return TRANSFER + _address(to_address) + _uint(amount)
+
+
+def encode_decimals():
+    return DECIMALS
+
+
+def encode_slot0():
+    return SLOT0
+
+
+def encode_liquidity():
+    return LIQUIDITY
+
+
+def encode_tick_bitmap(word_pos):
+    return TICK_BITMAP + _int(word_pos)
+
+
+def encode_ticks(tick):
+    return TICKS + _int(tick)
+
+
+def encode_get_pool(token_a, token_b, fee):
+    return GET_POOL + _address(token_a) + _address(token_b) + _uint(fee)
+
+
+def encode_exact_input_single(params):
+    """Calldata of SwapRouter.exactInputSingle, params as passed to the web3 contract"""
+    return (
+        EXACT_INPUT_SINGLE
+        + _address(params["tokenIn"])
+        + _address(params["tokenOut"])
+        + _uint(params["fee"])
+        + _address(params["recipient"])
+        + _uint(params["amountIn"])
+        + _uint(params["amountOutMinimum"])
+        + _uint(params["sqrtPriceLimitX96"])
+    )
+
+
+def encode_path(tokens, fees):
+    """Packed V3 swap path: token (20 bytes), fee (3 bytes), token, ..."""
+    if len(tokens) != len(fees) + 1:
+        raise ValueError("A path needs exactly one more token than fees")
+    path = _address(tokens[0])[12:]
+    for fee, token in zip(fees, tokens[1:]):
+        path += fee.to_bytes(3, "big") + _address(token)[12:]
+    return path
+
+
+def encode_exact_input(params):
+    """Calldata of SwapRouter02.exactInput, params {"path", "recipient", "amountIn", "amountOutMinimum"}"""
+    path = params["path"]
+    return (
+        EXACT_INPUT
+        + _uint(32)  # the params tuple (it has a dynamic member)
+        + _uint(128)  # path, after the four head words
+        + _address(params["recipient"])
+        + _uint(params["amountIn"])
+        + _uint(params["amountOutMinimum"])
+        + _uint(len(path))
+        + path
+        + bytes(-len(path) % 32)
+    )
+
+
+def encode_multicall(calls):
+    """Calldata of SwapRouter02.multicall(bytes[]), calls are calldata of the router itself"""
+    heads = []
+    tails = []
+    offset = 32 * len(calls)
+    for calldata in calls:
+        heads.append(_uint(offset))
+        tail = _uint(len(calldata)) + calldata + bytes(-len(calldata) % 32)
+        tails.append(tail)
+        offset += len(tail)
+    return MULTICALL + _uint(32) + _uint(len(calls)) + b"".join(heads) + b"".join(tails)
+
+
+def encode_aggregate3(calls):
+    """Calldata of Multicall3.aggregate3 for a list of (target, allow_failure, calldata)"""
+    heads = []
+    tails = []
+    offset = 32 * len(calls)
+    for target, allow_failure, calldata in calls:
+        heads.append(_uint(offset))
+        padding = bytes(-len(calldata) % 32)
+        tail = (
+            _address(target)
+            + _uint(1 if allow_failure else 0)
+            + _uint(96)
+            + _uint(len(calldata))
+            + calldata
+            + padding
+        )
+        tails.append(tail)
+        offset += len(tail)
+    return AGGREGATE3 + _uint(32) + _uint(len(calls)) + b"".join(heads) + b"".join(tails)
+
+
+# Decoding, raises ValueError on short or malformed return data like eth_abi
+
+
+def _word(data, index):
+    end = 32 * (index + 1)
+    if len(data) < end:
+        raise ValueError(f"return data too short: {len(data)} bytes")
+    return int.from_bytes(data[end - 32 : end], "big")
+
+
+def _signed(value, bits):
+    value &= (1 << bits) - 1
+    return value - (1 << bits) if value >> (bits - 1) else value
+
+
+def decode_uint(data):
+    return _word(data, 0)
+
+
+def decode_bool(data):
+    return _word(data, 0) != 0
+
+
+def decode_address(data):
+    """Lower case hex like eth_abi, 0x000.. when there is no pool"""
+    value = _word(data, 0)
+    if value >> 160:
+        raise ValueError("address word has dirty high bits")
+    return "0x" + value.to_bytes(20, "big").hex()
+
+
+def decode_slot0(data):
+    """(sqrtPriceX96, tick, observationIndex, observationCardinality,
+    observationCardinalityNext, feeProtocol, unlocked)"""
+    return (
+        _word(data, 0),
+        _signed(_word(data, 1), 24),
+        _word(data, 2),
+        _word(data, 3),
+        _word(data, 4),
+        _word(data, 5),
+        _word(data, 6) != 0,
+    )
+
+
+def decode_ticks(data):
+    """(liquidityGross, liquidityNet, feeGrowthOutside0X128, feeGrowthOutside1X128,
+    tickCumulativeOutside, secondsPerLiquidityOutsideX128, secondsOutside, initialized)"""
+    return (
+        _word(data, 0),
+        _signed(_word(data, 1), 128),
+        _word(data, 2),
+        _word(data, 3),
+        _signed(_word(data, 4), 56),
+        _word(data, 5),
+        _word(data, 6),
+        _word(data, 7) != 0,
+    )
+
+
+def decode_pool_log(log):
+    """Swap/Mint/Burn log of a pool, as returned by eth_getLogs (hex strings)
+
+    Returns:
+        ("swap", sqrtPriceX96, liquidity, tick), ("mint", tickLower, tickUpper,
+        amount) or ("burn", tickLower, tickUpper, amount), None for other events
+    """
+    topics = [topic.lower() for topic in log["topics"]]
+    data = bytes.fromhex(log["data"].removeprefix("0x"))
+    if topics[0] == SWAP_EVENT:
+        return ("swap", _word(data, 2), _word(data, 3), _signed(_word(data, 4), 24))
+    if topics[0] in (MINT_EVENT, BURN_EVENT):
+        tick_lower = _signed(int(topics[2], 16), 24)
+        tick_upper = _signed(int(topics[3], 16), 24)
+        if topics[0] == MINT_EVENT:
+            # Mint data starts with the (unindexed) sender
+            return ("mint", tick_lower, tick_upper, _word(data, 1))
+        return ("burn", tick_lower, tick_upper, _word(data, 0))
+    return None
+
+
+def decode_aggregate3(data):
+    """Return data of Multicall3.aggregate3 as a list of (success, return data)"""
+    data = bytes(data)
+    start = _word(data, 0) + 32
+    count = _word(data, start // 32 - 1)
+    results = []
+    for i in range(count):
+        element = start + _word(data, start // 32 + i)
+        success = _word(data[element:], 0) != 0
+        data_start = element + _word(data[element:], 1)
+        length = _word(data[data_start:], 0)
+        return_data = data[data_start + 32 : data_start + 32 + length]
+        if len(return_data) != length:
+            raise ValueError("aggregate3 return data is truncated")
+        results.append((success, return_data))
+    return results
+
+
+# Contract objects, built once per (Web3 instance, address, ABI)
+
+_contracts = {}
+_output_types = {}
+_contracts_lock = threading.Lock()
+
+
+def get_contract(w3, address, abi):
+    """Cached w3.eth.contract(address=address, abi=abi)
+
+    Building a web3 contract parses its ABI into function classes, which costs
+    more than the call it is used for. The ABI must be a module constant (it is
+    keyed by identity), the Web3 instances of the scripts live for the whole
+    process.
+    """
+    key = (id(w3), address, id(abi))
+    entry = _contracts.get(key)
+    if entry is None:
+        with _contracts_lock:
+            entry = _contracts.get(key)
+            if entry is None:
+                # Keep w3 and the ABI alive so their ids are not reused
+                entry = _contracts[key] = (
+                    w3.eth.contract(address=Web3.to_checksum_address(address), abi=abi),
+                    w3,
+                    abi,
+                )
+    return entry[0]
+
+
+def get_output_types(abi, fn_name):
+    """Output types of a function of an ABI, cached by identity like get_contract"""
+    key = (id(abi), fn_name)
+    output_types = _output_types.get(key)
+    if output_types is None:
+        fn_abi = next(
+            item
+            for item in abi
+            if item.get("type") == "function" and item["name"] == fn_name
+        )
+        output_types = _output_types[key] = (
+            [collapse_if_tuple(output) for output in fn_abi["outputs"]],
+            abi,
+        )
+    return output_types[0]
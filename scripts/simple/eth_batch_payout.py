@@ -0,0 +1,485 @@
+"""Pay many USDC recipients from a CSV of (address, amount)
+
+Transfers are signed with locally sequenced nonces and sent at a fixed rate
+without waiting for each other; confirmations are followed in bulk by the
+shared confirmation tracker. Every signed transaction is written to a SQLite
+journal before it is broadcast, so after a crash a rerun rebroadcasts the
+journaled transactions (same nonce, same hash) instead of paying again.
+
+With --disperse many recipients are paid per transaction through the
+Disperse contract (one approval, then disperseToken batches).
+
+Usage:
+    PRIVATE_KEY=0x... python eth_batch_payout.py payouts.csv [--rate 5] [--disperse]
+"""
+from collections import namedtuple
+from concurrent.futures import Future
+from decimal import Decimal, InvalidOperation
+import argparse
+import csv
+import os
+import sqlite3
+import threading
+import time
+
+from web3 import Web3
+from eth_account import Account
+
+from eth_abi_codec import encode_approve, encode_transfer, get_contract
+from eth_batching_provider import get_batching_web3
+from eth_confirmation_tracker import get_confirmation_tracker
+from eth_fee_oracle import get_fee_oracle
+from eth_nonce_manager import (
+    ALREADY_KNOWN_ERRORS,
+    NONCE_TOO_LOW_ERRORS,
+    REJECTED_ERRORS,
+    error_matches,
+    get_nonce_manager,
+    send_with_nonce,
+)
+from eth_token_transfer import RPC_URL, USDC_ADDRESS, build_usdc_transfer
+from uniswap_multicall import ERC20_READ_ABI
+
+USDC_DECIMALS = 6
+# Disperse.app deployment (same address on most EVM chains, check yours)
+DISPERSE_ADDRESS = Web3.to_checksum_address("0xD152f549545093347A162Dce210e7293f1452150")
+DISPERSE_ABI = [
+    {
+        "inputs": [
+            {"name": "token", "type": "address"},
+            {"name": "recipients", "type": "address[]"},
+            {"name": "values", "type": "uint256[]"},
+        ],
+        "name": "disperseToken",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function",
+    }
+]
+# A transfer to an address that never held USDC writes a new storage slot,
+# which costs this much more than the estimate for an existing holder
+NEW_HOLDER_GAS = 20000
+
+# key identifies the CSV row (line number, address, amount) in the journal
+Payout = namedtuple("Payout", ["key", "address", "amount"])
+
+
+def load_payouts(csv_path):
+    """Read (address, amount in USDC) rows, a header row is skipped
+
+    Raises:
+        Exception: on an invalid address or amount, nothing is paid then
+    """
+    payouts = []
+    with open(csv_path, newline="") as f:
+        for line_number, row in enumerate(csv.reader(f), start=1):
+            if not row or not row[0].strip():
+                continue
+            address = row[0].strip()
+            if line_number == 1 and not Web3.is_address(address):
+                continue  # header
+            if not Web3.is_address(address):
+                raise Exception(f"Line {line_number}: invalid address {address}")
+            if len(row) < 2:
+                raise Exception(f"Line {line_number}: missing amount")
+            amount = row[1].strip()
+            try:
+                amount = Decimal(amount) * 10**USDC_DECIMALS
+            except InvalidOperation:
+                raise Exception(f"Line {line_number}: invalid amount {row[1]}")
+            if amount <= 0 or amount != amount.to_integral_value():
+                raise Exception(f"Line {line_number}: invalid amount {row[1]}")
+            address = Web3.to_checksum_address(address)
+            payouts.append(
+                Payout(f"{line_number}:{address}:{int(amount)}", address, int(amount))
+            )
+    return payouts
+
+
+class PayoutJournal:
+    def __init__(self, path):
+        """SQLite journal of every payout transaction
+
+        A transaction is stored (with its raw signed bytes) before it is
+        broadcast. Rows of a transaction count as paid unless it reverted or
+        was never accepted by the node.
+        """
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS payout_transactions (
+                tx_hash TEXT PRIMARY KEY,
+                nonce INTEGER NOT NULL,
+                raw_transaction TEXT NOT NULL,
+                payout_keys TEXT NOT NULL,
+                status TEXT NOT NULL,
+                block_number INTEGER,
+                fee_wei INTEGER,
+                signed_at REAL NOT NULL
+            )"""
+        )
+        self.db.commit()
+
+    def paid_keys(self):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT payout_keys FROM payout_transactions WHERE status NOT IN ('reverted', 'dropped')"
+            ).fetchall()
+        return {key for (keys,) in rows for key in keys.split("|")}
+
+    def unfinished(self):
+        """Transactions signed but not seen mined, in nonce order"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT tx_hash, raw_transaction, payout_keys FROM payout_transactions WHERE status = 'signed' ORDER BY nonce"
+            ).fetchall()
+        return [
+            (tx_hash, raw_transaction, payout_keys.split("|"))
+            for tx_hash, raw_transaction, payout_keys in rows
+        ]
+
+    def record_signed(self, tx_hash, nonce, raw_transaction, payout_keys):
+        with self.lock:
+            # A dropped transaction signed again with the same nonce and fees
+            # has the same hash, its row is replaced
+            self.db.execute(
+                "INSERT OR REPLACE INTO payout_transactions VALUES (?, ?, ?, ?, 'signed', NULL, NULL, ?)",
+                (tx_hash, nonce, raw_transaction, "|".join(payout_keys), time.time()),
+            )
+            self.db.commit()
+
+    def record_status(self, tx_hash, status, block_number=None, fee_wei=None):
+        with self.lock:
+            self.db.execute(
+                "UPDATE payout_transactions SET status = ?, block_number = ?, fee_wei = ? WHERE tx_hash = ?",
+                (status, block_number, fee_wei, tx_hash),
+            )
+            self.db.commit()
+
+
+class PayoutReport:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.transactions_sent = 0
+        self.transfers_sent = 0
+        self.confirmed = 0
+        self.transfers_confirmed = 0
+        self.reverted = 0
+        self.dropped = 0
+        self.fee_wei = 0
+        self.started_at = time.time()
+        self.sending_done_at = None
+        self.finished_at = None
+
+    def print(self, skipped, total):
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        sending = (self.sending_done_at or time.time()) - self.started_at
+        print("\nPayout report")
+        print(f"- Rows: {total}, already paid before this run: {skipped}")
+        print(f"- Transactions sent: {self.transactions_sent} ({self.transfers_sent} transfers)")
+        print(f"- Confirmed: {self.confirmed} ({self.transfers_confirmed} transfers)")
+        print(f"- Reverted (will be retried by a rerun): {self.reverted}")
+        print(f"- Dropped by the node (will be retried by a rerun): {self.dropped}")
+        pending = self.transactions_sent - self.confirmed - self.reverted - self.dropped
+        print(f"- Still pending: {pending}")
+        if sending > 0:
+            print(f"- Submission rate: {self.transactions_sent / sending:.2f} tx/s")
+        if elapsed > 0:
+            print(
+                f"- Achieved throughput: {self.confirmed / elapsed:.2f} tx/s, "
+                f"{self.transfers_confirmed / elapsed:.2f} transfers/s"
+            )
+        print(f"- Total fee: {Web3.from_wei(self.fee_wei, 'ether')} ETH")
+
+
+class BatchPayout:
+    def __init__(
+        self,
+        w3,
+        private_key,
+        journal,
+        rate=5.0,
+        disperse_address=None,
+        batch_size=100,
+        confirmations=1,
+        urgency="standard",
+    ):
+        """Batch USDC payout engine
+
+        Args:
+            w3: Web3 instance
+            private_key: Private key of the paying account
+            journal: PayoutJournal
+            rate: Transactions submitted per second
+            disperse_address: Pay batch_size recipients per transaction
+                through this Disperse contract (default: one transfer each)
+            batch_size: Recipients per Disperse transaction
+            confirmations: Confirmation depth before a payout counts as final
+            urgency: Fee level of the transactions, "slow", "standard" or "fast"
+        """
+        self.w3 = w3
+        self.account = Account.from_key(private_key)
+        self.journal = journal
+        self.rate = rate
+        self.disperse_address = disperse_address
+        self.batch_size = batch_size if disperse_address else 1
+        self.chain_id = w3.eth.chain_id
+        self.nonce_manager = get_nonce_manager(w3, self.account.address)
+        self.tracker = get_confirmation_tracker(w3, confirmations)
+        self.usdc = get_contract(w3, USDC_ADDRESS, ERC20_READ_ABI)
+        self.report = PayoutReport()
+        self.futures = []
+        # Fees come from the endpoint's cached fee history, not one RPC per
+        # transaction
+        self.fee_oracle = get_fee_oracle(w3)
+        self.urgency = urgency
+        self.transfer_gas = None
+
+    def current_fee_fields(self):
+        return self.fee_oracle.fee_fields(self.urgency)
+
+    def _on_receipt(self, tx_hash, transfers, future, recorded):
+        try:
+            self._record_receipt(tx_hash, transfers, future.result())
+        except Exception as e:
+            print(f"Confirmation of {tx_hash} failed: {str(e)}")
+        finally:
+            recorded.set_result(tx_hash)
+
+    def _record_receipt(self, tx_hash, transfers, receipt):
+        fee_wei = receipt["gasUsed"] * receipt.get("effectiveGasPrice", 0)
+        status = "confirmed" if receipt["status"] == 1 else "reverted"
+        self.journal.record_status(tx_hash, status, receipt["blockNumber"], fee_wei)
+        self.nonce_manager.mark_confirmed(receipt["transactionHash"])
+        with self.report.lock:
+            self.report.fee_wei += fee_wei
+            if status == "confirmed":
+                self.report.confirmed += 1
+                self.report.transfers_confirmed += transfers
+            else:
+                self.report.reverted += 1
+                print(f"Transaction {tx_hash} reverted, its rows stay unpaid")
+
+    def _track(self, tx_hash, transfers, mined_before=False):
+        # Resolved once the receipt is in the journal and the report
+        recorded = Future()
+        self.futures.append(recorded)
+        self.tracker.track(
+            tx_hash,
+            callback=lambda future: self._on_receipt(tx_hash, transfers, future, recorded),
+            mined_before=mined_before,
+        )
+
+    def resume(self):
+        """Rebroadcast journaled transactions that were not seen mined
+
+        The same signed bytes are sent again, so each one can be mined at most
+        once whatever happened before the crash.
+        """
+        unfinished = self.journal.unfinished()
+        if not unfinished:
+            return
+        print(f"Resuming {len(unfinished)} journaled transactions...")
+        for tx_hash, raw_transaction, payout_keys in unfinished:
+            try:
+                self.w3.eth.send_raw_transaction(raw_transaction)
+            except Exception as e:
+                # Already in the mempool or already mined (nonce used), the
+                # tracker finds its receipt either way
+                if not error_matches(e, ALREADY_KNOWN_ERRORS + NONCE_TOO_LOW_ERRORS):
+                    print(f"Rebroadcast of {tx_hash} failed: {str(e)}")
+            # Possibly mined long ago, before the blocks the tracker scans
+            self._track(tx_hash, len(payout_keys), mined_before=True)
+            with self.report.lock:
+                self.report.transactions_sent += 1
+                self.report.transfers_sent += len(payout_keys)
+        # Rebroadcast transactions moved the chain nonce
+        self.nonce_manager.resync()
+
+    def _build(self, payouts):
+        if self.disperse_address is None:
+            (payout,) = payouts
+            return build_usdc_transfer(
+                self.w3,
+                payout.address,
+                payout.amount,
+                gas=self.transfer_gas,
+                fee_fields=self.current_fee_fields(),
+                chain_id=self.chain_id,
+            )
+        disperse = get_contract(self.w3, self.disperse_address, DISPERSE_ABI)
+        call = disperse.functions.disperseToken(
+            USDC_ADDRESS,
+            [payout.address for payout in payouts],
+            [payout.amount for payout in payouts],
+        )
+        gas = call.estimate_gas({"from": self.account.address})
+        return call.build_transaction(
+            {
+                "from": self.account.address,
+                "nonce": 0,
+                "gas": int(gas * 1.2) + NEW_HOLDER_GAS * len(payouts),
+                **self.current_fee_fields(),
+                "chainId": self.chain_id,
+            }
+        )
+
+    def _send(self, transaction, payouts):
+        """Journal, then broadcast one transaction, returns False to stop"""
+        while True:
+            nonce = self.nonce_manager.allocate()
+            signed_txn = self.account.sign_transaction(dict(transaction, nonce=nonce))
+            tx_hash = Web3.to_hex(signed_txn.hash)
+            self.journal.record_signed(
+                tx_hash,
+                nonce,
+                Web3.to_hex(signed_txn.raw_transaction),
+                [payout.key for payout in payouts],
+            )
+            try:
+                self.w3.eth.send_raw_transaction(signed_txn.raw_transaction)
+            except Exception as e:
+                if error_matches(e, NONCE_TOO_LOW_ERRORS + REJECTED_ERRORS):
+                    # The node did not take it, its rows are still unpaid
+                    self.journal.record_status(tx_hash, "dropped")
+                    if error_matches(e, NONCE_TOO_LOW_ERRORS):
+                        self.nonce_manager.resync()
+                        continue
+                    self.nonce_manager.release(nonce)
+                    print(f"Sending failed, stopping: {str(e)}")
+                    return False
+                if not error_matches(e, ALREADY_KNOWN_ERRORS):
+                    # Timeout, reset connection, router failure: the node may
+                    # have it, so it stays signed and is tracked; a rerun
+                    # rebroadcasts it if it never lands
+                    print(f"Sending {tx_hash} failed, tracking it anyway: {str(e)}")
+            self.nonce_manager.mark_sent(nonce, signed_txn.hash)
+            self._track(tx_hash, len(payouts))
+            with self.report.lock:
+                self.report.transactions_sent += 1
+                self.report.transfers_sent += len(payouts)
+            return True
+
+    def _approve_disperse(self, total):
+        allowance = self.usdc.functions.allowance(
+            self.account.address, self.disperse_address
+        ).call()
+        if allowance >= total:
+            return
+        print(f"Approving {total / 10**USDC_DECIMALS} USDC for Disperse...")
+        transaction = {
+            "from": self.account.address,
+            "to": USDC_ADDRESS,
+            "data": encode_approve(self.disperse_address, total),
+            "nonce": 0,
+            "gas": 100000,
+            **self.current_fee_fields(),
+            "chainId": self.chain_id,
+        }
+        tx_hash = send_with_nonce(self.nonce_manager, transaction, self.account.key)
+        # Disperse gas is estimated against the approved allowance
+        receipt = self.tracker.wait(tx_hash, nonce_manager=self.nonce_manager)
+        self.nonce_manager.mark_confirmed(tx_hash)
+        if receipt["status"] != 1:
+            raise Exception(f"Approval transaction {tx_hash.hex()} reverted")
+
+    def run(self, payouts, confirm_timeout=300):
+        """Pay every row not paid by an earlier run
+
+        Returns:
+            PayoutReport
+        """
+        self.report.started_at = time.time()
+        self.resume()
+        paid = self.journal.paid_keys()
+        todo = [payout for payout in payouts if payout.key not in paid]
+        total = sum(payout.amount for payout in todo)
+        print(f"{len(todo)} of {len(payouts)} rows to pay, {total / 10**USDC_DECIMALS} USDC")
+        if todo:
+            balance = self.usdc.functions.balanceOf(self.account.address).call()
+            if balance < total:
+                raise Exception(
+                    f"Insufficient USDC balance. Required: {total / 10**USDC_DECIMALS}, "
+                    f"Current balance: {balance / 10**USDC_DECIMALS}"
+                )
+            if self.disperse_address is not None:
+                self._approve_disperse(total)
+            else:
+                gas = self.w3.eth.estimate_gas(
+                    {
+                        "from": self.account.address,
+                        "to": USDC_ADDRESS,
+                        "data": encode_transfer(todo[0].address, todo[0].amount),
+                    }
+                )
+                self.transfer_gas = int(gas * 1.2) + NEW_HOLDER_GAS
+
+        interval = 1 / self.rate
+        next_send_at = time.time()
+        for start in range(0, len(todo), self.batch_size):
+            delay = next_send_at - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            next_send_at = max(next_send_at, time.time() - interval) + interval
+            payouts_in_tx = todo[start : start + self.batch_size]
+            if not self._send(self._build(payouts_in_tx), payouts_in_tx):
+                break
+        self.report.sending_done_at = time.time()
+
+        print("All transactions sent, waiting for confirmations...")
+        deadline = time.time() + confirm_timeout
+        for future in self.futures:
+            try:
+                future.result(timeout=max(0, deadline - time.time()))
+            except Exception:
+                pass
+        if not all(future.done() for future in self.futures):
+            # Transactions the node dropped leave their rows unpaid and their
+            # nonces free for the next run
+            dropped = self.nonce_manager.reconcile()
+            for _, tx_hash in dropped:
+                print(f"Transaction {Web3.to_hex(tx_hash)} was dropped, its rows stay unpaid")
+                self.journal.record_status(Web3.to_hex(tx_hash), "dropped")
+            with self.report.lock:
+                self.report.dropped += len(dropped)
+            self.tracker.fail_dropped(dropped)
+        self.report.finished_at = time.time()
+        self.report.print(len(payouts) - len(todo), len(payouts))
+        return self.report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pay USDC to every (address, amount) row of a CSV")
+    parser.add_argument("csv_path")
+    parser.add_argument("--rpc-url", default=RPC_URL, help="endpoint, or url1,url2,... to route over several")
+    parser.add_argument("--rate", type=float, default=5.0, help="transactions per second")
+    parser.add_argument("--journal", help="journal path (default: <csv>.journal.db)")
+    parser.add_argument("--disperse", action="store_true", help="pay many recipients per transaction")
+    parser.add_argument("--disperse-address", default=DISPERSE_ADDRESS)
+    parser.add_argument("--batch-size", type=int, default=100, help="recipients per Disperse transaction")
+    parser.add_argument("--confirmations", type=int, default=1)
+    parser.add_argument("--confirm-timeout", type=float, default=300)
+    parser.add_argument("--urgency", choices=["slow", "standard", "fast"], default="standard")
+    args = parser.parse_args()
+
+    private_key = os.environ.get("PRIVATE_KEY")
+    if not private_key:
+        raise Exception("Set the paying account's private key in PRIVATE_KEY")
+
+    w3 = get_batching_web3(args.rpc_url)
+    payouts = load_payouts(args.csv_path)
+    journal = PayoutJournal(args.journal or f"{args.csv_path}.journal.db")
+    BatchPayout(
+        w3,
+        private_key,
+        journal,
+        rate=args.rate,
+        disperse_address=Web3.to_checksum_address(args.disperse_address) if args.disperse else None,
+        batch_size=args.batch_size,
+        confirmations=args.confirmations,
+        urgency=args.urgency,
+    ).run(payouts, args.confirm_timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import itertools
+import json
+import threading
+import time
+
+from web3.providers.base import JSONBaseProvider
+
+from rpc_metrics import instrument_web3
+from rpc_router import HttpTransport, get_router, is_routed
+
+
+class BatchingHTTPProvider(JSONBaseProvider):
+    def __init__(
+        self,
+        endpoint_uri,
+        batch_window=0.002,
+        max_batch_size=50,
+        pool_size=8,
+        timeout=30,
+    ):
+        """Drop-in for Web3.HTTPProvider that merges concurrent calls into batches
+
+        Calls made within batch_window seconds of each other, from any thread,
+        go to the node as one JSON-RPC batch array (DataLoader style). Every
+        caller gets its own response back, so an error only fails the call it
+        belongs to. Batches are posted over a pooled keep-alive connection.
+
+        Usage: w3 = Web3(BatchingHTTPProvider(rpc_url))
+
+        Args:
+            endpoint_uri: RPC URL, "url1,url2,..." routes the batches over
+                the endpoints (rpc_router.py)
+            batch_window: Seconds the first call of a batch waits for others
+            max_batch_size: Most calls per batch, a full batch is sent at once
+            pool_size: Connections kept open (batches in flight at once)
+            timeout: HTTP timeout in seconds
+        """
+        super().__init__()
+        self.endpoint_uri = endpoint_uri
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        if is_routed(endpoint_uri):
+            self.transport = get_router(endpoint_uri, "evm")
+        else:
+            self.transport = HttpTransport(endpoint_uri, pool_size, timeout)
+        self.executor = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="rpc-batch"
+        )
+        self.ids = itertools.count()
+        self.condition = threading.Condition()
+        # (request dict, Future) waiting for the next batch
+        self.queue = []
+        self.batch_started_at = None
+        self.dispatcher = threading.Thread(
+            target=self._dispatch, name="rpc-batcher", daemon=True
+        )
+        self.dispatcher.start()
+
+    def __str__(self):
+        return f"Batching RPC connection {self.endpoint_uri}"
+
+    def is_connected(self, show_traceback=False):
+        try:
+            return "result" in self.make_request("web3_clientVersion", [])
+        except Exception:
+            if show_traceback:
+                raise
+            return False
+
+    def make_request(self, method, params):
+        future = Future()
+        request = {
+            "jsonrpc": "2.0",
+            "method": method,
+            "params": params or [],
+            "id": next(self.ids),
+        }
+        with self.condition:
+            if not self.queue:
+                self.batch_started_at = time.monotonic()
+            self.queue.append((request, future))
+            self.condition.notify()
+        return future.result()
+
+    def make_batch_request(self, batch_requests):
+        """An explicit web3 batch (w3.batch_requests()) is sent as it is"""
+        requests_ = [
+            {"jsonrpc": "2.0", "method": method, "params": params or [], "id": next(self.ids)}
+            for method, params in batch_requests
+        ]
+        responses = self._post(requests_)
+        if isinstance(responses, dict):
+            return responses
+        by_id = {response.get("id"): response for response in responses}
+        return [by_id.get(request["id"], _missing(request)) for request in requests_]
+
+    def _dispatch(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                while len(self.queue) < self.max_batch_size:
+                    remaining = self.batch_started_at + self.batch_window - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch = self.queue[: self.max_batch_size]
+                self.queue = self.queue[self.max_batch_size :]
+                if self.queue:
+                    self.batch_started_at = time.monotonic()
+            self.executor.submit(self._send_batch, batch)
+
+    def _post(self, payload):
+        return json.loads(self.transport.post(json.dumps(payload).encode()))
+
+    def _send_batch(self, batch):
+        try:
+            if len(batch) == 1:
+                request, future = batch[0]
+                future.set_result(self._post(request))
+                return
+            responses = self._post([request for request, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        if isinstance(responses, dict):
+            # The node rejected the whole batch (e.g. rate limit), every call
+            # gets that error under its own id
+            for request, future in batch:
+                future.set_result(dict(responses, id=request["id"]))
+            return
+        by_id = {response.get("id"): response for response in responses}
+        for request, future in batch:
+            future.set_result(by_id.get(request["id"], _missing(request)))
+
+
+def _missing(request):
+    return {
+        "jsonrpc": "2.0",
+        "id": request["id"],
+        "error": {"code": -32603, "message": "No response for this call in the batch"},
+    }
+
+
+_web3s = {}
+_web3s_lock = threading.Lock()
+
+
+def get_batching_web3(endpoint_uri):
+    """Process wide Web3 on a BatchingHTTPProvider, one per endpoint
+
+    Every script and client on the endpoint shares it, so their calls land in
+    the same batches and connection pool.
+    """
+    from web3 import Web3
+
+    with _web3s_lock:
+        w3 = _web3s.get(endpoint_uri)
+        if w3 is None:
+            w3 = _web3s[endpoint_uri] = instrument_web3(
+                Web3(BatchingHTTPProvider(endpoint_uri))
+            )
+        return w3
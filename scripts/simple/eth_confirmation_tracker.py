@@ -0,0 +1,321 @@
+from concurrent.futures import Future, TimeoutError
+import asyncio
+import threading
+
+from web3 import Web3
+from web3.exceptions import BlockNotFound, TimeExhausted
+
+from rpc_metrics import instrument_web3
+from rpc_router import web3_provider
+
+
+def _to_hex(tx_hash):
+    if isinstance(tx_hash, str):
+        return Web3.to_hex(hexstr=tx_hash)
+    return Web3.to_hex(tx_hash)
+
+
+class ConfirmationTracker:
+    def __init__(self, w3, confirmations=1, poll_interval=1.0, reorg_window=64):
+        """Resolve many pending transactions by following blocks once
+
+        A background thread polls the block number, and every new block is
+        read once: its header (hash, parent hash, transaction hashes) and,
+        when it holds tracked transactions, its receipts via
+        eth_getBlockReceipts (batched eth_getTransactionReceipt on nodes
+        without it). The number of requests grows with blocks, not with the
+        number of transactions waited for.
+
+        Args:
+            w3: Web3 instance (sync)
+            confirmations: Blocks on top of and including the inclusion block
+                before a transaction counts as confirmed (1 = mined)
+            poll_interval: Seconds between block number polls
+            reorg_window: Number of recent block hashes kept to detect reorgs
+        """
+        self.w3 = w3
+        self.confirmations = confirmations
+        self.poll_interval = poll_interval
+        self.reorg_window = reorg_window
+        self.lock = threading.Lock()
+        # tx_hash -> Future, waiting to be included
+        self.pending = {}
+        # tx_hashes mined before they were tracked, looked up directly
+        self.new_hashes = set()
+        # tx_hash -> receipt, included but not deep enough yet
+        self.included = {}
+        # block number -> block hash / transaction hashes of the blocks scanned
+        self.block_hashes = {}
+        self.block_transactions = {}
+        self.last_block = None
+        self.block_receipts_supported = True
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def track(self, tx_hash, callback=None, mined_before=False):
+        """Start tracking a transaction
+
+        Args:
+            tx_hash: Transaction hash
+            callback: Called with the Future once the transaction is confirmed
+                (or failed), from the tracker thread
+            mined_before: The transaction may be in a block older than the
+                ones scanned (e.g. sent by an earlier run), its receipt is
+                looked up directly
+
+        Returns:
+            concurrent.futures.Future resolving to the receipt
+        """
+        tx_hash = _to_hex(tx_hash)
+        with self.lock:
+            future = self.pending.get(tx_hash)
+            if future is None and tx_hash in self.included:
+                future = self.included[tx_hash][1]
+            if future is None:
+                future = Future()
+                self.pending[tx_hash] = future
+                # Before the first scan any hash may already be mined, later
+                # only the ones in blocks scanned before they were tracked
+                if mined_before or self.last_block is None or any(
+                    tx_hash in transactions
+                    for transactions in self.block_transactions.values()
+                ):
+                    self.new_hashes.add(tx_hash)
+        if callback is not None:
+            future.add_done_callback(callback)
+        self._ensure_running()
+        return future
+
+    def wait(self, tx_hash, timeout=120, nonce_manager=None):
+        """Block until the transaction is confirmed, like wait_for_transaction_receipt
+
+        Args:
+            tx_hash: Transaction hash
+            timeout: Seconds to wait
+            nonce_manager: NonceManager that sent the transaction, reconciled
+                on timeout so a transaction the node dropped frees its nonce
+
+        Raises:
+            TimeExhausted: when it is not confirmed within timeout seconds
+        """
+        future = self.track(tx_hash)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            if nonce_manager is not None:
+                self.fail_dropped(nonce_manager.reconcile())
+            if future.done():
+                # Dropped by the node, or confirmed meanwhile
+                return future.result()
+            raise TimeExhausted(
+                f"Transaction {_to_hex(tx_hash)} is not in the chain after {timeout} seconds"
+            )
+
+    async def wait_async(self, tx_hash, timeout=120, nonce_manager=None):
+        """Same as wait() without blocking the event loop, nonce_manager is
+        one created with an AsyncWeb3 instance"""
+        tracked = self.track(tx_hash)
+        future = asyncio.wrap_future(tracked)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if nonce_manager is not None:
+                self.fail_dropped(await nonce_manager.reconcile_async())
+            if tracked.done():
+                return await future
+            raise TimeExhausted(
+                f"Transaction {_to_hex(tx_hash)} is not in the chain after {timeout} seconds"
+            )
+
+    def fail_dropped(self, dropped):
+        """Stop tracking transactions NonceManager.reconcile() found dropped
+
+        Their Futures fail with TimeExhausted, so callbacks and waiters do not
+        wait for a transaction that can no longer be mined.
+
+        Args:
+            dropped: List of (nonce, tx_hash)
+        """
+        for _, tx_hash in dropped:
+            tx_hash = _to_hex(tx_hash)
+            with self.lock:
+                future = self.pending.pop(tx_hash, None)
+                self.new_hashes.discard(tx_hash)
+            if future is not None and not future.done():
+                future.set_exception(
+                    TimeExhausted(f"Transaction {tx_hash} was dropped by the node")
+                )
+
+    def _ensure_running(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stopped.clear()
+                self.thread = threading.Thread(
+                    target=self._run, name="confirmation-tracker", daemon=True
+                )
+                self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Confirmation tracker poll failed: {str(e)}")
+            with self.lock:
+                idle = not self.pending and not self.included
+            if idle:
+                # Nothing to follow, the next track() starts a new thread which
+                # looks its hashes up directly instead of scanning old blocks
+                with self.lock:
+                    if not self.pending and not self.included:
+                        self.thread = None
+                        self.last_block = None
+                        self.block_hashes.clear()
+                        self.block_transactions.clear()
+                        return
+            self.stopped.wait(self.poll_interval)
+
+    def poll(self):
+        """Scan new blocks once, resolving every tracked transaction they hold"""
+        head = self.w3.eth.block_number
+        self._check_new_hashes()
+        if self.last_block is None:
+            self.last_block = head - 1
+        number = self.last_block + 1
+        while number <= head:
+            block = self.w3.eth.get_block(number)
+            parent_hash = self.block_hashes.get(number - 1)
+            if parent_hash is not None and block["parentHash"] != parent_hash:
+                number = self._rewind(number - 1)
+                continue
+            self._scan_block(block)
+            with self.lock:
+                self.block_hashes[number] = block["hash"]
+                self.block_hashes.pop(number - self.reorg_window, None)
+                self.last_block = number
+            number += 1
+        self._resolve_confirmed(head)
+
+    def _check_new_hashes(self):
+        # One batch for every hash tracked since the last poll, catches
+        # transactions mined before the tracker saw their block
+        with self.lock:
+            new_hashes = list(self.new_hashes)
+            self.new_hashes.clear()
+        if new_hashes:
+            self._store_receipts(self._fetch_receipts(new_hashes))
+
+    def _fetch_receipts(self, tx_hashes):
+        # Raw batch first, a missing receipt would fail a formatted batch
+        responses = self.w3.provider.make_batch_request(
+            [("eth_getTransactionReceipt", [tx_hash]) for tx_hash in tx_hashes]
+        )
+        if not isinstance(responses, list):
+            # The whole batch failed, the node answered with a single error
+            raise Exception(f"Receipt batch failed: {responses}")
+        mined = [
+            tx_hash
+            for tx_hash, response in zip(tx_hashes, responses)
+            if response.get("result")
+        ]
+        if not mined:
+            return []
+        with self.w3.batch_requests() as batch:
+            for tx_hash in mined:
+                batch.add(self.w3.eth.get_transaction_receipt(tx_hash))
+            return batch.execute()
+
+    def _scan_block(self, block):
+        number = block["number"]
+        transactions = set(map(Web3.to_hex, block["transactions"]))
+        # Together, so a hash tracked after this is either picked here or
+        # found in block_transactions by track() and looked up directly
+        with self.lock:
+            self.block_transactions[number] = transactions
+            self.block_transactions.pop(number - self.reorg_window, None)
+            tracked = [tx_hash for tx_hash in transactions if tx_hash in self.pending]
+        if not tracked:
+            return
+        if self.block_receipts_supported:
+            try:
+                self._store_receipts(self.w3.eth.get_block_receipts(number))
+                return
+            except BlockNotFound:
+                # Reorged away since its header was read, the parent hash
+                # check rescans the replacement block
+                return
+            except Exception as e:
+                print(f"eth_getBlockReceipts failed, using batched lookups: {str(e)}")
+                self.block_receipts_supported = False
+        self._store_receipts(self._fetch_receipts(tracked))
+
+    def _store_receipts(self, receipts):
+        with self.lock:
+            for receipt in receipts:
+                tx_hash = Web3.to_hex(receipt["transactionHash"])
+                future = self.pending.pop(tx_hash, None)
+                if future is not None:
+                    self.included[tx_hash] = (receipt, future)
+
+    def _rewind(self, number):
+        """Walk back to the last block still on the canonical chain"""
+        while True:
+            with self.lock:
+                known_hash = self.block_hashes.get(number)
+            if known_hash is None or self.w3.eth.get_block(number)["hash"] == known_hash:
+                break
+            with self.lock:
+                self.block_hashes.pop(number, None)
+                self.block_transactions.pop(number, None)
+            number -= 1
+        print(f"Chain reorganization detected, rescanning from block {number + 1}")
+        with self.lock:
+            for tx_hash, (receipt, future) in list(self.included.items()):
+                if receipt["blockNumber"] > number:
+                    del self.included[tx_hash]
+                    self.pending[tx_hash] = future
+                    self.new_hashes.add(tx_hash)
+            self.last_block = number
+        return number + 1
+
+    def _resolve_confirmed(self, head):
+        with self.lock:
+            confirmed = [
+                (tx_hash, receipt, future)
+                for tx_hash, (receipt, future) in self.included.items()
+                if head - receipt["blockNumber"] + 1 >= self.confirmations
+            ]
+            for tx_hash, _, _ in confirmed:
+                del self.included[tx_hash]
+        for _, receipt, future in confirmed:
+            if not future.done():
+                future.set_result(receipt)
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def get_confirmation_tracker(w3, confirmations=1, poll_interval=1.0):
+    """Process wide tracker of an RPC endpoint, shared by every script
+
+    Works for Web3 and AsyncWeb3 instances, the tracker follows blocks with
+    its own sync Web3 on the same endpoint. The settings only apply when the
+    tracker of an endpoint is created.
+    """
+    endpoint = getattr(w3.provider, "endpoint_uri", None)
+    key = (str(endpoint or id(w3.provider)), confirmations)
+    with _trackers_lock:
+        tracker = _trackers.get(key)
+        if tracker is None:
+            if endpoint is not None:
+                tracker_w3 = instrument_web3(Web3(web3_provider(endpoint)))
+            else:
+                tracker_w3 = w3
+            tracker = _trackers[key] = ConfirmationTracker(
+                tracker_w3, confirmations, poll_interval
+            )
+        return tracker
@@ -0,0 +1,208 @@
+from collections import namedtuple
+import asyncio
+import statistics
+import threading
+import time
+
+from eth_abi import encode
+from web3 import Web3
+
+from rpc_metrics import instrument_web3
+from rpc_router import web3_provider
+
+# Reward percentile of recent blocks paid as priority fee, per urgency
+URGENCY_PERCENTILES = {"slow": 10, "standard": 50, "fast": 90}
+# Full blocks the max fee must stay valid through (+12.5% base fee each)
+URGENCY_BASE_FEE_BLOCKS = {"slow": 1, "standard": 3, "fast": 6}
+
+# OP Stack GasPriceOracle predeploy (Base, Optimism), charges the L1 data fee
+GAS_PRICE_ORACLE_ADDRESS = Web3.to_checksum_address(
+    "0x420000000000000000000000000000000000000F"
+)
+GET_L1_FEE = Web3.keccak(text="getL1Fee(bytes)")[:4]
+
+FeeEstimate = namedtuple(
+    "FeeEstimate", ["max_fee_per_gas", "max_priority_fee_per_gas", "base_fee_per_gas"]
+)
+
+
+class FeeOracle:
+    def __init__(self, w3, block_count=20, ttl=12.0, poll_interval=4.0, idle_timeout=60.0):
+        """EIP-1559 fee estimates from a cached eth_feeHistory
+
+        One eth_feeHistory call returns the next block's base fee and the
+        10th/50th/90th reward percentiles of recent blocks. While the oracle
+        is in use a background thread refreshes it every poll_interval, so
+        building a transaction needs no fee RPC. Nodes without EIP-1559 fall
+        back to a cached eth_gasPrice.
+
+        Args:
+            w3: Web3 instance (sync)
+            block_count: Blocks of history the tip percentiles are taken over
+            ttl: Seconds an estimate is served before a blocking refresh
+            poll_interval: Seconds between background refreshes
+            idle_timeout: Seconds without estimates after which the thread stops
+        """
+        self.w3 = w3
+        self.block_count = block_count
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        # urgency -> FeeEstimate, None while unknown or on a legacy chain
+        self.estimates = None
+        self.gas_price = None
+        self.legacy = False
+        self.updated_at = 0
+        self.used_at = 0
+        self.thread = None
+
+    def refresh(self):
+        """Read the fee history once and recompute every urgency level"""
+        percentiles = sorted(URGENCY_PERCENTILES.values())
+        try:
+            history = self.w3.eth.fee_history(self.block_count, "latest", percentiles)
+            base_fee = history["baseFeePerGas"][-1]
+        except Exception as e:
+            # Legacy chain or node without eth_feeHistory
+            if not self.legacy:
+                print(f"eth_feeHistory unavailable, using eth_gasPrice: {str(e)}")
+            gas_price = self.w3.eth.gas_price
+            with self.lock:
+                self.legacy = True
+                self.estimates = None
+                self.gas_price = gas_price
+                self.updated_at = time.time()
+            return
+
+        rewards = [block for block in history.get("reward") or [] if block]
+        estimates = {}
+        for urgency, percentile in URGENCY_PERCENTILES.items():
+            index = percentiles.index(percentile)
+            # Median over blocks, one block of outliers does not move it
+            tip = int(statistics.median(block[index] for block in rewards)) if rewards else 0
+            blocks = URGENCY_BASE_FEE_BLOCKS[urgency]
+            max_base_fee = base_fee * 9**blocks // 8**blocks
+            estimates[urgency] = FeeEstimate(max_base_fee + tip, tip, base_fee)
+        with self.lock:
+            self.legacy = False
+            self.estimates = estimates
+            self.gas_price = None
+            self.updated_at = time.time()
+
+    def _is_stale(self):
+        return time.time() - self.updated_at > self.ttl
+
+    def _ensure_running(self):
+        with self.lock:
+            self.used_at = time.time()
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self._run, name="fee-oracle", daemon=True
+                )
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self.lock:
+                if time.time() - self.used_at > self.idle_timeout:
+                    self.thread = None
+                    return
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Fee oracle refresh failed: {str(e)}")
+
+    def fee_fields(self, urgency="standard"):
+        """Fee fields of a transaction dict
+
+        Args:
+            urgency: "slow", "standard" or "fast"
+
+        Returns:
+            {"type": 2, "maxFeePerGas": ..., "maxPriorityFeePerGas": ...},
+            {"gasPrice": ...} on a chain without EIP-1559
+        """
+        if urgency not in URGENCY_PERCENTILES:
+            raise Exception(f"Unknown urgency {urgency}, use one of {list(URGENCY_PERCENTILES)}")
+        if self._is_stale():
+            self.refresh()
+        self._ensure_running()
+        return self._fields(urgency)
+
+    async def fee_fields_async(self, urgency="standard"):
+        """Same as fee_fields(), a stale cache is refreshed off the event loop"""
+        if urgency not in URGENCY_PERCENTILES:
+            raise Exception(f"Unknown urgency {urgency}, use one of {list(URGENCY_PERCENTILES)}")
+        if self._is_stale():
+            await asyncio.to_thread(self.refresh)
+        self._ensure_running()
+        return self._fields(urgency)
+
+    def _fields(self, urgency):
+        with self.lock:
+            if self.estimates is None:
+                return {"gasPrice": self.gas_price}
+            estimate = self.estimates[urgency]
+        return {
+            "type": 2,
+            "maxFeePerGas": estimate.max_fee_per_gas,
+            "maxPriorityFeePerGas": estimate.max_priority_fee_per_gas,
+        }
+
+
+def max_fee_per_gas(fee_fields):
+    """Highest price per gas a transaction with these fee fields can pay"""
+    return fee_fields.get("maxFeePerGas", fee_fields.get("gasPrice"))
+
+
+def describe_fees(w3, fee_fields):
+    """Human readable fee fields for the scripts' output"""
+    if "maxFeePerGas" in fee_fields:
+        return (
+            f"max fee {w3.from_wei(fee_fields['maxFeePerGas'], 'gwei')} Gwei, "
+            f"tip {w3.from_wei(fee_fields['maxPriorityFeePerGas'], 'gwei')} Gwei"
+        )
+    return f"{w3.from_wei(fee_fields['gasPrice'], 'gwei')} Gwei"
+
+
+def get_l1_fee(w3, raw_transaction):
+    """L1 data fee an OP Stack chain charges for a signed transaction, 0 elsewhere
+
+    The fee is taken from the balance on top of gas, so it has to be kept back
+    when sending a whole balance.
+    """
+    try:
+        result = w3.eth.call(
+            {
+                "to": GAS_PRICE_ORACLE_ADDRESS,
+                "data": GET_L1_FEE + encode(["bytes"], [bytes(raw_transaction)]),
+            }
+        )
+    except Exception:
+        return 0
+    return int.from_bytes(result[:32], "big") if len(result) >= 32 else 0
+
+
+_oracles = {}
+_oracles_lock = threading.Lock()
+
+
+def get_fee_oracle(w3):
+    """Process wide fee oracle of an RPC endpoint, shared by every script
+
+    Works for Web3 and AsyncWeb3 instances, an AsyncWeb3 gets an oracle with
+    its own sync Web3 on the same endpoint.
+    """
+    endpoint = getattr(w3.provider, "endpoint_uri", None)
+    key = str(endpoint or id(w3.provider))
+    with _oracles_lock:
+        oracle = _oracles.get(key)
+        if oracle is None:
+            if isinstance(w3, Web3):
+                oracle_w3 = w3
+            else:
+                oracle_w3 = instrument_web3(Web3(web3_provider(endpoint)))
+            oracle = _oracles[key] = FeeOracle(oracle_w3)
+        return oracle
@@ -0,0 +1,173 @@
+from collections import deque
+import math
+import sqlite3
+import threading
+import time
+
+from web3 import Web3
+
+from eth_token_cache import cache_path
+
+DEFAULT_MODEL_FILE = "gas_model.db"
+
+# A transaction that used this share of its limit may have run out of gas or
+# be close to it, the key is estimated again before the next use
+DRIFT_RATIO = 0.95
+
+
+class GasModel:
+    def __init__(
+        self,
+        path=":memory:",
+        window=50,
+        min_samples=3,
+        percentile=0.99,
+        headroom=0.1,
+    ):
+        """Gas limits learned from the gasUsed of our own receipts
+
+        Samples are kept per key, e.g. (chain, router, "exactInputSingle",
+        tokenIn, tokenOut, fee), in memory and in a SQLite file so a new process
+        starts warm. A warm key gets a limit from the observed percentile plus
+        a small headroom instead of an eth_estimateGas round trip and a blanket
+        20% padding. Keys with too few samples, or whose last transaction came
+        close to its limit, return None so the caller estimates.
+
+        Args:
+            path: SQLite file path, ":memory:" keeps the model in this process
+                only (get_default_gas_model() uses cache_path())
+            window: Most recent samples kept per key
+            min_samples: Samples needed before a key is trusted
+            percentile: Percentile of the samples the limit is based on
+            headroom: Share added on top of that percentile
+        """
+        self.window = window
+        self.min_samples = min_samples
+        self.percentile = percentile
+        self.headroom = headroom
+        self.lock = threading.Lock()
+        # key -> deque of gasUsed, oldest first
+        self.samples = {}
+        self.drifted = set()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS gas_samples (
+                key TEXT NOT NULL,
+                gas_used INTEGER NOT NULL,
+                recorded_at REAL NOT NULL
+            )"""
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS gas_samples_key ON gas_samples (key, recorded_at)"
+        )
+        self.db.commit()
+        for key, gas_used in self.db.execute(
+            "SELECT key, gas_used FROM gas_samples ORDER BY recorded_at"
+        ):
+            self.samples.setdefault(key, deque(maxlen=window)).append(gas_used)
+
+    @staticmethod
+    def key(chain_id, contract, function, *parts):
+        """Model key of a call, parts narrow it down (tokens, fee tier, ...)"""
+        values = [str(int(chain_id)), Web3.to_checksum_address(contract), function]
+        for part in parts:
+            values.append(
+                Web3.to_checksum_address(part) if Web3.is_address(part) else str(part)
+            )
+        return ":".join(values)
+
+    def suggest(self, key):
+        """Gas limit for the key, None when it is cold or drifting"""
+        with self.lock:
+            samples = self.samples.get(key)
+            if key in self.drifted or samples is None or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        # Nearest rank percentile
+        observed = ordered[max(math.ceil(self.percentile * len(ordered)) - 1, 0)]
+        return int(observed * (1 + self.headroom))
+
+    def record(self, key, receipt, gas_limit):
+        """Learn from a receipt of a transaction sent with gas_limit"""
+        gas_used = receipt["gasUsed"]
+        near_limit = gas_used >= gas_limit * DRIFT_RATIO
+        with self.lock:
+            if near_limit:
+                # Out of gas or about to be, the next use estimates again
+                self.drifted.add(key)
+            else:
+                self.drifted.discard(key)
+            if receipt["status"] != 1:
+                # A revert stops early, its gasUsed says nothing about success
+                return
+            self.samples.setdefault(key, deque(maxlen=self.window)).append(gas_used)
+            self.db.execute(
+                "INSERT INTO gas_samples (key, gas_used, recorded_at) VALUES (?, ?, ?)",
+                (key, gas_used, time.time()),
+            )
+            self.db.execute(
+                """DELETE FROM gas_samples WHERE key = ? AND rowid NOT IN (
+                    SELECT rowid FROM gas_samples WHERE key = ?
+                    ORDER BY recorded_at DESC LIMIT ?
+                )""",
+                (key, key, self.window),
+            )
+            self.db.commit()
+
+    def record_when_mined(self, tracker, tx_hash, key, gas_limit):
+        """record() once the ConfirmationTracker sees the transaction, for
+        transactions nobody waits for (e.g. an approval sent ahead of a swap)"""
+
+        def on_done(future):
+            if future.exception() is None:
+                self.record(key, future.result(), gas_limit)
+
+        tracker.track(tx_hash, on_done)
+
+    def limit(self, key, estimate, padding=1.2, default=None):
+        """Learned limit, else estimate() padded, else default
+
+        Args:
+            key: Model key
+            estimate: Callable returning eth_estimateGas, only called when the
+                key is cold or drifting
+            padding: Factor applied to an estimate
+            default: Limit used when estimation fails (None re-raises)
+        """
+        gas_limit = self.suggest(key)
+        if gas_limit is not None:
+            return gas_limit
+        try:
+            return int(estimate() * padding)
+        except Exception as e:
+            if default is None:
+                raise
+            print(f"Gas estimation failed, using default value: {str(e)}")
+            return default
+
+    async def limit_async(self, key, estimate, padding=1.2, default=None):
+        """Same as limit() with estimate returning an awaitable, e.g.
+        lambda: w3.eth.estimate_gas(...) of an AsyncWeb3 instance"""
+        gas_limit = self.suggest(key)
+        if gas_limit is not None:
+            return gas_limit
+        try:
+            return int(await estimate() * padding)
+        except Exception as e:
+            if default is None:
+                raise
+            print(f"Gas estimation failed, using default value: {str(e)}")
+            return default
+
+
+_default_model = None
+_default_model_lock = threading.Lock()
+
+
+def get_default_gas_model():
+    """Process wide gas model shared by the swap and transfer scripts"""
+    global _default_model
+    with _default_model_lock:
+        if _default_model is None:
+            _default_model = GasModel(cache_path(DEFAULT_MODEL_FILE))
+        return _default_model
@@ -0,0 +1,230 @@
+import threading
+import time
+
+from web3.exceptions import TransactionNotFound
+
+from rpc_metrics import span
+
+# Node error messages meaning our local nonce is behind the chain
+NONCE_TOO_LOW_ERRORS = ("nonce too low", "nonce has already been used", "invalid nonce")
+# The node already has this exact transaction, the send itself succeeded
+ALREADY_KNOWN_ERRORS = ("already known", "known transaction", "already imported")
+# The node refused the transaction outright, it can never be mined as signed
+REJECTED_ERRORS = (
+    "insufficient funds",
+    "underpriced",
+    "intrinsic gas too low",
+    "max fee per gas less than block base fee",
+)
+
+
+class NonceManager:
+    def __init__(self, w3, address, dropped_after=120):
+        """Hand out sequential nonces for one account without asking the chain
+
+        The chain nonce ("pending" count) is read once, after that nonces are
+        allocated locally so transactions can be sent back-to-back without
+        waiting for the previous one to be mined. Sent transactions are kept
+        as pending until confirmed, reconcile() notices dropped ones.
+
+        Args:
+            w3: Web3 instance (AsyncWeb3 for allocate_async/send_with_nonce_async)
+            address: Account address
+            dropped_after: Seconds a pending transaction may be missing from
+                the node before reconcile() treats it as dropped
+        """
+        self.w3 = w3
+        self.address = w3.to_checksum_address(address)
+        self.dropped_after = dropped_after
+        self.lock = threading.Lock()
+        self.next_nonce = None
+        # nonce -> (tx_hash, sent_at)
+        self.pending = {}
+
+    def _take(self, chain_nonce=None):
+        with self.lock:
+            if self.next_nonce is None:
+                self.next_nonce = chain_nonce
+            nonce = self.next_nonce
+            self.next_nonce += 1
+            return nonce
+
+    def allocate(self):
+        """Return the next nonce, reading the chain only when not in sync"""
+        if self.next_nonce is None:
+            return self._take(self.w3.eth.get_transaction_count(self.address, "pending"))
+        return self._take()
+
+    async def allocate_async(self):
+        """Same as allocate() for a manager created with an AsyncWeb3 instance"""
+        if self.next_nonce is None:
+            return self._take(
+                await self.w3.eth.get_transaction_count(self.address, "pending")
+            )
+        return self._take()
+
+    def mark_sent(self, nonce, tx_hash):
+        with self.lock:
+            self.pending[nonce] = (tx_hash, time.time())
+
+    def mark_confirmed(self, tx_hash):
+        with self.lock:
+            for nonce, (pending_hash, _) in list(self.pending.items()):
+                if pending_hash == tx_hash:
+                    del self.pending[nonce]
+
+    def release(self, nonce):
+        """Give back a nonce whose transaction was never broadcast
+
+        The last allocated nonce is simply reused, any other one would leave a
+        gap that stalls every later transaction, so the manager resyncs.
+        """
+        with self.lock:
+            if self.next_nonce is not None and nonce == self.next_nonce - 1:
+                self.next_nonce = nonce
+            else:
+                self.next_nonce = None
+
+    def resync(self):
+        """Forget the local nonce, the next allocate() reads it from the chain"""
+        with self.lock:
+            self.next_nonce = None
+
+    def reconcile(self):
+        """Drop confirmed transactions from pending and resync if one was dropped
+
+        Needs a manager created with a sync Web3 instance.
+
+        Returns:
+            List of (nonce, tx_hash) found dropped by the node
+        """
+        stale = self._stale(self.w3.eth.get_transaction_count(self.address, "latest"))
+        dropped = []
+        for nonce, tx_hash in stale:
+            try:
+                self.w3.eth.get_transaction(tx_hash)
+            except TransactionNotFound:
+                dropped.append((nonce, tx_hash))
+        self._drop(dropped)
+        return dropped
+
+    async def reconcile_async(self):
+        """Same as reconcile() for a manager created with an AsyncWeb3 instance"""
+        stale = self._stale(
+            await self.w3.eth.get_transaction_count(self.address, "latest")
+        )
+        dropped = []
+        for nonce, tx_hash in stale:
+            try:
+                await self.w3.eth.get_transaction(tx_hash)
+            except TransactionNotFound:
+                dropped.append((nonce, tx_hash))
+        self._drop(dropped)
+        return dropped
+
+    def _stale(self, mined_nonce):
+        # Forget the mined ones, return those pending for too long
+        with self.lock:
+            for nonce in [nonce for nonce in self.pending if nonce < mined_nonce]:
+                del self.pending[nonce]
+            return [
+                (nonce, tx_hash)
+                for nonce, (tx_hash, sent_at) in self.pending.items()
+                if time.time() - sent_at > self.dropped_after
+            ]
+
+    def _drop(self, dropped):
+        if dropped:
+            with self.lock:
+                for nonce, _ in dropped:
+                    self.pending.pop(nonce, None)
+                self.next_nonce = None
+
+
+def error_matches(error, messages):
+    """True when the node error message contains one of messages"""
+    text = str(error).lower()
+    return any(message in text for message in messages)
+
+
+def send_with_nonce(nonce_manager, transaction, private_key, retries=1):
+    """Fill in the nonce, sign and send a transaction
+
+    On "nonce too low" the manager resyncs with the chain and the transaction
+    is sent again with a fresh nonce (up to `retries` times). A transaction
+    that failed to broadcast gives its nonce back.
+
+    Args:
+        nonce_manager: NonceManager of the sending account
+        transaction: Transaction dict without (or with a stale) nonce
+        private_key: Private key of the sending account
+
+    Returns:
+        Transaction hash
+    """
+    w3 = nonce_manager.w3
+    while True:
+        nonce = nonce_manager.allocate()
+        transaction = dict(transaction, nonce=nonce)
+        with span("sign"):
+            signed_txn = w3.eth.account.sign_transaction(transaction, private_key)
+        try:
+            tx_hash = w3.eth.send_raw_transaction(signed_txn.raw_transaction)
+        except Exception as e:
+            if error_matches(e, ALREADY_KNOWN_ERRORS):
+                tx_hash = signed_txn.hash
+            elif error_matches(e, NONCE_TOO_LOW_ERRORS) and retries > 0:
+                print(f"Nonce {nonce} rejected ({str(e)}), resyncing with the chain")
+                nonce_manager.resync()
+                retries -= 1
+                continue
+            else:
+                nonce_manager.release(nonce)
+                raise
+        nonce_manager.mark_sent(nonce, tx_hash)
+        return tx_hash
+
+
+async def send_with_nonce_async(nonce_manager, transaction, private_key, retries=1):
+    """Same as send_with_nonce() for a manager created with an AsyncWeb3 instance"""
+    w3 = nonce_manager.w3
+    while True:
+        nonce = await nonce_manager.allocate_async()
+        transaction = dict(transaction, nonce=nonce)
+        with span("sign"):
+            signed_txn = w3.eth.account.sign_transaction(transaction, private_key)
+        try:
+            tx_hash = await w3.eth.send_raw_transaction(signed_txn.raw_transaction)
+        except Exception as e:
+            if error_matches(e, ALREADY_KNOWN_ERRORS):
+                tx_hash = signed_txn.hash
+            elif error_matches(e, NONCE_TOO_LOW_ERRORS) and retries > 0:
+                print(f"Nonce {nonce} rejected ({str(e)}), resyncing with the chain")
+                nonce_manager.resync()
+                retries -= 1
+                continue
+            else:
+                nonce_manager.release(nonce)
+                raise
+        nonce_manager.mark_sent(nonce, tx_hash)
+        return tx_hash
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_nonce_manager(w3, address):
+    """Process wide NonceManager of an account, shared by every script
+
+    Managers are keyed by RPC endpoint and address, so two Web3 instances
+    pointing at the same node share the nonce sequence (sync and AsyncWeb3
+    instances get separate managers).
+    """
+    endpoint = getattr(w3.provider, "endpoint_uri", None) or id(w3.provider)
+    key = (type(w3).__name__, str(endpoint), w3.to_checksum_address(address))
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = _managers[key] = NonceManager(w3, address)
+        return manager
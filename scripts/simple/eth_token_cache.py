@@ -0,0 +1,207 @@
+from collections import OrderedDict, namedtuple
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+from web3 import Web3
+
+from eth_abi_codec import get_contract
+from uniswap_multicall import ERC20_READ_ABI, Multicall3, add_token_metadata, read_token_metadata
+
+# Directory of the process-wide on-disk caches (token metadata, pool index,
+# gas model), overridden by this environment variable
+CACHE_DIR_ENV = "WEB3_SCRIPTS_CACHE_DIR"
+DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "web3_scripts")
+DEFAULT_CACHE_FILE = "token_metadata.db"
+
+TokenMetadata = namedtuple("TokenMetadata", ["name", "symbol", "decimals"])
+
+# Returned by callers that allow a fallback when the metadata can not be read.
+# Compare with `is` to tell it apart from a real token.
+FALLBACK_TOKEN_METADATA = TokenMetadata("Unknown", "???", 18)
+
+
+def cache_path(file_name):
+    """Path of an on-disk cache file in the cache directory, created if needed
+
+    The caches live outside the working directory, so running a script does
+    not leave files in the tree.
+    """
+    directory = os.path.expanduser(os.environ.get(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, file_name)
+
+
+class TokenMetadataCache:
+    def __init__(self, path=":memory:", max_memory_entries=4096):
+        """Token name/symbol/decimals cache keyed by (chain_id, token address)
+
+        An in-memory LRU sits in front of a SQLite file, so metadata read once
+        is reused by every later swap and by new processes.
+
+        Args:
+            path: SQLite file path, ":memory:" keeps the cache in this process
+                only (get_default_cache() uses cache_path())
+            max_memory_entries: Size of the in-memory LRU
+        """
+        self.max_memory_entries = max_memory_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS token_metadata (
+                chain_id INTEGER NOT NULL,
+                address TEXT NOT NULL,
+                name TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                decimals INTEGER NOT NULL,
+                PRIMARY KEY (chain_id, address)
+            )"""
+        )
+        self.db.commit()
+
+    def _remember(self, key, metadata):
+        self.memory[key] = metadata
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, chain_id, token_address):
+        """Return cached TokenMetadata or None on a miss"""
+        key = (int(chain_id), Web3.to_checksum_address(token_address))
+        with self.lock:
+            metadata = self.memory.get(key)
+            if metadata is not None:
+                self.memory.move_to_end(key)
+                return metadata
+
+            row = self.db.execute(
+                "SELECT name, symbol, decimals FROM token_metadata WHERE chain_id = ? AND address = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                return None
+            metadata = TokenMetadata(*row)
+            self._remember(key, metadata)
+            return metadata
+
+    def put(self, chain_id, token_address, metadata):
+        """Store metadata read from chain (never store fallback values)"""
+        if metadata is FALLBACK_TOKEN_METADATA:
+            return
+        key = (int(chain_id), Web3.to_checksum_address(token_address))
+        metadata = TokenMetadata(*metadata)
+        with self.lock:
+            self._remember(key, metadata)
+            self.db.execute(
+                "INSERT OR REPLACE INTO token_metadata VALUES (?, ?, ?, ?, ?)",
+                key + tuple(metadata),
+            )
+            self.db.commit()
+
+    def resolve(self, chain_id, token_address, results):
+        """Return cached metadata, or take it from multicall results and cache it
+
+        Raises:
+            Exception: on a cache miss whose reads failed
+        """
+        metadata = self.get(chain_id, token_address)
+        if metadata is None:
+            metadata = TokenMetadata(*read_token_metadata(results, token_address))
+            self.put(chain_id, token_address, metadata)
+        return metadata
+
+    def _split_missing(self, chain_id, token_addresses):
+        found = {}
+        missing = []
+        for token_address in token_addresses:
+            token_address = Web3.to_checksum_address(token_address)
+            metadata = self.get(chain_id, token_address)
+            if metadata is None:
+                missing.append(token_address)
+            else:
+                found[token_address] = metadata
+        return found, missing
+
+    def _queue_missing(self, w3, missing):
+        multicall = Multicall3(w3)
+        for token_address in missing:
+            add_token_metadata(
+                multicall, get_contract(w3, token_address, ERC20_READ_ABI)
+            )
+        return multicall
+
+    def _store_missing(self, chain_id, missing, results, found):
+        for token_address in missing:
+            try:
+                found[token_address] = self.resolve(chain_id, token_address, results)
+            except Exception as e:
+                print(f"Failed to get token info: {str(e)}")
+        return found
+
+    def fetch(self, w3, chain_id, token_addresses):
+        """Return metadata of several tokens, reading all misses in one multicall
+
+        Tokens whose reads failed are left out of the result.
+        """
+        found, missing = self._split_missing(chain_id, token_addresses)
+        if missing:
+            results = self._queue_missing(w3, missing).execute()
+            self._store_missing(chain_id, missing, results, found)
+        return found
+
+    async def fetch_async(self, w3, chain_id, token_addresses):
+        """Same as fetch() for an AsyncWeb3 instance"""
+        found, missing = self._split_missing(chain_id, token_addresses)
+        if missing:
+            results = await self._queue_missing(w3, missing).execute_async()
+            self._store_missing(chain_id, missing, results, found)
+        return found
+
+    def warm_from_token_list(self, path, chain_id=None):
+        """Load a token list file (https://tokenlists.org format)
+
+        Args:
+            path: Token list JSON file
+            chain_id: Only load tokens of this chain (default: all chains)
+
+        Returns:
+            Number of tokens loaded
+        """
+        with open(path) as f:
+            token_list = json.load(f)
+
+        count = 0
+        for token in token_list.get("tokens", []):
+            if chain_id is not None and int(token["chainId"]) != int(chain_id):
+                continue
+            self.put(
+                token["chainId"],
+                token["address"],
+                TokenMetadata(token["name"], token["symbol"], int(token["decimals"])),
+            )
+            count += 1
+        return count
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """Process wide cache shared by UniswapV3 and BaseUniswapV3"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = TokenMetadataCache(cache_path(DEFAULT_CACHE_FILE))
+        return _default_cache
+
+
+if __name__ == "__main__":
+    # Usage: python eth_token_cache.py <token_list.json> [chain_id]
+    token_list_path = sys.argv[1]
+    chain_id = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    count = get_default_cache().warm_from_token_list(token_list_path, chain_id)
+    print(f"Loaded {count} tokens into {cache_path(DEFAULT_CACHE_FILE)}")
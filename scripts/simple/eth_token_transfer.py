@@ -1,57 +1,104 @@
 from web3 import Web3
 from eth_account import Account
-import json
+
+from eth_abi_codec import encode_transfer
+from eth_batching_provider import get_batching_web3
+from eth_confirmation_tracker import get_confirmation_tracker
+from eth_fee_oracle import get_fee_oracle
+from eth_gas_model import get_default_gas_model
+from eth_nonce_manager import get_nonce_manager, send_with_nonce
+from rpc_metrics import span
 
 # Base network RPC URL
 RPC_URL = "https://mainnet.base.org"
-w3 = Web3(Web3.HTTPProvider(RPC_URL))
+w3 = get_batching_web3(RPC_URL)
 
 # USDC contract address on Base
 USDC_ADDRESS = Web3.to_checksum_address("0x833589fCD6eDb6E08f4c7C32D4f71b54bdA02913")
 
-# USDC ABI - minimal for transfer
-USDC_ABI = [
-    {
-        "inputs": [
-            {"name": "to", "type": "address"},
-            {"name": "amount", "type": "uint256"}
-        ],
-        "name": "transfer",
-        "outputs": [{"name": "", "type": "bool"}],
-        "stateMutability": "nonpayable",
-        "type": "function"
+def build_usdc_transfer(web3, to_address, amount_in_wei, gas=100000, fee_fields=None, chain_id=8453):
+    """Build an unsigned USDC transfer, the nonce is left for the nonce manager
+
+    Args:
+        web3: Web3 instance
+        to_address: Recipient address
+        amount_in_wei: Amount in USDC base units (6 decimals)
+        gas: Gas limit
+        fee_fields: Fee fields of the transaction, e.g. from
+            FeeOracle.fee_fields() (default: the standard urgency of the
+            endpoint's fee oracle)
+        chain_id: Chain ID (default: Base mainnet)
+    """
+    if fee_fields is None:
+        fee_fields = get_fee_oracle(web3).fee_fields()
+    # Precompiled calldata, no contract object per transfer
+    return {
+        'to': USDC_ADDRESS,
+        'data': encode_transfer(Web3.to_checksum_address(to_address), amount_in_wei),
+        'value': 0,
+        'nonce': 0,
+        'gas': gas,
+        'chainId': chain_id,
+        **fee_fields
     }
-]
 
-def transfer_usdc(private_key, to_address, amount):
+def transfer_usdc(private_key, to_address, amount, wait=True, gas=None, urgency="standard"):
+    """Transfer USDC
+
+    Args:
+        private_key: Sender private key
+        to_address: Recipient address
+        amount: Amount in USDC
+        wait: Wait for the receipt, with False the transfer is only sent so a
+            burst of transfers goes out back-to-back (nonces come from the
+            local nonce manager)
+        gas: Gas limit (default: learned from earlier transfers)
+        urgency: Fee level, "slow", "standard" or "fast"
+    """
     # Create account from private key
     account = Account.from_key(private_key)
-    
-    # Initialize USDC contract
-    usdc_contract = w3.eth.contract(address=USDC_ADDRESS, abi=USDC_ABI)
-    
-    # Build transaction
-    nonce = w3.eth.get_transaction_count(account.address)
+    nonce_manager = get_nonce_manager(w3, account.address)
     
     # USDC uses 6 decimals
     amount_in_wei = int(amount * 10**6)  # Convert to integer
+
+    # Gas limit learned from earlier transfers, estimated until there are enough
+    with span("gas"):
+        gas_model = get_default_gas_model()
+        gas_key = gas_model.key(8453, USDC_ADDRESS, "transfer")
+        if gas is None:
+            gas = gas_model.limit(
+                gas_key,
+                lambda: w3.eth.estimate_gas(
+                    {
+                        "from": account.address,
+                        "to": USDC_ADDRESS,
+                        "data": encode_transfer(to_address, amount_in_wei),
+                    }
+                ),
+                default=100000,
+            )
     
-    transaction = usdc_contract.functions.transfer(
-        Web3.to_checksum_address(to_address),
-        amount_in_wei
-    ).build_transaction({
-        'nonce': nonce,
-        'gas': 100000,
-        'gasPrice': w3.eth.gas_price,
-        'chainId': 8453  # Base mainnet chain ID
-    })
+    # Build transaction, the nonce is filled in by the nonce manager
+    transaction = build_usdc_transfer(
+        w3, to_address, amount_in_wei, gas, get_fee_oracle(w3).fee_fields(urgency)
+    )
     
     # Sign and send transaction
-    signed_txn = w3.eth.account.sign_transaction(transaction, private_key)
-    tx_hash = w3.eth.send_raw_transaction(signed_txn.raw_transaction)
+    with span("send"):
+        tx_hash = send_with_nonce(nonce_manager, transaction, private_key)
+    if not wait:
+        gas_model.record_when_mined(get_confirmation_tracker(w3), tx_hash, gas_key, gas)
+        print(f"Transaction {tx_hash.hex()} sent")
+        return tx_hash.hex()
     
     print(f"Waiting for transaction {tx_hash.hex()} to be mined...")
-    tx_receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+    with span("confirm"):
+        tx_receipt = get_confirmation_tracker(w3).wait(
+            tx_hash, nonce_manager=nonce_manager
+        )
+    nonce_manager.mark_confirmed(tx_hash)
+    gas_model.record(gas_key, tx_receipt, gas)
     print(f"Transaction successful!")
     print(f"Transaction hash: {tx_receipt['transactionHash'].hex()}")
     print(f"Block number: {tx_receipt['blockNumber']}")
@@ -59,9 +106,10 @@ def transfer_usdc(private_key, to_address, amount):
 
     return tx_hash.hex()
 
-# Example usage:
-private_key = ""
-to_address = ""
-amount = 0.001  # Amount in USDC
-tx_hash = transfer_usdc(private_key, to_address, amount)
-print(f"Transaction hash: {tx_hash}")
+if __name__ == "__main__":
+    # Example usage:
+    private_key = ""
+    to_address = ""
+    amount = 0.001  # Amount in USDC
+    tx_hash = transfer_usdc(private_key, to_address, amount)
+    print(f"Transaction hash: {tx_hash}")
@@ -1,12 +1,17 @@
-from web3 import Web3
 from eth_account import Account
 import os
 
+from eth_batching_provider import get_batching_web3
+from eth_confirmation_tracker import get_confirmation_tracker
+from eth_fee_oracle import describe_fees, get_fee_oracle, get_l1_fee, max_fee_per_gas
+from eth_nonce_manager import get_nonce_manager, send_with_nonce
+from rpc_metrics import span
+
 # Base network RPC URL
 BASE_RPC_URL = "https://mainnet.base.org"
 
 # Initialize Web3
-w3 = Web3(Web3.HTTPProvider(BASE_RPC_URL))
+w3 = get_batching_web3(BASE_RPC_URL)
 
 def generate_wallet():
     """生成新的钱包并保存到文件"""
@@ -15,30 +20,45 @@ def generate_wallet():
         f.write(f"{account.address},{account.key.hex()}\n")
     return account
 
-def transfer_eth_with_fixed_amount(private_key, to_address, amount_in_eth):
-    """执行 ETH 转账"""
+def transfer_eth_with_fixed_amount(private_key, to_address, amount_in_eth, wait=True, urgency="standard"):
+    """执行 ETH 转账
+
+    Args:
+        private_key: 源账户私钥
+        to_address: 目标地址
+        amount_in_eth: 转账金额(ETH)
+        wait: 是否等待交易确认, False 时发送后立即返回交易哈希,
+            nonce 由本地 nonce 管理器分配, 可以连续发送多笔交易
+        urgency: 手续费档位 "slow", "standard" 或 "fast" (EIP-1559)
+    """
     from_account = Account.from_key(private_key)
     amount_in_wei = w3.to_wei(amount_in_eth, 'ether')
+    nonce_manager = get_nonce_manager(w3, from_account.address)
     
-    # Build transaction
+    # Build transaction (nonce 由 nonce 管理器填写)
+    # 手续费来自缓存的 fee history, 不需要额外的 RPC
     transaction = {
-        'nonce': w3.eth.get_transaction_count(from_account.address),
         'to': w3.to_checksum_address(to_address),
         'value': amount_in_wei,
         'gas': 21000,
-        'gasPrice': w3.eth.gas_price,
-        'chainId': 8453  # Base mainnet chain ID
+        'chainId': 8453,  # Base mainnet chain ID
+        **get_fee_oracle(w3).fee_fields(urgency)
     }
     
-    # Sign transaction
-    signed_txn = w3.eth.account.sign_transaction(transaction, private_key)
-    
-    # Send transaction
-    tx_hash = w3.eth.send_raw_transaction(signed_txn.raw_transaction)
+    # Sign and send transaction
+    with span("send"):
+        tx_hash = send_with_nonce(nonce_manager, transaction, private_key)
+    if not wait:
+        print(f"交易已发送, 交易哈希: {tx_hash.hex()}")
+        return tx_hash
     
     # Wait for transaction receipt
     print(f"等待交易确认... 交易哈希: {tx_hash.hex()}")
-    tx_receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+    with span("confirm"):
+        tx_receipt = get_confirmation_tracker(w3).wait(
+            tx_hash, nonce_manager=nonce_manager
+        )
+    nonce_manager.mark_confirmed(tx_hash)
     print(f"交易成功!")
     print(f"交易哈希: {tx_receipt['transactionHash'].hex()}")
     print(f"区块号: {tx_receipt['blockNumber']}")
@@ -46,12 +66,13 @@ def transfer_eth_with_fixed_amount(private_key, to_address, amount_in_eth):
     
     return tx_receipt
 
-def transfer_all_balance(private_key, to_address):
+def transfer_all_balance(private_key, to_address, urgency="standard"):
     """转出账户所有余额
     
     Args:
         private_key: 源账户私钥
         to_address: 目标地址
+        urgency: 手续费档位 "slow", "standard" 或 "fast" (EIP-1559)
     """
     # 创建账户
     from_account = Account.from_key(private_key)
@@ -62,44 +83,52 @@ def transfer_all_balance(private_key, to_address):
     if balance <= 0:
         raise Exception("账户余额不足")
         
-    # 获取当前gas价格
-    gas_price = w3.eth.gas_price
-    print(f"当前gas价格: {w3.from_wei(gas_price, 'ether')} ETH")
+    # 当前手续费 (EIP-1559 最高单价, 多付的部分不会被收取)
+    with span("gas"):
+        fee_fields = get_fee_oracle(w3).fee_fields(urgency)
+    print(f"当前gas价格: {describe_fees(w3, fee_fields)}")
     
-    # 预估gas费用,增加20%的buffer
-    gas = 21000 * 100  # 标准ETH转账gas用量
-    gas_cost = gas * gas_price  # gas费用 = gas用量 * gas价格
-    gas_cost_with_buffer = int(gas_cost * 1.2)  # 增加20%的buffer
-    
-    # 实际可转金额 = 余额 - gas费用(含buffer)
-    amount_to_send = balance - gas_cost_with_buffer
-    print(f"账户余额: {w3.from_wei(balance, 'ether')} ETH")
-    print(f"预估gas费用: {w3.from_wei(gas_cost, 'ether')} ETH")
-    print(f"gas费用(含20%buffer): {w3.from_wei(gas_cost_with_buffer, 'ether')} ETH")
-    print(f"实际可转金额: {w3.from_wei(amount_to_send, 'ether')} ETH")
-
-    if amount_to_send <= 0:
-        raise Exception("余额不足以支付gas费用")
+    # 标准ETH转账gas用量, 最多支付 gas * maxFeePerGas
+    gas = 21000
+    gas_cost = gas * max_fee_per_gas(fee_fields)
     
-    # 构建交易
+    # 构建交易 (nonce 由 nonce 管理器填写)
     transaction = {
-        'nonce': w3.eth.get_transaction_count(from_account.address),
         'to': w3.to_checksum_address(to_address),
-        'value': amount_to_send,
+        'value': max(balance - gas_cost, 0),
         'gas': gas,
-        'gasPrice': gas_price,
-        'chainId': 8453  # Base mainnet chain ID
+        'chainId': 8453,  # Base mainnet chain ID
+        **fee_fields
     }
     
-    # 签名交易
-    signed_txn = w3.eth.account.sign_transaction(transaction, private_key)
+    # Base 额外收取 L1 数据费, 用草稿交易估算, 预留10%应对 L1 费用波动
+    with span("l1_fee"):
+        draft = from_account.sign_transaction(dict(transaction, nonce=0))
+        l1_fee = get_l1_fee(w3, draft.raw_transaction) * 11 // 10
+    
+    # 实际可转金额 = 余额 - gas费用 - L1数据费
+    amount_to_send = balance - gas_cost - l1_fee
+    transaction['value'] = amount_to_send
+    print(f"账户余额: {w3.from_wei(balance, 'ether')} ETH")
+    print(f"最高gas费用: {w3.from_wei(gas_cost, 'ether')} ETH")
+    print(f"L1数据费(含10%buffer): {w3.from_wei(l1_fee, 'ether')} ETH")
+    print(f"实际可转金额: {w3.from_wei(amount_to_send, 'ether')} ETH")
+
+    if amount_to_send <= 0:
+        raise Exception("余额不足以支付gas费用")
     
-    # 发送交易
-    tx_hash = w3.eth.send_raw_transaction(signed_txn.raw_transaction)
+    # 签名并发送交易
+    nonce_manager = get_nonce_manager(w3, from_account.address)
+    with span("send"):
+        tx_hash = send_with_nonce(nonce_manager, transaction, private_key)
     
-    # 等待交易确认
+    # 等待交易确认 (转出全部余额, 必须等确认后余额才准确)
     print(f"等待交易确认... 交易哈希: {tx_hash.hex()}")
-    tx_receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+    with span("confirm"):
+        tx_receipt = get_confirmation_tracker(w3).wait(
+            tx_hash, nonce_manager=nonce_manager
+        )
+    nonce_manager.mark_confirmed(tx_hash)
     print(f"交易成功!")
     print(f"交易哈希: {tx_receipt['transactionHash'].hex()}")
     print(f"区块号: {tx_receipt['blockNumber']}")
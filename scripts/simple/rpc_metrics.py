@@ -0,0 +1,418 @@
+"""RPC and phase latency metrics shared by every script
+
+Every JSON-RPC call of an instrumented web3 or Solana client is counted by
+method and timed into a histogram, and the logical phases of a flow
+(metadata, quote, approve, gas, sign, send, confirm) are timed as spans
+tagged with the function they run in:
+
+    with span("quote"):
+        best_fee, amount_out = self.find_best_pool_fee(...)
+
+Metrics are kept in memory with fixed buckets, a call costs two clock reads,
+a lock and a bisect, so they stay on in production. Export them as
+Prometheus text (to_prometheus(), write(), serve()) or as JSON lines of the
+series (to_json_lines()). With RPC_METRICS_EVENTS=<path> every call and span
+is also appended to a JSON lines event log, RPC_METRICS=0 turns everything
+off.
+
+Usage:
+    from rpc_metrics import get_metrics
+    get_metrics().serve(9464)               # Prometheus scrape endpoint
+    get_metrics().write("metrics.prom")     # or metrics.jsonl
+"""
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import functools
+import inspect
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+try:
+    from web3.middleware import Web3Middleware
+except ImportError:  # Solana only install
+    Web3Middleware = object
+
+# Upper bounds in seconds, from a cached read to a slow confirmation
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """Counts of observations per bucket, plus their count and sum"""
+        self.buckets = buckets
+        # One count per bucket and one for +Inf, not cumulative
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+
+    def observe(self, seconds, error=False):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if error:
+            self.errors += 1
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q quantile (None when empty)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS, enabled=True, events_path=None):
+        """RPC and span histograms of this process
+
+        Args:
+            buckets: Histogram upper bounds in seconds
+            enabled: False makes every observation a no-op
+            events_path: JSON lines file every call and span is appended to
+        """
+        self.buckets = buckets
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        # (client, method) -> Histogram
+        self.rpc = {}
+        # (phase, function) -> Histogram
+        self.spans = {}
+        self.events = open(events_path, "a") if events_path else None
+        self.server = None
+
+    def _observe(self, series, key, seconds, error):
+        with self.lock:
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self.buckets)
+            histogram.observe(seconds, error)
+
+    def _event(self, kind, labels, seconds, error):
+        line = json.dumps(
+            {"ts": time.time(), "kind": kind, **labels, "seconds": seconds, "error": error}
+        )
+        with self.lock:
+            self.events.write(line + "\n")
+
+    def observe_rpc(self, client, method, seconds, error=False):
+        """Record one JSON-RPC call of client ("evm" or "solana")"""
+        if not self.enabled:
+            return
+        self._observe(self.rpc, (client, method), seconds, error)
+        if self.events is not None:
+            self._event("rpc", {"client": client, "method": method}, seconds, error)
+
+    def observe_span(self, phase, function, seconds, error=False):
+        """Record one phase of a flow run by function"""
+        if not self.enabled:
+            return
+        self._observe(self.spans, (phase, function), seconds, error)
+        if self.events is not None:
+            self._event("span", {"phase": phase, "function": function}, seconds, error)
+
+    def span(self, phase, function=None):
+        """Context manager timing a phase, function defaults to the caller's"""
+        if function is None:
+            function = _caller(sys._getframe(1))
+        return Span(self, phase, function)
+
+    def reset(self):
+        with self.lock:
+            self.rpc = {}
+            self.spans = {}
+
+    def flush(self):
+        if self.events is not None:
+            with self.lock:
+                self.events.flush()
+
+    def snapshot(self):
+        """List of series dicts: kind, labels, count, errors, sum, buckets"""
+        with self.lock:
+            series = [
+                ("rpc", {"client": client, "method": method}, histogram)
+                for (client, method), histogram in sorted(self.rpc.items())
+            ] + [
+                ("span", {"phase": phase, "function": function}, histogram)
+                for (phase, function), histogram in sorted(self.spans.items())
+            ]
+            return [
+                {
+                    "kind": kind,
+                    **labels,
+                    "count": histogram.count,
+                    "errors": histogram.errors,
+                    "sum": histogram.sum,
+                    "p50": histogram.percentile(0.5),
+                    "p99": histogram.percentile(0.99),
+                    "buckets": dict(zip([str(bound) for bound in self.buckets] + ["+Inf"], histogram.counts)),
+                }
+                for kind, labels, histogram in series
+            ]
+
+    def to_json_lines(self):
+        """One JSON line per series, stamped with the current time"""
+        now = time.time()
+        return "".join(
+            json.dumps({"ts": now, **series}) + "\n" for series in self.snapshot()
+        )
+
+    def to_prometheus(self):
+        """Prometheus text exposition format"""
+        families = [
+            ("rpc_request_duration_seconds", "JSON-RPC call latency by method", "rpc_requests_errors_total", "JSON-RPC calls answered with an error", self.rpc, ("client", "method")),
+            ("phase_duration_seconds", "Duration of a flow phase by function", "phase_errors_total", "Phases that raised", self.spans, ("phase", "function")),
+        ]
+        lines = []
+        with self.lock:
+            for name, help_text, errors_name, errors_help, series, label_names in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(series.items()):
+                    labels = ",".join(
+                        f'{label}="{_escape(value)}"' for label, value in zip(label_names, key)
+                    )
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+                    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+                    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+                lines.append(f"# HELP {errors_name} {errors_help}")
+                lines.append(f"# TYPE {errors_name} counter")
+                for key, histogram in sorted(series.items()):
+                    labels = ",".join(
+                        f'{label}="{_escape(value)}"' for label, value in zip(label_names, key)
+                    )
+                    lines.append(f"{errors_name}{{{labels}}} {histogram.errors}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write Prometheus text, or JSON lines when path ends with .jsonl or .json"""
+        text = self.to_json_lines() if path.endswith((".jsonl", ".json")) else self.to_prometheus()
+        with open(path, "w") as f:
+            f.write(text)
+
+    def serve(self, port=9464, host="0.0.0.0"):
+        """Serve /metrics in Prometheus format from a daemon thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                data = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
+
+
+class Span:
+    def __init__(self, metrics, phase, function):
+        self.metrics = metrics
+        self.phase = phase
+        self.function = function
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe_span(
+            self.phase, self.function, time.perf_counter() - self.started, exc_type is not None
+        )
+        return False
+
+
+def _caller(frame):
+    code = frame.f_code
+    return getattr(code, "co_qualname", code.co_name)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def span(phase):
+    """Time a phase of the calling function with the process wide metrics"""
+    return get_metrics().span(phase, _caller(sys._getframe(1)))
+
+
+class RpcMetricsMiddleware(Web3Middleware):
+    """web3 middleware timing every request, sync and async, single and batch"""
+
+    def wrap_make_request(self, make_request):
+        def middleware(method, params):
+            started = time.perf_counter()
+            error = True
+            try:
+                response = make_request(method, params)
+                error = "error" in response
+                return response
+            finally:
+                get_metrics().observe_rpc("evm", method, time.perf_counter() - started, error)
+
+        return middleware
+
+    def wrap_make_batch_request(self, make_batch_request):
+        def middleware(requests_info):
+            started = time.perf_counter()
+            responses = None
+            try:
+                responses = make_batch_request(requests_info)
+                return responses
+            finally:
+                _observe_batch(requests_info, responses, time.perf_counter() - started)
+
+        return middleware
+
+    async def async_wrap_make_request(self, make_request):
+        async def middleware(method, params):
+            started = time.perf_counter()
+            error = True
+            try:
+                response = await make_request(method, params)
+                error = "error" in response
+                return response
+            finally:
+                get_metrics().observe_rpc("evm", method, time.perf_counter() - started, error)
+
+        return middleware
+
+    async def async_wrap_make_batch_request(self, make_batch_request):
+        async def middleware(requests_info):
+            started = time.perf_counter()
+            responses = None
+            try:
+                responses = await make_batch_request(requests_info)
+                return responses
+            finally:
+                _observe_batch(requests_info, responses, time.perf_counter() - started)
+
+        return middleware
+
+
+def _observe_batch(requests_info, responses, seconds):
+    # Every call of a batch waited for the whole batch
+    metrics = get_metrics()
+    for position, (method, _) in enumerate(requests_info):
+        if isinstance(responses, list) and position < len(responses):
+            error = "error" in responses[position]
+        else:
+            error = True
+        metrics.observe_rpc("evm", method, seconds, error)
+
+
+def instrument_web3(w3):
+    """Add the metrics middleware to a Web3 or AsyncWeb3 instance (once)"""
+    if Web3Middleware is object:
+        return w3
+    try:
+        w3.middleware_onion.add(RpcMetricsMiddleware, "rpc_metrics")
+    except ValueError:
+        pass  # already instrumented
+    return w3
+
+
+# Client methods whose RPC method is not their camelCase name
+SOLANA_METHOD_NAMES = {"send_raw_transaction": "sendTransaction"}
+_SOLANA_METHOD = re.compile(r"^(get_|send_|is_|request_|simulate_|minimum_|validator_)")
+
+
+def _solana_method(name):
+    if name in SOLANA_METHOD_NAMES:
+        return SOLANA_METHOD_NAMES[name]
+    first, *rest = name.split("_")
+    return first + "".join(word.capitalize() for word in rest)
+
+
+def instrument_solana_client(client):
+    """Time every RPC method of a solana-py Client or AsyncClient (once)
+
+    Public methods are wrapped on the instance, so this works for any
+    provider the client uses.
+    """
+    if getattr(client, "_rpc_metrics", False):
+        return client
+    for name in dir(type(client)):
+        if not _SOLANA_METHOD.match(name):
+            continue
+        function = getattr(client, name)
+        if not callable(function):
+            continue
+        method = _solana_method(name)
+        if inspect.iscoroutinefunction(function):
+            wrapper = _timed_async(function, method)
+        else:
+            wrapper = _timed(function, method)
+        setattr(client, name, wrapper)
+    client._rpc_metrics = True
+    return client
+
+
+def _timed(function, method):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        error = True
+        try:
+            result = function(*args, **kwargs)
+            error = False
+            return result
+        finally:
+            get_metrics().observe_rpc("solana", method, time.perf_counter() - started, error)
+
+    return wrapper
+
+
+def _timed_async(function, method):
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        error = True
+        try:
+            result = await function(*args, **kwargs)
+            error = False
+            return result
+        finally:
+            get_metrics().observe_rpc("solana", method, time.perf_counter() - started, error)
+
+    return wrapper
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """Process wide Metrics, configured from RPC_METRICS and RPC_METRICS_EVENTS"""
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = Metrics(
+                    enabled=os.environ.get("RPC_METRICS", "1") != "0",
+                    events_path=os.environ.get("RPC_METRICS_EVENTS") or None,
+                )
+    return _metrics
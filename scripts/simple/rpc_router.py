@@ -0,0 +1,600 @@
+"""Latency-aware routing of JSON-RPC over several endpoints of one chain
+
+Any script takes a comma separated list of endpoints where it takes one RPC
+URL, for example:
+
+    UniswapV3("https://mainnet.base.org,https://base-rpc.publicnode.com", ...)
+    python sol_batch_payout.py --rpc-url https://api.mainnet-beta.solana.com,https://solana-rpc.publicnode.com ...
+
+and its calls go through the chain's RpcRouter. The router keeps a rolling
+window of latencies, an error rate and the head block (slot on Solana) of
+every endpoint, the heads are polled in the background while it is in use.
+
+Reads go to the fastest healthy endpoint that keeps up with the head. A read
+still unanswered after that endpoint's usual (p90) latency is hedged to the
+next endpoint and the first answer wins. An endpoint that fails (connection
+or HTTP error, rate limit, node behind) is failed over at once and rested for
+a cool-down that doubles while it keeps failing. Raw transactions are
+broadcast to every endpoint at once and the first accepting answer is
+returned.
+
+Usage:
+    from rpc_router import get_router
+    print(get_router("https://a.example,https://b.example").stats())
+"""
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+import asyncio
+import itertools
+import json
+import threading
+import time
+
+try:
+    import httpx
+except ImportError:  # requests (a web3 dependency) is used instead
+    httpx = None
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+
+    HTTP2_AVAILABLE = httpx is not None
+except ImportError:
+    HTTP2_AVAILABLE = False
+try:
+    from web3.providers.async_base import AsyncJSONBaseProvider
+    from web3.providers.base import JSONBaseProvider
+except ImportError:  # Solana only install
+    JSONBaseProvider = AsyncJSONBaseProvider = object
+
+# Sent to every endpoint, the rest are reads
+BROADCAST_METHODS = frozenset({"eth_sendRawTransaction", "sendTransaction"})
+# JSON-RPC errors that say "not this endpoint, not now" rather than anything
+# about the call: limit exceeded / node behind, internal error, block not
+# available, HTTP 429 passed through as a code
+RETRY_ERROR_CODES = frozenset({-32005, -32603, -32004, 429})
+RETRY_ERROR_MESSAGES = ("rate limit", "too many requests", "header not found", "missing trie node")
+# Head method and how to read its result, per chain
+HEAD_METHODS = {
+    "evm": ("eth_blockNumber", lambda result: int(result, 16)),
+    "solana": ("getSlot", int),
+}
+# Blocks (slots) an endpoint may be behind the best head and still get reads;
+# a Solana node further behind would not know transactions that landed
+# recently (a blockhash is valid for 150 blocks)
+DEFAULT_MAX_LAG = {"evm": 3, "solana": 10}
+# Weight of the newest call in an endpoint's error rate and in the latency
+# average it is ranked by (reacts within a few calls, the window does not)
+ERROR_DECAY = 0.1
+LATENCY_DECAY = 0.2
+# Latency score multiplier of an endpoint failing every call
+ERROR_PENALTY = 4.0
+# Hedge delay while an endpoint has no latencies yet
+DEFAULT_HEDGE_DELAY = 0.5
+
+
+def parse_endpoints(rpc_url):
+    """List of endpoint URLs of "url" or "url1,url2,..." (or a list)"""
+    if isinstance(rpc_url, (list, tuple)):
+        return [url.strip() for url in rpc_url if url.strip()]
+    return [url.strip() for url in rpc_url.split(",") if url.strip()]
+
+
+def is_routed(rpc_url):
+    return len(parse_endpoints(rpc_url)) > 1
+
+
+class HttpTransport:
+    def __init__(self, endpoint_uri, pool_size=8, timeout=30):
+        """Pooled keep-alive POSTs of JSON-RPC bodies to one endpoint
+
+        HTTP/2 (one multiplexed connection) when httpx and h2 are installed.
+        """
+        self.endpoint_uri = endpoint_uri
+        self.timeout = timeout
+        headers = {"Content-Type": "application/json"}
+        if httpx is not None:
+            self.client = httpx.Client(
+                http2=HTTP2_AVAILABLE,
+                headers=headers,
+                timeout=timeout,
+                limits=httpx.Limits(
+                    max_connections=pool_size, max_keepalive_connections=pool_size
+                ),
+            )
+            self.session = None
+        else:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            self.client = None
+            self.session = requests.Session()
+            self.session.headers.update(headers)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+
+    def post(self, body):
+        if self.client is not None:
+            response = self.client.post(self.endpoint_uri, content=body)
+        else:
+            response = self.session.post(self.endpoint_uri, data=body, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+
+class Endpoint:
+    def __init__(self, url, pool_size, timeout, window):
+        self.url = url
+        self.transport = HttpTransport(url, pool_size, timeout)
+        # Seconds of the latest successful calls, and their moving average
+        self.latencies = deque(maxlen=window)
+        self.average = None
+        self.error_rate = 0.0
+        # Failures in a row, the cool-down doubles with each
+        self.failures = 0
+        self.down_until = 0.0
+        self.head = None
+        self.calls = 0
+        self.errors = 0
+
+    def latency(self, q):
+        """Latency quantile of the window, None before the first answer"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class RpcRouter:
+    def __init__(
+        self,
+        endpoints,
+        chain="evm",
+        hedge=True,
+        hedge_quantile=0.9,
+        min_hedge_delay=0.02,
+        max_hedge_delay=2.0,
+        max_lag=None,
+        cooldown=1.0,
+        max_cooldown=60.0,
+        head_interval=2.0,
+        idle_timeout=60.0,
+        window=100,
+        pool_size=8,
+        timeout=30,
+    ):
+        """Route JSON-RPC bodies over several endpoints of one chain
+
+        post() is the whole interface, it takes and returns the raw bytes of
+        a request (or batch), so it stands in for a single endpoint's HTTP
+        transport anywhere.
+
+        Args:
+            endpoints: Endpoint URLs, a list or "url1,url2,..."
+            chain: "evm" or "solana" (head method and broadcast method)
+            hedge: Send a slow read to a second endpoint
+            hedge_quantile: Latency quantile of an endpoint after which its read is hedged
+            min_hedge_delay: Shortest hedge delay in seconds
+            max_hedge_delay: Longest hedge delay in seconds
+            max_lag: Blocks (slots) behind the best head an endpoint still gets reads
+            cooldown: Seconds a failed endpoint rests, doubled per failure in a row
+            max_cooldown: Longest rest in seconds
+            head_interval: Seconds between head polls of every endpoint
+            idle_timeout: Seconds without calls after which head polling stops
+            window: Latest latencies kept per endpoint
+            pool_size: Connections kept open per endpoint
+            timeout: HTTP timeout in seconds
+        """
+        urls = parse_endpoints(endpoints)
+        if not urls:
+            raise Exception("RpcRouter needs at least one endpoint")
+        if chain not in HEAD_METHODS:
+            raise Exception(f"Unknown chain {chain}, use one of {list(HEAD_METHODS)}")
+        self.chain = chain
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        self.max_lag = DEFAULT_MAX_LAG[chain] if max_lag is None else max_lag
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.head_interval = head_interval
+        self.idle_timeout = idle_timeout
+        self.endpoints = [Endpoint(url, pool_size, timeout, window) for url in urls]
+        self.executor = ThreadPoolExecutor(
+            max_workers=pool_size * len(urls), thread_name_prefix="rpc-router"
+        )
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.hedged = 0
+        self.failovers = 0
+        self.used_at = 0
+        self.thread = None
+
+    def post(self, body):
+        """POST a JSON-RPC request or batch (bytes), returns the answer (bytes)
+
+        Raises:
+            Exception: When every endpoint failed
+        """
+        self._ensure_running()
+        if _methods(body) & BROADCAST_METHODS:
+            return self._broadcast(body)
+        return self._read(body)
+
+    def ranked(self):
+        """Endpoints best first
+
+        Resting endpoints go last (soonest back first), then endpoints behind
+        the head, the rest by average latency weighted by error rate. An
+        endpoint without latencies yet ranks first so it gets measured.
+        """
+        now = time.monotonic()
+        with self.lock:
+            best_head = max(
+                (endpoint.head for endpoint in self.endpoints if endpoint.head is not None),
+                default=None,
+            )
+
+            def key(endpoint):
+                resting = endpoint.down_until > now
+                behind = endpoint.head is not None and best_head - endpoint.head > self.max_lag
+                return (
+                    resting,
+                    endpoint.down_until if resting else 0.0,
+                    behind,
+                    (endpoint.average or 0.0) * (1 + ERROR_PENALTY * endpoint.error_rate),
+                )
+
+            return sorted(self.endpoints, key=key)
+
+    def hedge_delay(self, endpoint):
+        """Seconds to wait for an endpoint before hedging the read"""
+        with self.lock:
+            latency = endpoint.latency(self.hedge_quantile)
+        if latency is None:
+            latency = DEFAULT_HEDGE_DELAY
+        return min(max(latency, self.min_hedge_delay), self.max_hedge_delay)
+
+    def stats(self):
+        """Per endpoint numbers and the router's hedge and failover counts"""
+        now = time.monotonic()
+        with self.lock:
+            return {
+                "hedged": self.hedged,
+                "failovers": self.failovers,
+                "endpoints": [
+                    {
+                        "url": endpoint.url,
+                        "average_ms": _ms(endpoint.average),
+                        "p50_ms": _ms(endpoint.latency(0.5)),
+                        "p90_ms": _ms(endpoint.latency(0.9)),
+                        "error_rate": round(endpoint.error_rate, 3),
+                        "head": endpoint.head,
+                        "resting_s": round(max(endpoint.down_until - now, 0.0), 1),
+                        "calls": endpoint.calls,
+                        "errors": endpoint.errors,
+                    }
+                    for endpoint in self.endpoints
+                ],
+            }
+
+    def _read(self, body):
+        ranked = self.ranked()
+        pending = {}
+        errors = []
+        hedged = False
+
+        def launch():
+            endpoint = ranked[len(pending) + len(errors)]
+            pending[self.executor.submit(self._post, endpoint, body)] = endpoint
+            return time.monotonic() + self.hedge_delay(endpoint)
+
+        hedge_at = launch()
+        while pending:
+            timeout = None
+            can_launch = len(pending) + len(errors) < len(ranked)
+            if self.hedge and not hedged and can_launch:
+                timeout = max(hedge_at - time.monotonic(), 0.0)
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Slower than usual, the first answer of the two is used
+                hedged = True
+                launch()
+                with self.lock:
+                    self.hedged += 1
+                continue
+            for future in done:
+                endpoint = pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    errors.append(f"{endpoint.url}: {str(e)}")
+            if not pending and len(errors) < len(ranked):
+                hedge_at = launch()
+                with self.lock:
+                    self.failovers += 1
+        raise Exception(f"Every RPC endpoint failed: {'; '.join(errors)}")
+
+    def _broadcast(self, body):
+        ranked = self.ranked()
+        futures = {self.executor.submit(self._post, endpoint, body): endpoint for endpoint in ranked}
+        errors = []
+        # (rank, answer) of endpoints that rejected the transaction
+        rejected = []
+        for future in as_completed(futures):
+            endpoint = futures[future]
+            try:
+                content = future.result()
+            except Exception as e:
+                errors.append(f"{endpoint.url}: {str(e)}")
+                continue
+            if not _has_error(json.loads(content)):
+                return content
+            # "already known" from one endpoint while another accepts it
+            rejected.append((ranked.index(endpoint), content))
+        if rejected:
+            return min(rejected)[1]
+        raise Exception(f"Every RPC endpoint failed: {'; '.join(errors)}")
+
+    def _post(self, endpoint, body):
+        started = time.perf_counter()
+        try:
+            content = endpoint.transport.post(body)
+            error = _retry_error(json.loads(content))
+            if error is not None:
+                raise Exception(f"{error.get('code')} {error.get('message')}")
+        except Exception:
+            self._record(endpoint, None)
+            raise
+        self._record(endpoint, time.perf_counter() - started)
+        return content
+
+    def _record(self, endpoint, seconds):
+        with self.lock:
+            endpoint.calls += 1
+            error = seconds is None
+            endpoint.error_rate += ERROR_DECAY * (error - endpoint.error_rate)
+            if error:
+                endpoint.errors += 1
+                endpoint.failures += 1
+                rest = min(self.cooldown * 2 ** (endpoint.failures - 1), self.max_cooldown)
+                endpoint.down_until = time.monotonic() + rest
+            else:
+                endpoint.failures = 0
+                endpoint.down_until = 0.0
+                endpoint.latencies.append(seconds)
+                if endpoint.average is None:
+                    endpoint.average = seconds
+                else:
+                    endpoint.average += LATENCY_DECAY * (seconds - endpoint.average)
+
+    def poll_heads(self):
+        """Read the head of every endpoint once (also measures resting ones)"""
+        method, parse = HEAD_METHODS[self.chain]
+        body = json.dumps(
+            {"jsonrpc": "2.0", "method": method, "params": [], "id": next(self.ids)}
+        ).encode()
+        futures = {
+            self.executor.submit(self._post, endpoint, body): endpoint
+            for endpoint in self.endpoints
+        }
+        for future in as_completed(futures):
+            try:
+                head = parse(json.loads(future.result())["result"])
+            except Exception:
+                continue
+            with self.lock:
+                futures[future].head = head
+
+    def _ensure_running(self):
+        with self.lock:
+            self.used_at = time.time()
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self._run, name="rpc-router", daemon=True
+                )
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if time.time() - self.used_at > self.idle_timeout:
+                    self.thread = None
+                    return
+            try:
+                self.poll_heads()
+            except Exception as e:
+                print(f"RPC router head poll failed: {str(e)}")
+            time.sleep(self.head_interval)
+
+
+def _methods(body):
+    payload = json.loads(body)
+    if isinstance(payload, dict):
+        return {payload.get("method")}
+    return {request.get("method") for request in payload}
+
+
+def _has_error(answer):
+    answers = answer if isinstance(answer, list) else [answer]
+    return any("error" in item for item in answers)
+
+
+def _retry_error(answer):
+    """The first error of an answer that another endpoint may not give, or None"""
+    answers = answer if isinstance(answer, list) else [answer]
+    for item in answers:
+        error = item.get("error")
+        if not isinstance(error, dict):
+            continue
+        message = str(error.get("message", "")).lower()
+        if error.get("code") in RETRY_ERROR_CODES or any(
+            text in message for text in RETRY_ERROR_MESSAGES
+        ):
+            return error
+    return None
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+class RouterHTTPProvider(JSONBaseProvider):
+    def __init__(self, endpoint_uri, router=None):
+        """Drop-in for Web3.HTTPProvider over the endpoints of "url1,url2,..."
+
+        Usage: w3 = Web3(RouterHTTPProvider("https://a.example,https://b.example"))
+        """
+        super().__init__()
+        self.endpoint_uri = endpoint_uri
+        self.router = router or get_router(endpoint_uri, "evm")
+
+    def __str__(self):
+        return f"Routed RPC connection {self.endpoint_uri}"
+
+    def is_connected(self, show_traceback=False):
+        try:
+            return "result" in self.make_request("web3_clientVersion", [])
+        except Exception:
+            if show_traceback:
+                raise
+            return False
+
+    def make_request(self, method, params):
+        return self.decode_rpc_response(self.router.post(self.encode_rpc_request(method, params)))
+
+    def make_batch_request(self, batch_requests):
+        body = self.encode_batch_rpc_request(batch_requests)
+        return _sorted_batch(self.decode_rpc_response(self.router.post(body)))
+
+
+class AsyncRouterHTTPProvider(AsyncJSONBaseProvider):
+    def __init__(self, endpoint_uri, router=None):
+        """Drop-in for AsyncWeb3.AsyncHTTPProvider over "url1,url2,..."
+
+        The router's blocking calls run in the default executor.
+        """
+        super().__init__()
+        self.endpoint_uri = endpoint_uri
+        self.router = router or get_router(endpoint_uri, "evm")
+
+    def __str__(self):
+        return f"Async routed RPC connection {self.endpoint_uri}"
+
+    async def is_connected(self, show_traceback=False):
+        try:
+            return "result" in await self.make_request("web3_clientVersion", [])
+        except Exception:
+            if show_traceback:
+                raise
+            return False
+
+    async def make_request(self, method, params):
+        body = self.encode_rpc_request(method, params)
+        return self.decode_rpc_response(await asyncio.to_thread(self.router.post, body))
+
+    async def make_batch_request(self, batch_requests):
+        body = self.encode_batch_rpc_request(batch_requests)
+        answer = self.decode_rpc_response(await asyncio.to_thread(self.router.post, body))
+        return _sorted_batch(answer)
+
+
+def _sorted_batch(answer):
+    # A whole batch rejected at once is a single error object
+    if isinstance(answer, dict):
+        return answer
+    return sorted(answer, key=lambda response: response.get("id") or 0)
+
+
+if httpx is not None:
+
+    class RouterTransport(httpx.BaseTransport):
+        """httpx transport sending every request through an RpcRouter"""
+
+        def __init__(self, router):
+            self.router = router
+
+        def handle_request(self, request):
+            content = self.router.post(request.read())
+            return httpx.Response(
+                200, content=content, headers={"Content-Type": "application/json"}
+            )
+
+    class AsyncRouterTransport(httpx.AsyncBaseTransport):
+        """Async httpx transport, the router's blocking calls run in the default executor"""
+
+        def __init__(self, router):
+            self.router = router
+
+        async def handle_async_request(self, request):
+            content = await asyncio.to_thread(self.router.post, await request.aread())
+            return httpx.Response(
+                200, content=content, headers={"Content-Type": "application/json"}
+            )
+
+
+def web3_provider(rpc_url):
+    """Web3.HTTPProvider of one URL, RouterHTTPProvider of "url1,url2,..." """
+    if is_routed(rpc_url):
+        return RouterHTTPProvider(rpc_url)
+    from web3 import Web3
+
+    return Web3.HTTPProvider(rpc_url)
+
+
+def async_web3_provider(rpc_url):
+    """AsyncHTTPProvider of one URL, AsyncRouterHTTPProvider of "url1,url2,..." """
+    if is_routed(rpc_url):
+        return AsyncRouterHTTPProvider(rpc_url)
+    from web3 import AsyncWeb3
+
+    return AsyncWeb3.AsyncHTTPProvider(rpc_url)
+
+
+def solana_client(rpc_url, **kwargs):
+    """solana.rpc.api.Client of one URL or of the router of "url1,url2,..."
+
+    A routed client keeps solana-py's request building and parsing, only its
+    HTTP session posts through the router.
+    """
+    from solana.rpc.api import Client
+
+    urls = parse_endpoints(rpc_url)
+    client = Client(urls[0], **kwargs)
+    if len(urls) > 1:
+        client._provider.session = httpx.Client(
+            transport=RouterTransport(get_router(rpc_url, "solana"))
+        )
+    return client
+
+
+def solana_async_client(rpc_url, **kwargs):
+    """solana.rpc.async_api.AsyncClient of one URL or of the router of "url1,url2,..." """
+    from solana.rpc.async_api import AsyncClient
+
+    urls = parse_endpoints(rpc_url)
+    client = AsyncClient(urls[0], **kwargs)
+    if len(urls) > 1:
+        client._provider.session = httpx.AsyncClient(
+            transport=AsyncRouterTransport(get_router(rpc_url, "solana"))
+        )
+    return client
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(rpc_url, chain="evm"):
+    """Process wide router of a list of endpoints, shared by every script
+
+    The same endpoints in the same order share one router, its latency
+    windows and its head polling.
+    """
+    key = (tuple(parse_endpoints(rpc_url)), chain)
+    with _routers_lock:
+        router = _routers.get(key)
+        if router is None:
+            router = _routers[key] = RpcRouter(key[0], chain)
+        return router
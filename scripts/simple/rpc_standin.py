@@ -0,0 +1,925 @@
+"""Local Ethereum and Solana JSON-RPC stand-in for benchmarks
+
+EvmWorld answers the calls the Uniswap and transfer scripts make (Multicall3,
+ERC20 reads, pool state, gas, fees, nonce, send, receipts and pool logs) from
+an in-memory chain. Sent transactions are not executed, they are mined into
+the next block the first time a receipt or block number is asked for, along
+with the pool events (swaps, mints, burns) queued since the last block.
+
+SolanaWorld answers the calls of the Solana scripts (blockhash, block height,
+balances, accounts, token accounts, send and signature statuses). Slots
+advance with the clock, System transfers are executed and land in the slot
+they were sent in.
+
+Both are served over HTTP by RpcStandIn and share what makes a run
+repeatable and a remote node believable: a per-request latency (and extra
+latency per method), injected errors (a seeded rate or the next calls of a
+method), and scripted or recorded responses that answer before the world
+does.
+"""
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import base64
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+
+import base58
+from eth_abi import decode, encode
+from eth_account import Account
+from solders.hash import Hash
+from solders.transaction import VersionedTransaction
+from web3 import Web3
+
+from uniswap_pool_index import compute_pool_address
+from uniswap_v3_math import get_sqrt_ratio_at_tick
+
+
+def _selector(signature):
+    return Web3.keccak(text=signature)[:4].hex().removeprefix("0x")
+
+
+SELECTORS = {
+    _selector(signature): signature.split("(")[0]
+    for signature in [
+        "aggregate3((address,bool,bytes)[])",
+        "getEthBalance(address)",
+        "getBlockNumber()",
+        "name()",
+        "symbol()",
+        "decimals()",
+        "balanceOf(address)",
+        "allowance(address,address)",
+        "getPool(address,address,uint24)",
+        "slot0()",
+        "liquidity()",
+        "tickBitmap(int16)",
+        "ticks(int24)",
+    ]
+}
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+# Topics of the pool events, computed here so the scripts' decoding is checked
+SWAP_TOPIC = Web3.to_hex(Web3.keccak(text="Swap(address,address,int256,int256,uint160,uint128,int24)"))
+MINT_TOPIC = Web3.to_hex(Web3.keccak(text="Mint(address,address,int24,int24,uint128,uint256,uint256)"))
+BURN_TOPIC = Web3.to_hex(Web3.keccak(text="Burn(address,int24,int24,uint128,uint256,uint256)"))
+
+
+def _topic(value, abi_type="address"):
+    return Web3.to_hex(encode([abi_type], [value]))
+
+
+class JsonRpcError(Exception):
+    def __init__(self, code, message, data=None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.data = data
+
+    def to_json(self):
+        error = {"code": self.code, "message": self.message}
+        if self.data is not None:
+            error["data"] = self.data
+        return error
+
+
+class Reverted(JsonRpcError):
+    def __init__(self, reason):
+        super().__init__(3, f"execution reverted: {reason}")
+
+
+class StandInWorld:
+    # Answer of an injected error, what a loaded public node says
+    INJECTED_ERROR = {"code": -32005, "message": "limit exceeded"}
+
+    def __init__(self, latency=0.0, seed=0):
+        """Request accounting, latency, error injection and scripted answers
+
+        Args:
+            latency: Seconds every JSON-RPC request (or batch) takes
+            seed: Seed of the injected error draws, the same seed fails the
+                same calls of the same run
+        """
+        self.latency = latency
+        # method -> extra seconds a request containing it takes
+        self.method_latency = {}
+        # Share of calls answered with INJECTED_ERROR, error_methods limits
+        # it to some methods (None: every method)
+        self.error_rate = 0.0
+        self.error_methods = None
+        self.random = random.Random(seed)
+        # method -> deque of scripted answers, see script()
+        self.scripted = {}
+        self.request_counts = Counter()
+        self.error_counts = Counter()
+        # HTTP round trips, a batch counts once
+        self.http_requests = 0
+        self.lock = threading.RLock()
+
+    def script(self, method, result=None, error=None, params=None, times=1):
+        """Answer the next calls of method with result (or error) instead of the world
+
+        Args:
+            method: JSON-RPC method
+            result: Result to answer with
+            error: JSON-RPC error object ({"code", "message"}) to answer with
+            params: Only answer calls with exactly these params (None: any)
+            times: Calls answered, None answers every call
+        """
+        with self.lock:
+            self.scripted.setdefault(method, deque()).append(
+                {"params": params, "result": result, "error": error, "times": times}
+            )
+
+    def fail(self, method, times=1, error=None):
+        """Answer the next `times` calls of method with an error"""
+        self.script(method, error=error or self.INJECTED_ERROR, times=times)
+
+    def load_script(self, path):
+        """Script the answers of a JSON Lines file, e.g. recorded from a real node
+
+        Each line is {"method", "params" (optional), "result" or "error",
+        "times" (optional, default every call)}.
+        """
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.script(
+                        entry["method"],
+                        entry.get("result"),
+                        entry.get("error"),
+                        entry.get("params"),
+                        entry.get("times"),
+                    )
+
+    def reset_counts(self):
+        with self.lock:
+            self.request_counts.clear()
+            self.error_counts.clear()
+            self.http_requests = 0
+
+    def request_latency(self, methods):
+        """Seconds a request (or batch) of these methods takes"""
+        return self.latency + max(
+            (self.method_latency.get(method, 0.0) for method in methods), default=0.0
+        )
+
+    def _scripted_answer(self, method, params):
+        with self.lock:
+            answers = self.scripted.get(method)
+            if not answers:
+                return None
+            for answer in answers:
+                if answer["params"] is None or answer["params"] == params:
+                    if answer["times"] is not None:
+                        answer["times"] -= 1
+                        if answer["times"] <= 0:
+                            answers.remove(answer)
+                    return answer
+        return None
+
+    def _inject_error(self, method):
+        if not self.error_rate:
+            return False
+        if self.error_methods is not None and method not in self.error_methods:
+            return False
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def answer(self, request):
+        """JSON-RPC response object of one request"""
+        method = request["method"]
+        params = request.get("params", [])
+        with self.lock:
+            self.request_counts[method] += 1
+        response = {"jsonrpc": "2.0", "id": request["id"]}
+        scripted = self._scripted_answer(method, params)
+        if scripted is not None:
+            if scripted["error"] is not None:
+                self.error_counts[method] += 1
+                response["error"] = scripted["error"]
+            else:
+                response["result"] = scripted["result"]
+            return response
+        if self._inject_error(method):
+            self.error_counts[method] += 1
+            response["error"] = self.INJECTED_ERROR
+            return response
+        try:
+            response["result"] = self.handle(method, params)
+        except JsonRpcError as e:
+            self.error_counts[method] += 1
+            response["error"] = e.to_json()
+        except Exception as e:
+            self.error_counts[method] += 1
+            response["error"] = {"code": -32000, "message": str(e)}
+        return response
+
+    def handle(self, method, params):
+        raise JsonRpcError(-32601, f"Method {method} not found")
+
+
+class EvmWorld(StandInWorld):
+    def __init__(self, chain_id=8453, latency=0.0, gas_price=10**7, priority_fee=10**6, seed=0):
+        """In-memory chain state served by RpcStandIn
+
+        Args:
+            chain_id: Chain ID reported by eth_chainId
+            latency: Seconds every JSON-RPC request (or batch) takes
+            gas_price: Gas price in Wei reported by eth_gasPrice, also the
+                base fee of every block
+            priority_fee: Median tip in Wei reported by eth_feeHistory
+            seed: Seed of the injected errors
+        """
+        super().__init__(latency, seed)
+        self.chain_id = chain_id
+        self.gas_price = gas_price
+        self.priority_fee = priority_fee
+        self.block_number = 1
+        self.tokens = {}
+        self.pools = {}
+        self.pool_keys = {}
+        self.eth_balances = {}
+        self.nonces = Counter()
+        self.pending = []
+        self.receipts = {}
+        self.block_receipts = {}
+        self.block_hashes = {}
+        self.forks = 0
+        # (pool address, event, args) applied in the next block, see swap_pool()
+        self.pending_events = []
+        # block number -> logs / (pool address, pool state before the block)
+        self.block_logs = {}
+        self.block_undo = {}
+
+    def add_token(self, address, name, symbol, decimals):
+        address = Web3.to_checksum_address(address)
+        self.tokens[address] = {
+            "name": name,
+            "symbol": symbol,
+            "decimals": decimals,
+            "balances": Counter(),
+            "allowances": Counter(),
+        }
+        return address
+
+    def fund(self, account_address, token_address=None, amount=0, allowance=0):
+        """Give an account ETH (token_address None) or token balance/allowance"""
+        account_address = Web3.to_checksum_address(account_address)
+        if token_address is None:
+            self.eth_balances[account_address] = amount
+            return
+        token = self.tokens[Web3.to_checksum_address(token_address)]
+        token["balances"][account_address] = amount
+        token["allowances"][account_address] = allowance
+
+    def add_pool(self, factory, token_a, token_b, fee, price, liquidity, tick_spacing, width=2000):
+        """Add a pool with one liquidity position of +-width ticks around price
+
+        Args:
+            price: Raw price of token1 in token0 (token1 wei per token0 wei)
+        """
+        token0, token1 = sorted(
+            [Web3.to_checksum_address(token_a), Web3.to_checksum_address(token_b)],
+            key=lambda address: int(address, 16),
+        )
+        address = compute_pool_address(factory, token0, token1, fee)
+        tick = math.floor(math.log(price, 1.0001))
+        lower = (tick - width) // tick_spacing * tick_spacing
+        upper = (tick + width) // tick_spacing * tick_spacing
+        ticks = {lower: (liquidity, liquidity), upper: (liquidity, -liquidity)}
+        bitmap = Counter()
+        for initialized in ticks:
+            compressed = initialized // tick_spacing
+            bitmap[compressed >> 8] |= 1 << (compressed % 256)
+        self.pools[address] = {
+            "sqrt_price_x96": get_sqrt_ratio_at_tick(tick),
+            "tick": tick,
+            "tick_spacing": tick_spacing,
+            "liquidity": liquidity,
+            "ticks": ticks,
+            "bitmap": bitmap,
+        }
+        self.pool_keys[(token0, token1, fee)] = address
+        return address
+
+    def swap_pool(self, address, tick):
+        """Queue a swap moving a pool's price to tick, mined with the next block"""
+        with self.lock:
+            self.pending_events.append((Web3.to_checksum_address(address), "swap", (tick,)))
+
+    def modify_position(self, address, tick_lower, tick_upper, liquidity_delta):
+        """Queue a Mint (positive delta) or Burn (negative delta), mined with the next block"""
+        with self.lock:
+            self.pending_events.append(
+                (Web3.to_checksum_address(address), "position", (tick_lower, tick_upper, liquidity_delta))
+            )
+
+    @staticmethod
+    def _copy_pool(pool):
+        return dict(pool, ticks=dict(pool["ticks"]), bitmap=Counter(pool["bitmap"]))
+
+    def _apply_event(self, address, event, args):
+        """Change the pool like the contract would, returns its log (without block fields)"""
+        pool = self.pools[address]
+        if event == "swap":
+            (tick,) = args
+            for initialized, (_, net) in pool["ticks"].items():
+                if pool["tick"] < initialized <= tick:
+                    pool["liquidity"] += net
+                elif tick < initialized <= pool["tick"]:
+                    pool["liquidity"] -= net
+            pool["tick"] = tick
+            pool["sqrt_price_x96"] = get_sqrt_ratio_at_tick(tick)
+            return {
+                "address": address.lower(),
+                "topics": [SWAP_TOPIC, _topic(ZERO_ADDRESS), _topic(ZERO_ADDRESS)],
+                "data": Web3.to_hex(
+                    encode(
+                        ["int256", "int256", "uint160", "uint128", "int24"],
+                        [0, 0, pool["sqrt_price_x96"], pool["liquidity"], tick],
+                    )
+                ),
+            }
+
+        tick_lower, tick_upper, delta = args
+        for tick, net in ((tick_lower, delta), (tick_upper, -delta)):
+            gross, old_net = pool["ticks"].get(tick, (0, 0))
+            compressed = tick // pool["tick_spacing"]
+            if gross + delta == 0:
+                pool["ticks"].pop(tick, None)
+                pool["bitmap"][compressed >> 8] &= ~(1 << (compressed % 256))
+            else:
+                pool["ticks"][tick] = (gross + delta, old_net + net)
+                pool["bitmap"][compressed >> 8] |= 1 << (compressed % 256)
+        if tick_lower <= pool["tick"] < tick_upper:
+            pool["liquidity"] += delta
+        topics = [_topic(ZERO_ADDRESS), _topic(tick_lower, "int24"), _topic(tick_upper, "int24")]
+        if delta > 0:
+            return {
+                "address": address.lower(),
+                "topics": [MINT_TOPIC] + topics,
+                "data": Web3.to_hex(
+                    encode(["address", "uint128", "uint256", "uint256"], [ZERO_ADDRESS, delta, 0, 0])
+                ),
+            }
+        return {
+            "address": address.lower(),
+            "topics": [BURN_TOPIC] + topics,
+            "data": Web3.to_hex(encode(["uint128", "uint256", "uint256"], [-delta, 0, 0])),
+        }
+
+    def call(self, to, data):
+        to = Web3.to_checksum_address(to)
+        data = data.removeprefix("0x")
+        function = SELECTORS.get(data[:8])
+        args = bytes.fromhex(data[8:])
+
+        if function == "aggregate3":
+            (calls,) = decode(["(address,bool,bytes)[]"], args)
+            results = []
+            for target, allow_failure, call_data in calls:
+                try:
+                    results.append((True, self.call(target, call_data.hex())))
+                except Reverted:
+                    if not allow_failure:
+                        raise
+                    results.append((False, b""))
+            return encode(["(bool,bytes)[]"], [results])
+        if function == "getEthBalance":
+            (address,) = decode(["address"], args)
+            balance = self.eth_balances.get(Web3.to_checksum_address(address), 0)
+            return encode(["uint256"], [balance])
+        if function == "getBlockNumber":
+            return encode(["uint256"], [self.block_number])
+        if function == "getPool":
+            token_a, token_b, fee = decode(["address", "address", "uint24"], args)
+            token0, token1 = sorted(
+                [Web3.to_checksum_address(token_a), Web3.to_checksum_address(token_b)],
+                key=lambda address: int(address, 16),
+            )
+            return encode(["address"], [self.pool_keys.get((token0, token1, fee), ZERO_ADDRESS)])
+
+        if to in self.tokens:
+            return self._call_token(self.tokens[to], function, args)
+        if to in self.pools:
+            return self._call_pool(self.pools[to], function, args)
+        # No code at the address, like a pool that was never created
+        return b""
+
+    @staticmethod
+    def _call_token(token, function, args):
+        if function in ("name", "symbol"):
+            return encode(["string"], [token[function]])
+        if function == "decimals":
+            return encode(["uint8"], [token["decimals"]])
+        if function == "balanceOf":
+            (owner,) = decode(["address"], args)
+            return encode(["uint256"], [token["balances"][Web3.to_checksum_address(owner)]])
+        if function == "allowance":
+            owner, _ = decode(["address", "address"], args)
+            return encode(["uint256"], [token["allowances"][Web3.to_checksum_address(owner)]])
+        raise Reverted(function)
+
+    @staticmethod
+    def _call_pool(pool, function, args):
+        if function == "slot0":
+            return encode(
+                ["uint160", "int24", "uint16", "uint16", "uint16", "uint8", "bool"],
+                [pool["sqrt_price_x96"], pool["tick"], 0, 1, 1, 0, True],
+            )
+        if function == "liquidity":
+            return encode(["uint128"], [pool["liquidity"]])
+        if function == "tickBitmap":
+            (word,) = decode(["int16"], args)
+            return encode(["uint256"], [pool["bitmap"][word]])
+        if function == "ticks":
+            (tick,) = decode(["int24"], args)
+            gross, net = pool["ticks"].get(tick, (0, 0))
+            return encode(
+                ["uint128", "int128", "uint256", "uint256", "int56", "uint160", "uint32", "bool"],
+                [gross, net, 0, 0, 0, 0, 0, gross > 0],
+            )
+        raise Reverted(function)
+
+    def block_hash(self, number):
+        if number not in self.block_hashes:
+            self.block_hashes[number] = "0x" + Web3.keccak(
+                text=f"{number}:{self.forks}"
+            ).hex().removeprefix("0x")
+        return self.block_hashes[number]
+
+    def mine(self):
+        """Put every pending transaction and pool event into a new block"""
+        with self.lock:
+            if not self.pending and not self.pending_events:
+                return
+            self.block_number += 1
+            block_hash = self.block_hash(self.block_number)
+            logs = []
+            undo = []
+            for address, event, args in self.pending_events:
+                undo.append((address, self._copy_pool(self.pools[address])))
+                log = self._apply_event(address, event, args)
+                log.update(
+                    {
+                        "blockNumber": hex(self.block_number),
+                        "blockHash": block_hash,
+                        "transactionHash": Web3.to_hex(
+                            Web3.keccak(text=f"{block_hash}:{len(logs)}")
+                        ),
+                        "transactionIndex": "0x0",
+                        "logIndex": hex(len(logs)),
+                        "removed": False,
+                    }
+                )
+                logs.append(log)
+            self.block_logs[self.block_number] = logs
+            self.block_undo[self.block_number] = undo
+            self.pending_events = []
+            receipts = []
+            for index, (tx_hash, sender) in enumerate(self.pending):
+                receipt = {
+                    "transactionHash": tx_hash,
+                    "transactionIndex": hex(index),
+                    "blockNumber": hex(self.block_number),
+                    "blockHash": block_hash,
+                    "from": sender,
+                    "to": None,
+                    "contractAddress": None,
+                    "status": "0x1",
+                    "gasUsed": hex(120000),
+                    "cumulativeGasUsed": hex(120000 * (index + 1)),
+                    "effectiveGasPrice": hex(self.gas_price),
+                    "logs": [],
+                    "logsBloom": "0x" + "0" * 512,
+                    "type": "0x0",
+                }
+                self.receipts[tx_hash] = receipt
+                receipts.append(receipt)
+            self.block_receipts[self.block_number] = receipts
+            self.pending = []
+
+    def reorg(self, depth):
+        """Replace the last `depth` blocks, their transactions go back to pending
+
+        Their pool events are undone and dropped, the new blocks do not have them.
+        """
+        with self.lock:
+            self.forks += 1
+            orphaned = []
+            for number in range(self.block_number, self.block_number - depth, -1):
+                for address, pool in reversed(self.block_undo.pop(number, [])):
+                    self.pools[address] = pool
+                self.block_logs.pop(number, None)
+            for number in range(self.block_number - depth + 1, self.block_number + 1):
+                self.block_hashes.pop(number, None)
+                for receipt in self.block_receipts.pop(number, []):
+                    del self.receipts[receipt["transactionHash"]]
+                    orphaned.append((receipt["transactionHash"], receipt["from"]))
+            self.block_number -= depth
+            self.pending = orphaned + self.pending
+
+    def _block(self, number):
+        if number > self.block_number:
+            return None
+        return {
+            "number": hex(number),
+            "hash": self.block_hash(number),
+            "parentHash": self.block_hash(number - 1),
+            "timestamp": hex(int(time.time())),
+            "baseFeePerGas": hex(self.gas_price),
+            "gasLimit": hex(30000000),
+            "gasUsed": hex(120000 * len(self.block_receipts.get(number, []))),
+            "transactions": [
+                receipt["transactionHash"] for receipt in self.block_receipts.get(number, [])
+            ],
+        }
+
+    def handle(self, method, params):
+        if method == "eth_chainId":
+            return hex(self.chain_id)
+        if method == "eth_blockNumber":
+            self.mine()
+            return hex(self.block_number)
+        if method == "eth_call":
+            transaction = params[0]
+            data = transaction.get("data") or transaction.get("input") or "0x"
+            return "0x" + self.call(transaction["to"], data).hex()
+        if method == "eth_getBalance":
+            return hex(self.eth_balances.get(Web3.to_checksum_address(params[0]), 0))
+        if method == "eth_gasPrice":
+            return hex(self.gas_price)
+        if method == "eth_feeHistory":
+            count = min(int(params[0], 16) if isinstance(params[0], str) else params[0], self.block_number)
+            return {
+                "oldestBlock": hex(self.block_number - count + 1),
+                "baseFeePerGas": [hex(self.gas_price)] * (count + 1),
+                "gasUsedRatio": [0.5] * count,
+                # The median percentile pays priority_fee
+                "reward": [
+                    [hex(self.priority_fee * percentile // 50) for percentile in params[2]]
+                ] * count,
+            }
+        if method == "eth_estimateGas":
+            return hex(150000)
+        if method == "eth_getTransactionCount":
+            return hex(self.nonces[Web3.to_checksum_address(params[0])])
+        if method == "eth_sendRawTransaction":
+            sender = Account.recover_transaction(params[0])
+            tx_hash = "0x" + Web3.keccak(hexstr=params[0]).hex().removeprefix("0x")
+            with self.lock:
+                # The same transaction sent again (e.g. broadcast to every
+                # endpoint of one chain) is not applied twice
+                if tx_hash in self.receipts or any(tx_hash == pending for pending, _ in self.pending):
+                    raise JsonRpcError(-32000, "already known")
+                self.nonces[sender] += 1
+                self.pending.append((tx_hash, sender))
+            return tx_hash
+        if method == "eth_getTransactionReceipt":
+            self.mine()
+            return self.receipts.get(params[0])
+        if method == "eth_getBlockReceipts":
+            number = self.block_number if params[0] == "latest" else int(params[0], 16)
+            if number > self.block_number:
+                return None
+            return self.block_receipts.get(number, [])
+        if method == "eth_getBlockByNumber":
+            self.mine()
+            number = self.block_number if params[0] == "latest" else int(params[0], 16)
+            return self._block(number)
+        if method == "eth_getLogs":
+            query = params[0]
+            numbers = [
+                self.block_number if query.get(bound, "latest") == "latest" else int(query[bound], 16)
+                for bound in ("fromBlock", "toBlock")
+            ]
+            addresses = query.get("address")
+            if isinstance(addresses, str):
+                addresses = [addresses]
+            addresses = {address.lower() for address in addresses} if addresses else None
+            topics = (query.get("topics") or [None])[0]
+            if isinstance(topics, str):
+                topics = [topics]
+            return [
+                log
+                for number in range(numbers[0], min(numbers[1], self.block_number) + 1)
+                for log in self.block_logs.get(number, [])
+                if (addresses is None or log["address"] in addresses)
+                and (topics is None or log["topics"][0] in topics)
+            ]
+        if method == "eth_getTransactionByHash":
+            receipt = self.receipts.get(params[0])
+            pending = [tx_hash for tx_hash, _ in self.pending]
+            if receipt is None and params[0] not in pending:
+                return None
+            return {"hash": params[0], "blockNumber": receipt and receipt["blockNumber"]}
+        raise JsonRpcError(-32601, f"Method {method} not supported by the stand-in")
+
+
+SYSTEM_PROGRAM_ID = "11111111111111111111111111111111"
+COMPUTE_BUDGET_PROGRAM_ID = "ComputeBudget111111111111111111111111111111"
+TOKEN_PROGRAM_ID = "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA"
+TOKEN_2022_PROGRAM_ID = "TokenzQdBNbLqP5VEhdkAS6EPFLC1PHnBqCXEpPxuEb"
+# Blocks a blockhash stays valid and confirmations until a slot is finalized
+MAX_PROCESSING_AGE = 150
+FINALIZED_DEPTH = 32
+DEFAULT_COMPUTE_UNITS = 200000
+
+
+class SolanaWorld(StandInWorld):
+    INJECTED_ERROR = {"code": -32005, "message": "Node is behind", "data": {}}
+
+    def __init__(self, latency=0.0, slot_time=0.4, seed=0, drop_rate=0.0, lamports_per_signature=5000):
+        """In-memory Solana cluster served by RpcStandIn
+
+        Every slot has a block, so block height and slot are the same number.
+        A transaction is confirmed one slot after it landed and finalized 32
+        slots after.
+
+        Args:
+            latency: Seconds every JSON-RPC request (or batch) takes
+            slot_time: Seconds per slot
+            seed: Seed of the injected errors and dropped transactions
+            drop_rate: Share of sent transactions that never land, like ones
+                lost on the way to the leader
+            lamports_per_signature: Base fee per signature
+        """
+        super().__init__(latency, seed)
+        self.slot_time = slot_time
+        self.drop_rate = drop_rate
+        self.lamports_per_signature = lamports_per_signature
+        self.started_at = time.monotonic()
+        self.balances = Counter()
+        # address -> (owner program, data), accounts with data
+        self.accounts = {}
+        # blockhash -> last valid block height
+        self.blockhashes = {}
+        # signature -> (slot, err)
+        self.landed = {}
+        self.sent = []
+
+    def slot(self):
+        return int((time.monotonic() - self.started_at) / self.slot_time) + 1
+
+    def fund(self, address, lamports):
+        self.balances[str(address)] = lamports
+
+    def add_mint(self, mint, decimals, program_id=TOKEN_PROGRAM_ID, supply=0):
+        """Add an SPL mint account (82 bytes, decimals at offset 44)"""
+        data = bytearray(82)
+        data[36:44] = supply.to_bytes(8, "little")
+        data[44] = decimals
+        data[45] = 1  # initialized
+        self.accounts[str(mint)] = (program_id, bytes(data))
+        self.balances[str(mint)] = 1461600
+
+    def add_token_account(self, address, mint, owner, amount, program_id=TOKEN_PROGRAM_ID):
+        """Add an SPL token account (165 bytes: mint, owner, amount, ..., state)"""
+        data = bytearray(165)
+        data[0:32] = bytes(mint)
+        data[32:64] = bytes(owner)
+        data[64:72] = amount.to_bytes(8, "little")
+        data[108] = 1  # initialized
+        self.accounts[str(address)] = (program_id, bytes(data))
+        self.balances[str(address)] = 2039280
+
+    def _context(self):
+        return {"slot": self.slot()}
+
+    def _account(self, address, config):
+        address = str(address)
+        lamports = self.balances.get(address)
+        owner, data = self.accounts.get(address, (SYSTEM_PROGRAM_ID, b""))
+        if lamports is None and address not in self.accounts:
+            return None
+        data_slice = (config or {}).get("dataSlice")
+        if data_slice:
+            data = data[data_slice["offset"] : data_slice["offset"] + data_slice["length"]]
+        return {
+            "lamports": lamports or 0,
+            "owner": owner,
+            "data": [base64.b64encode(data).decode(), "base64"],
+            "executable": False,
+            "rentEpoch": 0,
+            "space": len(self.accounts.get(address, (None, b""))[1]),
+        }
+
+    def _latest_blockhash(self):
+        height = self.slot()
+        blockhash = str(Hash(hashlib.sha256(f"blockhash:{height}".encode()).digest()))
+        with self.lock:
+            self.blockhashes[blockhash] = height + MAX_PROCESSING_AGE
+        return blockhash, height + MAX_PROCESSING_AGE
+
+    def _execute(self, tx):
+        """Charge the fee and run the System transfers, returns the error or None"""
+        message = tx.message
+        keys = [str(key) for key in message.account_keys]
+        payer = keys[0]
+        compute_units = None
+        micro_lamports = 0
+        transfers = []
+        for position, instruction in enumerate(message.instructions):
+            program_id = keys[instruction.program_id_index]
+            data = bytes(instruction.data)
+            if program_id == COMPUTE_BUDGET_PROGRAM_ID and data:
+                if data[0] == 2:
+                    compute_units = int.from_bytes(data[1:5], "little")
+                elif data[0] == 3:
+                    micro_lamports = int.from_bytes(data[1:9], "little")
+            elif program_id == SYSTEM_PROGRAM_ID and int.from_bytes(data[:4], "little") == 2:
+                accounts = instruction.accounts
+                transfers.append(
+                    (position, keys[accounts[0]], keys[accounts[1]], int.from_bytes(data[4:12], "little"))
+                )
+        if compute_units is None:
+            compute_units = DEFAULT_COMPUTE_UNITS * len(message.instructions)
+        fee = self.lamports_per_signature * len(tx.signatures) + math.ceil(
+            compute_units * micro_lamports / 10**6
+        )
+        with self.lock:
+            if self.balances[payer] < fee:
+                raise JsonRpcError(
+                    -32002,
+                    "Transaction simulation failed: Attempt to debit an account but found no record of a prior credit.",
+                    {"err": "AccountNotFound", "logs": []},
+                )
+            balances = Counter(self.balances)
+            balances[payer] -= fee
+            self.balances[payer] -= fee
+            for position, source, destination, lamports in transfers:
+                if balances[source] < lamports:
+                    return {"InstructionError": [position, {"Custom": 1}]}
+                balances[source] -= lamports
+                balances[destination] += lamports
+            self.balances = balances
+        return None
+
+    def _send_transaction(self, params):
+        config = params[1] if len(params) > 1 else {}
+        encoding = config.get("encoding", "base58")
+        raw = base64.b64decode(params[0]) if encoding == "base64" else base58.b58decode(params[0])
+        tx = VersionedTransaction.from_bytes(raw)
+        signature = str(tx.signatures[0])
+        preflight = not config.get("skipPreflight", False)
+        if not all(tx.verify_with_results()):
+            raise JsonRpcError(-32003, "Transaction signature verification failure")
+        last_valid_block_height = self.blockhashes.get(str(tx.message.recent_blockhash))
+        with self.lock:
+            self.sent.append(signature)
+            if signature in self.landed:
+                return signature
+            if last_valid_block_height is None or self.slot() > last_valid_block_height:
+                if preflight:
+                    raise JsonRpcError(-32002, "Transaction simulation failed: Blockhash not found", {"err": "BlockhashNotFound", "logs": []})
+                return signature
+            if self.drop_rate and self.random.random() < self.drop_rate:
+                return signature
+            try:
+                err = self._execute(tx)
+            except JsonRpcError:
+                # The fee can not be paid, nothing lands
+                if preflight:
+                    raise
+                return signature
+            if err is not None and preflight:
+                raise JsonRpcError(-32002, "Transaction simulation failed: Error processing Instruction", {"err": err, "logs": []})
+            self.landed[signature] = (self.slot(), err)
+        return signature
+
+    def _signature_status(self, signature):
+        landed = self.landed.get(signature)
+        if landed is None:
+            return None
+        slot, err = landed
+        confirmations = self.slot() - slot
+        if confirmations >= FINALIZED_DEPTH:
+            level, confirmations = "finalized", None
+        elif confirmations >= 1:
+            level = "confirmed"
+        else:
+            level = "processed"
+        return {
+            "slot": slot,
+            "confirmations": confirmations,
+            "err": err,
+            "status": {"Ok": None} if err is None else {"Err": err},
+            "confirmationStatus": level,
+        }
+
+    def handle(self, method, params):
+        if method in ("getSlot", "getBlockHeight"):
+            return self.slot()
+        if method == "getLatestBlockhash":
+            blockhash, last_valid_block_height = self._latest_blockhash()
+            return {
+                "context": self._context(),
+                "value": {"blockhash": blockhash, "lastValidBlockHeight": last_valid_block_height},
+            }
+        if method == "isBlockhashValid":
+            last_valid_block_height = self.blockhashes.get(params[0])
+            valid = last_valid_block_height is not None and self.slot() <= last_valid_block_height
+            return {"context": self._context(), "value": valid}
+        if method == "getBalance":
+            return {"context": self._context(), "value": self.balances.get(params[0], 0)}
+        if method == "getAccountInfo":
+            config = params[1] if len(params) > 1 else {}
+            return {"context": self._context(), "value": self._account(params[0], config)}
+        if method == "getMultipleAccounts":
+            config = params[1] if len(params) > 1 else {}
+            return {
+                "context": self._context(),
+                "value": [self._account(address, config) for address in params[0]],
+            }
+        if method == "getTokenAccountsByOwner":
+            owner = base58.b58decode(params[0])
+            account_filter = params[1]
+            config = params[2] if len(params) > 2 else {}
+            value = []
+            for address, (program_id, data) in list(self.accounts.items()):
+                if len(data) < 165 or data[32:64] != owner:
+                    continue
+                if account_filter.get("programId", program_id) != program_id:
+                    continue
+                if "mint" in account_filter and base58.b58decode(account_filter["mint"]) != data[:32]:
+                    continue
+                value.append({"pubkey": address, "account": self._account(address, config)})
+            return {"context": self._context(), "value": value}
+        if method == "getMinimumBalanceForRentExemption":
+            return 890880 + 6960 * params[0]
+        if method == "getFeeForMessage":
+            return {"context": self._context(), "value": self.lamports_per_signature}
+        if method == "sendTransaction":
+            return self._send_transaction(params)
+        if method == "getSignatureStatuses":
+            return {
+                "context": self._context(),
+                "value": [self._signature_status(signature) for signature in params[0]],
+            }
+        raise JsonRpcError(-32601, f"Method {method} not supported by the stand-in")
+
+
+class RpcStandIn:
+    def __init__(self, world, host="127.0.0.1", port=0, latency=0.0):
+        """Serve an EvmWorld or SolanaWorld as JSON-RPC over HTTP (single and batch requests)
+
+        Use as a context manager, the endpoint is self.url. Several stand-ins
+        can serve one world as the endpoints of one chain, each with its own
+        extra latency; set down to answer every request with HTTP 503.
+        """
+        self.world = world
+        self.latency = latency
+        self.down = False
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                requests = body if isinstance(body, list) else [body]
+                if standin.down:
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                with world.lock:
+                    world.http_requests += 1
+                latency = standin.latency + world.request_latency(
+                    [request["method"] for request in requests]
+                )
+                if latency:
+                    time.sleep(latency)
+                if isinstance(body, list):
+                    response = [world.answer(request) for request in body]
+                else:
+                    response = world.answer(body)
+                data = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
@@ -1,11 +1,12 @@
-from solana.rpc.api import Client
 from solders.pubkey import Pubkey
 import base58
 from loguru import logger
 
+from rpc_router import solana_client
+
 # Mainnet RPC URL
 rpc_url = "https://api.mainnet-beta.solana.com"
-client = Client(rpc_url)
+client = solana_client(rpc_url)
 
 # Replace with your address
 address = ""
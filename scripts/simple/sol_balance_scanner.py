@@ -0,0 +1,309 @@
+"""Lamport balances of many Solana addresses via getMultipleAccounts
+
+Addresses are read from a file (or stdin with "-"), one per line; only the
+first CSV column is used, so a CSV export works as is. They are fetched 100
+per getMultipleAccounts request with several requests in flight, and the
+account data is sliced away since only lamports are needed. Rows are written
+as their request completes, to CSV or, for a .parquet output, to a directory
+of Parquet part files.
+
+A checkpoint file lists the chunks (100 addresses each, in input order) whose
+rows are in the output. A rerun with the same input skips them and appends.
+
+Usage:
+    python sol_balance_scanner.py addresses.txt -o balances.csv [--nonzero]
+    cat addresses.txt | python sol_balance_scanner.py - -o balances.parquet
+"""
+import argparse
+import asyncio
+import csv
+import os
+import sys
+import time
+
+from loguru import logger
+from solana.rpc.types import DataSliceOpts
+from solders.pubkey import Pubkey
+
+from rpc_metrics import instrument_solana_client
+from rpc_router import solana_async_client
+
+RPC_URL = "https://api.mainnet-beta.solana.com"
+# Most keys getMultipleAccounts accepts per request
+CHUNK_SIZE = 100
+# Lamports only, no account data in the response
+NO_DATA = DataSliceOpts(offset=0, length=0)
+
+
+def read_addresses(path):
+    """Yield valid addresses of a file or stdin, invalid lines are logged and skipped"""
+    f = sys.stdin if path == "-" else open(path, newline="")
+    try:
+        for line_number, line in enumerate(f, start=1):
+            address = line.split(",", 1)[0].strip()
+            if not address:
+                continue
+            try:
+                Pubkey.from_string(address)
+            except ValueError:
+                if line_number > 1:  # the first line may be a header
+                    logger.warning(f"Line {line_number}: invalid address {address}")
+                continue
+            yield address
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def chunked(addresses, size=CHUNK_SIZE):
+    """Yield (chunk index, addresses), the index is stable for the same input"""
+    chunk = []
+    index = 0
+    for address in addresses:
+        chunk.append(address)
+        if len(chunk) == size:
+            yield index, chunk
+            index += 1
+            chunk = []
+    if chunk:
+        yield index, chunk
+
+
+class Checkpoint:
+    def __init__(self, path):
+        """Indexes of the chunks whose rows are in the output, one per line
+
+        Args:
+            path: Checkpoint file, appended to and read back on a rerun
+        """
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                # A line cut short by a crash has no newline and is ignored
+                self.done = {int(line) for line in f if line.endswith("\n")}
+        self.file = open(path, "a")
+
+    def mark(self, indexes):
+        if indexes:
+            self.file.write("".join(f"{index}\n" for index in indexes))
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class CsvSink:
+    def __init__(self, path):
+        """address,lamports rows, appended to an existing file"""
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "a", newline="")
+        self.writer = csv.writer(self.file)
+        if new_file:
+            self.writer.writerow(["address", "lamports"])
+
+    def write(self, index, rows):
+        """Write the rows of a chunk, returns the chunk indexes now on disk"""
+        self.writer.writerows(rows)
+        self.file.flush()
+        return [index]
+
+    def close(self):
+        self.file.close()
+        return []
+
+
+class ParquetSink:
+    def __init__(self, path, rows_per_file=50000):
+        """Directory of Parquet part files, each written whole
+
+        A Parquet file can not be appended to and is unreadable until it is
+        closed, so rows are buffered and every flush writes a new part file.
+        Read the result with pandas.read_parquet(path) or pyarrow.dataset.
+
+        Args:
+            path: Output directory
+            rows_per_file: Buffered rows that trigger a new part file
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception("Parquet output needs pyarrow: pip install pyarrow")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.rows_per_file = rows_per_file
+        os.makedirs(path, exist_ok=True)
+        self.part = len([name for name in os.listdir(path) if name.endswith(".parquet")])
+        self.addresses = []
+        self.lamports = []
+        self.pending = []
+
+    def write(self, index, rows):
+        """Buffer the rows of a chunk, returns the chunk indexes now on disk"""
+        for address, lamports in rows:
+            self.addresses.append(address)
+            self.lamports.append(lamports)
+        self.pending.append(index)
+        if len(self.addresses) >= self.rows_per_file:
+            return self.flush()
+        return []
+
+    def flush(self):
+        if self.addresses:
+            table = self.pa.table(
+                {
+                    "address": self.pa.array(self.addresses, self.pa.string()),
+                    "lamports": self.pa.array(self.lamports, self.pa.uint64()),
+                }
+            )
+            part_path = os.path.join(self.path, f"part-{self.part:05d}.parquet")
+            # Renamed into place, a crash never leaves a half written part
+            self.pq.write_table(table, part_path + ".tmp")
+            os.replace(part_path + ".tmp", part_path)
+            self.part += 1
+        flushed = self.pending
+        self.addresses = []
+        self.lamports = []
+        self.pending = []
+        return flushed
+
+    def close(self):
+        return self.flush()
+
+
+async def fetch_chunk(client, chunk, retries=3):
+    """[(address, lamports)] of a chunk, 0 for accounts that do not exist"""
+    pubkeys = [Pubkey.from_string(address) for address in chunk]
+    for attempt in range(retries + 1):
+        try:
+            resp = await client.get_multiple_accounts(pubkeys, data_slice=NO_DATA)
+            break
+        except Exception as e:
+            if attempt == retries:
+                raise
+            logger.warning(f"getMultipleAccounts failed, retrying: {str(e)}")
+            await asyncio.sleep(2**attempt)
+    return [
+        (address, account.lamports if account is not None else 0)
+        for address, account in zip(chunk, resp.value)
+    ]
+
+
+async def scan(
+    addresses,
+    sink,
+    checkpoint,
+    rpc_url=RPC_URL,
+    concurrency=8,
+    nonzero_only=False,
+    report_interval=10.0,
+):
+    """Fetch the balances of all addresses and write them to sink
+
+    Args:
+        addresses: Iterable of base58 addresses, read lazily
+        sink: CsvSink or ParquetSink
+        checkpoint: Checkpoint, its chunks are skipped
+        rpc_url: Solana RPC URL
+        concurrency: getMultipleAccounts requests in flight
+        nonzero_only: Only write addresses holding lamports
+        report_interval: Seconds between progress lines
+
+    Returns:
+        dict of counters (scanned, nonzero, lamports, skipped, failed, seconds)
+    """
+    stats = {"scanned": 0, "nonzero": 0, "lamports": 0, "skipped": 0, "failed": 0}
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = set()
+    started = time.time()
+    last_report = started
+
+    def report():
+        elapsed = time.time() - started
+        logger.info(
+            f"{stats['scanned']} addresses scanned, {stats['nonzero']} non-zero, "
+            f"{stats['scanned'] / elapsed if elapsed else 0:.0f} addresses/s"
+        )
+
+    async def run(index, chunk):
+        nonlocal last_report
+        try:
+            rows = await fetch_chunk(client, chunk)
+        except Exception as e:
+            stats["failed"] += len(chunk)
+            logger.error(f"Chunk {index} failed, rerun to retry it: {str(e)}")
+            return
+        finally:
+            semaphore.release()
+        stats["scanned"] += len(rows)
+        nonzero = [row for row in rows if row[1] > 0]
+        stats["nonzero"] += len(nonzero)
+        stats["lamports"] += sum(lamports for _, lamports in nonzero)
+        checkpoint.mark(sink.write(index, nonzero if nonzero_only else rows))
+        if time.time() - last_report >= report_interval:
+            last_report = time.time()
+            report()
+
+    async with solana_async_client(rpc_url, timeout=30) as client:
+        instrument_solana_client(client)
+        for index, chunk in chunked(addresses):
+            if index in checkpoint.done:
+                stats["skipped"] += len(chunk)
+                continue
+            await semaphore.acquire()
+            task = asyncio.create_task(run(index, chunk))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+    checkpoint.mark(sink.close())
+    stats["seconds"] = time.time() - started
+    report()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch the SOL balances of many addresses")
+    parser.add_argument("input", help='address file, "-" reads stdin')
+    parser.add_argument("-o", "--output", default="balances.csv", help="CSV file or .parquet directory")
+    parser.add_argument("--rpc-url", default=RPC_URL, help="endpoint, or url1,url2,... to route over several")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight")
+    parser.add_argument("--nonzero", action="store_true", help="only write addresses holding SOL")
+    parser.add_argument("--checkpoint", help="checkpoint path (default: <output>.checkpoint)")
+    args = parser.parse_args()
+
+    if args.output.endswith(".parquet"):
+        sink = ParquetSink(args.output)
+    else:
+        sink = CsvSink(args.output)
+    checkpoint = Checkpoint(args.checkpoint or args.output.rstrip("/") + ".checkpoint")
+    if checkpoint.done:
+        logger.info(f"Resuming, {len(checkpoint.done)} chunks already written")
+
+    try:
+        stats = asyncio.run(
+            scan(
+                read_addresses(args.input),
+                sink,
+                checkpoint,
+                args.rpc_url,
+                args.concurrency,
+                args.nonzero,
+            )
+        )
+    finally:
+        checkpoint.close()
+
+    logger.info(
+        f"Done: {stats['scanned']} scanned, {stats['skipped']} skipped (checkpoint), "
+        f"{stats['failed']} failed, {stats['nonzero']} non-zero holding "
+        f"{stats['lamports'] / 10 ** 9} SOL, "
+        f"{stats['scanned'] / stats['seconds'] if stats['seconds'] else 0:.0f} addresses/s"
+    )
+    if stats["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
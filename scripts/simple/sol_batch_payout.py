@@ -0,0 +1,443 @@
+"""Pay many SOL recipients from a CSV of (address, amount in SOL)
+
+System transfers are packed into as few transactions as the 1232 byte packet
+limit allows (about 20 per transaction), each with a ComputeBudget unit limit
+sized for its transfers. The batches of a run share one recent blockhash, are
+sent concurrently and are confirmed through the shared SignaturePoller, which
+reads the statuses of every pending transaction with batched
+getSignatureStatuses calls instead of one confirm_transaction per transfer.
+
+Every signed transaction is written to a SQLite journal before it is sent. A
+Solana transaction can only land while its blockhash is valid, so a rerun
+(or the next round of the same run) sends journaled transactions again as they
+are (same signature) while their blockhash is valid, and packs the rows of a
+transaction again only once its blockhash expired without it landing.
+
+Usage:
+    PRIVATE_KEY=<base58 key> python sol_batch_payout.py payouts.csv [--concurrency 8] [--priority-fee 0]
+"""
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+import argparse
+import asyncio
+import base64
+import csv
+import math
+import os
+import sqlite3
+import time
+
+from loguru import logger
+from solana.rpc.commitment import Confirmed, Finalized
+from solana.rpc.types import TxOpts
+from solders.compute_budget import set_compute_unit_limit, set_compute_unit_price
+from solders.keypair import Keypair
+from solders.message import Message
+from solders.pubkey import Pubkey
+from solders.system_program import TransferParams, transfer
+from solders.transaction import Transaction
+
+from rpc_metrics import instrument_solana_client, span
+from rpc_router import solana_async_client
+from sol_blockhash_cache import get_blockhash_cache
+from sol_signature_poller import BlockhashExpired, get_signature_poller
+
+RPC_URL = "https://api.mainnet-beta.solana.com"
+LAMPORTS_PER_SOL = 10**9
+# Most bytes a serialized transaction may have
+PACKET_DATA_SIZE = 1232
+# Compute units of a System transfer and of a ComputeBudget instruction
+TRANSFER_COMPUTE_UNITS = 150
+COMPUTE_BUDGET_COMPUTE_UNITS = 150
+LAMPORTS_PER_SIGNATURE = 5000
+
+# key identifies the CSV row (line number, address, lamports) in the journal
+Payout = namedtuple("Payout", ["key", "address", "lamports"])
+
+
+def load_payouts(csv_path):
+    """Read (address, amount in SOL) rows, a header row is skipped
+
+    Raises:
+        Exception: on an invalid address or amount, nothing is paid then
+    """
+    payouts = []
+    with open(csv_path, newline="") as f:
+        for line_number, row in enumerate(csv.reader(f), start=1):
+            if not row or not row[0].strip():
+                continue
+            address = row[0].strip()
+            try:
+                pubkey = Pubkey.from_string(address)
+            except ValueError:
+                if line_number == 1:
+                    continue  # header
+                raise Exception(f"Line {line_number}: invalid address {address}")
+            if len(row) < 2:
+                raise Exception(f"Line {line_number}: missing amount")
+            amount = row[1].strip()
+            try:
+                lamports = Decimal(amount) * LAMPORTS_PER_SOL
+            except InvalidOperation:
+                raise Exception(f"Line {line_number}: invalid amount {row[1]}")
+            if lamports <= 0 or lamports != lamports.to_integral_value():
+                raise Exception(f"Line {line_number}: invalid amount {row[1]}")
+            payouts.append(
+                Payout(f"{line_number}:{address}:{int(lamports)}", pubkey, int(lamports))
+            )
+    return payouts
+
+
+def compute_units(transfers, priority_fee):
+    budget_instructions = 2 if priority_fee else 1
+    return TRANSFER_COMPUTE_UNITS * transfers + COMPUTE_BUDGET_COMPUTE_UNITS * budget_instructions
+
+
+def build_instructions(payer, payouts, priority_fee=0):
+    """ComputeBudget instructions sized for the batch, then one transfer per row
+
+    Args:
+        payer: Paying Pubkey
+        payouts: Rows of the batch
+        priority_fee: Micro-lamports per compute unit (0: no price instruction)
+    """
+    instructions = [set_compute_unit_limit(compute_units(len(payouts), priority_fee))]
+    if priority_fee:
+        instructions.append(set_compute_unit_price(priority_fee))
+    for payout in payouts:
+        instructions.append(
+            transfer(
+                TransferParams(from_pubkey=payer, to_pubkey=payout.address, lamports=payout.lamports)
+            )
+        )
+    return instructions
+
+
+def transaction_size(payer, instructions):
+    """Serialized size of a transaction with one signature"""
+    # Signature count (1 byte shortvec) and the 64 byte signature
+    return 1 + 64 + len(bytes(Message(instructions, payer)))
+
+
+def pack_batches(payer, payouts, priority_fee=0):
+    """Split payouts into batches whose transactions fit in one packet"""
+    batches = []
+    batch = []
+    for payout in payouts:
+        candidate = batch + [payout]
+        size = transaction_size(payer, build_instructions(payer, candidate, priority_fee))
+        if size > PACKET_DATA_SIZE and batch:
+            batches.append(batch)
+            batch = [payout]
+        else:
+            batch = candidate
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def transaction_fee(transfers, priority_fee):
+    """Lamports a batch transaction pays: one signature plus the priority fee"""
+    units = compute_units(transfers, priority_fee)
+    return LAMPORTS_PER_SIGNATURE + math.ceil(units * priority_fee / 10**6)
+
+
+class PayoutJournal:
+    def __init__(self, path):
+        """SQLite journal of every payout transaction
+
+        A transaction is stored (with its raw signed bytes and the last block
+        height its blockhash is valid for) before it is sent. Rows of a
+        transaction count as paid unless it failed or expired unlanded.
+        """
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS payout_transactions (
+                signature TEXT PRIMARY KEY,
+                raw_transaction TEXT NOT NULL,
+                payout_keys TEXT NOT NULL,
+                last_valid_block_height INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                slot INTEGER,
+                signed_at REAL NOT NULL
+            )"""
+        )
+        self.db.commit()
+
+    def paid_keys(self):
+        rows = self.db.execute(
+            "SELECT payout_keys FROM payout_transactions WHERE status NOT IN ('failed', 'expired')"
+        ).fetchall()
+        return {key for (keys,) in rows for key in keys.split("|")}
+
+    def unfinished(self):
+        """(signature, raw bytes, payout keys, last valid block height) not seen landed"""
+        rows = self.db.execute(
+            "SELECT signature, raw_transaction, payout_keys, last_valid_block_height "
+            "FROM payout_transactions WHERE status = 'signed' ORDER BY signed_at"
+        ).fetchall()
+        return [
+            (signature, base64.b64decode(raw), keys.split("|"), last_valid_block_height)
+            for signature, raw, keys, last_valid_block_height in rows
+        ]
+
+    def record_signed(self, signature, raw_transaction, payout_keys, last_valid_block_height):
+        self.db.execute(
+            "INSERT INTO payout_transactions VALUES (?, ?, ?, ?, 'signed', NULL, ?)",
+            (
+                signature,
+                base64.b64encode(raw_transaction).decode(),
+                "|".join(payout_keys),
+                last_valid_block_height,
+                time.time(),
+            ),
+        )
+        self.db.commit()
+
+    def record_status(self, signature, status, slot=None):
+        self.db.execute(
+            "UPDATE payout_transactions SET status = ?, slot = ? WHERE signature = ?",
+            (status, slot, signature),
+        )
+        self.db.commit()
+
+
+class PayoutReport:
+    def __init__(self):
+        self.transactions_sent = 0
+        self.transfers_sent = 0
+        self.confirmed = 0
+        self.transfers_confirmed = 0
+        self.failed = 0
+        self.expired = 0
+        self.fee_lamports = 0
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def log(self, skipped, total, pending):
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        logger.info("Payout report")
+        logger.info(f"- Rows: {total}, already paid before this run: {skipped}")
+        logger.info(f"- Transactions sent: {self.transactions_sent} ({self.transfers_sent} transfers)")
+        logger.info(f"- Confirmed: {self.confirmed} ({self.transfers_confirmed} transfers)")
+        logger.info(f"- Failed: {self.failed}, expired unlanded: {self.expired} (their rows are packed again)")
+        logger.info(f"- Still pending: {pending}")
+        if elapsed > 0:
+            logger.info(
+                f"- Achieved throughput: {self.confirmed / elapsed:.2f} tx/s, "
+                f"{self.transfers_confirmed / elapsed:.2f} transfers/s"
+            )
+        logger.info(f"- Total fee: {self.fee_lamports / LAMPORTS_PER_SOL} SOL")
+
+
+class BatchPayout:
+    def __init__(
+        self,
+        client,
+        keypair,
+        journal,
+        blockhash_cache,
+        signature_poller,
+        concurrency=8,
+        priority_fee=0,
+        commitment=Confirmed,
+    ):
+        """Packed SOL payout engine
+
+        Args:
+            client: solana.rpc.async_api.AsyncClient
+            keypair: Paying Keypair
+            journal: PayoutJournal
+            blockhash_cache: BlockhashCache of the cluster, shared by the batches
+            signature_poller: SignaturePoller of the cluster
+            concurrency: Transactions being sent at once
+            priority_fee: Micro-lamports per compute unit
+            commitment: Confirmed or Finalized, when a payout counts as landed
+        """
+        self.client = client
+        self.keypair = keypair
+        self.payer = keypair.pubkey()
+        self.journal = journal
+        self.blockhash_cache = blockhash_cache
+        self.concurrency = concurrency
+        self.priority_fee = priority_fee
+        self.commitment = commitment
+        self.signature_poller = signature_poller
+        self.level = "finalized" if commitment == Finalized else "confirmed"
+        self.report = PayoutReport()
+        # signature string -> asyncio task waiting for it to resolve
+        self.pending = {}
+
+    async def _send_raw(self, signature, raw_transaction):
+        try:
+            await self.client.send_raw_transaction(
+                raw_transaction, opts=TxOpts(skip_preflight=True)
+            )
+        except Exception as e:
+            # It may still have reached a leader, it stays pending until it
+            # lands or its blockhash expires
+            logger.warning(f"Sending {signature} failed: {str(e)}")
+
+    async def _send_batch(self, payouts, semaphore):
+        async with semaphore:
+            with span("sign"):
+                # Served from memory, every batch sent meanwhile shares it
+                blockhash = await self.blockhash_cache.latest_async()
+                tx = Transaction(
+                    [self.keypair],
+                    Message(build_instructions(self.payer, payouts, self.priority_fee), self.payer),
+                    blockhash.blockhash,
+                )
+            signature = str(tx.signatures[0])
+            raw_transaction = bytes(tx)
+            self.journal.record_signed(
+                signature,
+                raw_transaction,
+                [payout.key for payout in payouts],
+                blockhash.last_valid_block_height,
+            )
+            with span("send"):
+                await self._send_raw(signature, raw_transaction)
+            self._track(signature, len(payouts), blockhash.last_valid_block_height)
+            self.report.transactions_sent += 1
+            self.report.transfers_sent += len(payouts)
+
+    def _track(self, signature, transfers, last_valid_block_height):
+        self.pending[signature] = asyncio.ensure_future(
+            self._wait(signature, transfers, last_valid_block_height)
+        )
+
+    async def _wait(self, signature, transfers, last_valid_block_height):
+        """Journal the outcome of a transaction once the poller resolved it"""
+        try:
+            with span("confirm"):
+                status = await asyncio.wrap_future(
+                    self.signature_poller.track(signature, self.level, last_valid_block_height)
+                )
+        except BlockhashExpired:
+            self.journal.record_status(signature, "expired")
+            self.report.expired += 1
+        else:
+            if status.err is not None:
+                self.journal.record_status(signature, "failed", status.slot)
+                self.report.failed += 1
+                # A failed transaction is still charged its fees
+                self.report.fee_lamports += transaction_fee(transfers, self.priority_fee)
+                logger.warning(f"Transaction {signature} failed ({status.err}), its rows stay unpaid")
+            else:
+                self.journal.record_status(signature, "confirmed", status.slot)
+                self.report.confirmed += 1
+                self.report.transfers_confirmed += transfers
+                self.report.fee_lamports += transaction_fee(transfers, self.priority_fee)
+        del self.pending[signature]
+
+    async def resume(self):
+        """Resolve journaled transactions of an earlier run
+
+        Ones whose blockhash is still valid are sent again as they are (same
+        signature, can land at most once), then all of them are tracked: the
+        poller searches the full history for ones that already landed and
+        expires the rest, freeing their rows for packing again.
+        """
+        unfinished = self.journal.unfinished()
+        if not unfinished:
+            return
+        logger.info(f"Resuming {len(unfinished)} journaled transactions...")
+        for signature, raw_transaction, payout_keys, last_valid_block_height in unfinished:
+            if not self.blockhash_cache.expired(last_valid_block_height):
+                await self._send_raw(signature, raw_transaction)
+                self.report.transactions_sent += 1
+                self.report.transfers_sent += len(payout_keys)
+            self._track(signature, len(payout_keys), last_valid_block_height)
+
+    async def confirm(self, timeout=120):
+        """Wait until every pending transaction landed, failed or expired"""
+        if self.pending:
+            await asyncio.wait(list(self.pending.values()), timeout=timeout)
+
+    async def run(self, payouts, rounds=3, confirm_timeout=120):
+        """Pay every row not paid by an earlier run
+
+        Rows of transactions that expired unlanded are packed again in the
+        next round, up to rounds times.
+
+        Returns:
+            PayoutReport
+        """
+        self.report.started_at = time.time()
+        await self.resume()
+        await self.confirm(confirm_timeout)
+        skipped = None
+        for _ in range(rounds):
+            paid = self.journal.paid_keys()
+            todo = [payout for payout in payouts if payout.key not in paid]
+            if skipped is None:
+                skipped = len(payouts) - len(todo)
+            if not todo:
+                break
+            batches = pack_batches(self.payer, todo, self.priority_fee)
+            total = sum(payout.lamports for payout in todo)
+            fees = sum(transaction_fee(len(batch), self.priority_fee) for batch in batches)
+            logger.info(
+                f"{len(todo)} of {len(payouts)} rows to pay, {total / LAMPORTS_PER_SOL} SOL "
+                f"in {len(batches)} transactions"
+            )
+            balance = (await self.client.get_balance(self.payer, self.commitment)).value
+            if balance < total + fees:
+                raise Exception(
+                    f"Insufficient SOL balance. Required: {(total + fees) / LAMPORTS_PER_SOL}, "
+                    f"Current balance: {balance / LAMPORTS_PER_SOL}"
+                )
+
+            semaphore = asyncio.Semaphore(self.concurrency)
+            await asyncio.gather(*(self._send_batch(batch, semaphore) for batch in batches))
+            logger.info("All transactions sent, waiting for confirmations...")
+            await self.confirm(confirm_timeout)
+            # Rows of transactions still pending stay journaled as sent, the
+            # next round only packs rows of expired ones
+
+        self.report.finished_at = time.time()
+        self.report.log(skipped or 0, len(payouts), len(self.pending))
+        return self.report
+
+
+async def pay(args, keypair, payouts):
+    journal = PayoutJournal(args.journal or f"{args.csv_path}.journal.db")
+    commitment = Finalized if args.finalized else Confirmed
+    async with solana_async_client(args.rpc_url) as client:
+        instrument_solana_client(client)
+        await BatchPayout(
+            client,
+            keypair,
+            journal,
+            get_blockhash_cache(args.rpc_url, commitment),
+            get_signature_poller(args.rpc_url, args.ws_url),
+            concurrency=args.concurrency,
+            priority_fee=args.priority_fee,
+            commitment=commitment,
+        ).run(payouts, args.rounds, args.confirm_timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pay SOL to every (address, amount) row of a CSV")
+    parser.add_argument("csv_path")
+    parser.add_argument("--rpc-url", default=RPC_URL, help="endpoint, or url1,url2,... to route over several")
+    parser.add_argument("--ws-url", help="websocket endpoint, signatureSubscribe instead of polling statuses")
+    parser.add_argument("--journal", help="journal path (default: <csv>.journal.db)")
+    parser.add_argument("--concurrency", type=int, default=8, help="transactions sent at once")
+    parser.add_argument("--priority-fee", type=int, default=0, help="micro-lamports per compute unit")
+    parser.add_argument("--rounds", type=int, default=3, help="times rows of expired transactions are packed again")
+    parser.add_argument("--finalized", action="store_true", help="wait for finalized instead of confirmed")
+    parser.add_argument("--confirm-timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    private_key = os.environ.get("PRIVATE_KEY")
+    if not private_key:
+        raise Exception("Set the paying account's private key in PRIVATE_KEY")
+
+    payouts = load_payouts(args.csv_path)
+    asyncio.run(pay(args, Keypair.from_base58_string(private_key), payouts))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+from collections import namedtuple
+import asyncio
+import threading
+import time
+
+from solana.rpc.commitment import Confirmed
+
+from rpc_metrics import instrument_solana_client
+from rpc_router import solana_client
+
+# Blocks a blockhash stays usable: lastValidBlockHeight of the latest blockhash
+# is the current block height plus this
+MAX_PROCESSING_AGE = 150
+
+# fetched_at is time.time() of the fetch, block_height the height it was read at
+CachedBlockhash = namedtuple(
+    "CachedBlockhash", ["blockhash", "last_valid_block_height", "block_height", "fetched_at"]
+)
+
+
+class BlockhashCache:
+    def __init__(
+        self,
+        client,
+        commitment=Confirmed,
+        refresh_interval=2.0,
+        max_age=30.0,
+        idle_timeout=60.0,
+    ):
+        """Recent blockhash served from memory, refreshed in the background
+
+        While the cache is in use a background thread calls getLatestBlockhash
+        every refresh_interval, so signing a transaction needs no RPC. Each
+        hash is kept with its lastValidBlockHeight, and the block height it
+        was read at (lastValidBlockHeight - 150) tells how far the chain is.
+        That height lags the chain by at most one refresh, so expired() can be
+        late but never early: a transaction it reports expired can not land.
+
+        Args:
+            client: solana.rpc.api.Client
+            commitment: Commitment of the blockhash and block height
+            refresh_interval: Seconds between background refreshes
+            max_age: Seconds a hash is served before a blocking refresh
+            idle_timeout: Seconds without use after which the thread stops
+        """
+        self.client = client
+        self.commitment = commitment
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.current = None
+        self.used_at = 0
+        self.thread = None
+
+    def refresh(self):
+        """Fetch the latest blockhash once"""
+        resp = self.client.get_latest_blockhash(self.commitment)
+        last_valid_block_height = resp.value.last_valid_block_height
+        cached = CachedBlockhash(
+            resp.value.blockhash,
+            last_valid_block_height,
+            last_valid_block_height - MAX_PROCESSING_AGE,
+            time.time(),
+        )
+        with self.lock:
+            # Responses of different nodes may arrive out of order
+            if self.current is None or cached.block_height >= self.current.block_height:
+                self.current = cached
+            return self.current
+
+    def _is_stale(self):
+        return self.current is None or time.time() - self.current.fetched_at > self.max_age
+
+    def _ensure_running(self):
+        with self.lock:
+            self.used_at = time.time()
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self._run, name="blockhash-cache", daemon=True
+                )
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            with self.lock:
+                if time.time() - self.used_at > self.idle_timeout:
+                    self.thread = None
+                    return
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Blockhash refresh failed: {str(e)}")
+
+    def latest(self):
+        """CachedBlockhash to sign with, from memory unless the cache went stale"""
+        if self._is_stale():
+            self.refresh()
+        self._ensure_running()
+        return self.current
+
+    async def latest_async(self):
+        """Same as latest(), a stale cache is refreshed off the event loop"""
+        if self._is_stale():
+            await asyncio.to_thread(self.refresh)
+        self._ensure_running()
+        return self.current
+
+    def block_height(self):
+        """Block height as of the last refresh (lags by up to one refresh)"""
+        return self.latest().block_height
+
+    def expired(self, last_valid_block_height):
+        """True once a transaction signed with a hash of this height can no longer land"""
+        return self.block_height() > last_valid_block_height
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_blockhash_cache(rpc_url, commitment=Confirmed):
+    """Process wide blockhash cache of an RPC endpoint, shared by every script
+
+    The cache has its own sync Client, so async callers (latest_async) share
+    it too.
+    """
+    key = (rpc_url, str(commitment))
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = BlockhashCache(
+                instrument_solana_client(solana_client(rpc_url)), commitment
+            )
+        return cache
@@ -0,0 +1,440 @@
+from collections import namedtuple
+from concurrent.futures import Future, TimeoutError
+import asyncio
+import itertools
+import json
+import threading
+import time
+
+from solana.rpc.types import TxOpts
+from solders.commitment_config import CommitmentLevel
+from solders.message import Message
+from solders.rpc.config import RpcContextConfig, RpcSignatureStatusConfig
+from solders.rpc.requests import GetBlockHeight, GetSignatureStatuses
+from solders.rpc.responses import GetBlockHeightResp, GetSignatureStatusesResp
+from solders.signature import Signature
+from solders.transaction import Transaction
+from solders.transaction_status import TransactionConfirmationStatus
+
+from rpc_metrics import instrument_solana_client, span
+from rpc_router import solana_client
+
+# Commitment levels, each implies the ones before it
+LEVELS = ("processed", "confirmed", "finalized")
+# confirmationStatus of each level, in the same order
+_STATUSES = (
+    TransactionConfirmationStatus.Processed,
+    TransactionConfirmationStatus.Confirmed,
+    TransactionConfirmationStatus.Finalized,
+)
+# Most signatures getSignatureStatuses accepts per request
+MAX_SIGNATURE_STATUSES = 256
+
+# err is None for a successful transaction, level the commitment it reached
+SignatureStatus = namedtuple("SignatureStatus", ["signature", "slot", "err", "level"])
+
+
+class BlockhashExpired(Exception):
+    """The transaction's blockhash expired before it landed, it never will"""
+
+
+class _Entry:
+    def __init__(self, signature, last_valid_block_height):
+        self.signature = signature
+        self.last_valid_block_height = last_valid_block_height
+        # level index -> Future
+        self.futures = {}
+
+
+class SignaturePoller:
+    def __init__(self, client, poll_interval=0.4, ws_url=None, ws_poll_interval=5.0):
+        """Resolve many pending Solana transactions with batched status reads
+
+        A background thread reads the statuses of every outstanding signature
+        with getSignatureStatuses, 256 per request, about once per slot. The
+        cost grows with the number of polls, not with the transactions waited
+        for. Signatures tracked with their blockhash's lastValidBlockHeight
+        fail with BlockhashExpired once the node answering their statuses is
+        past it without them landing; its block height is read in the same
+        batch, so a node behind the others can not expire a transaction it
+        has not seen yet.
+
+        With ws_url every signature is also subscribed to with
+        signatureSubscribe and resolved on its notification. Polling then
+        only backs it up (ws_poll_interval), e.g. for expiry.
+
+        Args:
+            client: solana.rpc.api.Client
+            poll_interval: Seconds between status polls (one slot is ~0.4)
+            ws_url: Websocket endpoint for signatureSubscribe (optional)
+            ws_poll_interval: Seconds between status polls with ws_url
+        """
+        if ws_url:
+            try:
+                import websockets  # noqa: F401
+            except ImportError:
+                raise Exception("signatureSubscribe needs the websockets package: pip install websockets")
+        self.client = client
+        self.poll_interval = ws_poll_interval if ws_url else poll_interval
+        self.ws_url = ws_url
+        self.lock = threading.Lock()
+        # signature string -> _Entry
+        self.pending = {}
+        # Signatures not polled yet, may have landed before they were tracked
+        self.new_signatures = set()
+        self.thread = None
+        self.stopped = threading.Event()
+        self.ws_loop = None
+        self.ws_queue = None
+
+    def track(self, signature, level="confirmed", last_valid_block_height=None, callback=None):
+        """Start tracking a signature
+
+        Args:
+            signature: Signature (or its base58 string)
+            level: "processed", "confirmed" or "finalized"
+            last_valid_block_height: Of the blockhash it was signed with,
+                enables expiry detection
+            callback: Called with the Future once it resolved, from the
+                poller thread
+
+        Returns:
+            concurrent.futures.Future resolving to a SignatureStatus, or
+            failing with BlockhashExpired
+        """
+        if level not in LEVELS:
+            raise Exception(f"Unknown level {level}, use one of {list(LEVELS)}")
+        key = str(signature)
+        with self.lock:
+            entry = self.pending.get(key)
+            if entry is None:
+                entry = self.pending[key] = _Entry(
+                    Signature.from_string(key), last_valid_block_height
+                )
+                self.new_signatures.add(key)
+            elif last_valid_block_height is not None:
+                entry.last_valid_block_height = last_valid_block_height
+            future = entry.futures.get(LEVELS.index(level))
+            subscribe = future is None
+            if future is None:
+                future = entry.futures[LEVELS.index(level)] = Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+        self._ensure_running()
+        if subscribe and self.ws_url:
+            self._subscribe(key, level)
+        return future
+
+    def wait(self, signature, level="confirmed", last_valid_block_height=None, timeout=120):
+        """Block until the signature reaches level
+
+        Raises:
+            BlockhashExpired: when it can no longer land
+            Exception: when it did not reach level within timeout seconds
+        """
+        future = self.track(signature, level, last_valid_block_height)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            raise Exception(f"Transaction {signature} is not {level} after {timeout} seconds")
+
+    async def wait_async(self, signature, level="confirmed", last_valid_block_height=None, timeout=120):
+        """Same as wait() without blocking the event loop"""
+        future = asyncio.wrap_future(
+            self.track(signature, level, last_valid_block_height)
+        )
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            raise Exception(f"Transaction {signature} is not {level} after {timeout} seconds")
+
+    def _ensure_running(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stopped.clear()
+                self.thread = threading.Thread(
+                    target=self._run, name="signature-poller", daemon=True
+                )
+                self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.stopped.wait(self.poll_interval)
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Signature poll failed: {str(e)}")
+            with self.lock:
+                if not self.pending:
+                    self.thread = None
+                    return
+
+    def poll(self):
+        """Read every outstanding status once, resolving what reached its level"""
+        with self.lock:
+            entries = list(self.pending.items())
+            new_signatures = self.new_signatures
+            self.new_signatures = set()
+        if not entries:
+            return
+        expiring = any(entry.last_valid_block_height is not None for _, entry in entries)
+
+        # Signatures tracked since the last poll are searched in the full
+        # history once, later polls only need the recent status cache
+        for search_history in (True, False):
+            group = [
+                (key, entry)
+                for key, entry in entries
+                if (key in new_signatures) == search_history
+            ]
+            for start in range(0, len(group), MAX_SIGNATURE_STATUSES):
+                chunk = group[start : start + MAX_SIGNATURE_STATUSES]
+                signatures = [entry.signature for _, entry in chunk]
+                if expiring:
+                    height, statuses = self._read_statuses_at_height(signatures, search_history)
+                else:
+                    height = None
+                    statuses = self.client.get_signature_statuses(
+                        signatures, search_transaction_history=search_history
+                    ).value
+                for (key, entry), status in zip(chunk, statuses):
+                    if status is not None:
+                        # Nodes predating confirmationStatus leave it empty
+                        level = (
+                            _STATUSES.index(status.confirmation_status)
+                            if status.confirmation_status in _STATUSES
+                            else 0
+                        )
+                        self._resolve(key, SignatureStatus(key, status.slot, status.err, level))
+                    elif (
+                        height is not None
+                        and entry.last_valid_block_height is not None
+                        and height > entry.last_valid_block_height
+                    ):
+                        self._expire(key)
+
+    def _read_statuses_at_height(self, signatures, search_history):
+        """Block height and statuses in one JSON-RPC batch, so from one node
+
+        The height is read first: a signature the same node does not know
+        after that height has really expired.
+
+        Returns:
+            (block height, list of statuses)
+        """
+        height_resp, statuses_resp = self.client._provider.make_batch_request(
+            (
+                GetBlockHeight(RpcContextConfig(CommitmentLevel.Confirmed)),
+                GetSignatureStatuses(signatures, RpcSignatureStatusConfig(search_history)),
+            ),
+            (GetBlockHeightResp, GetSignatureStatusesResp),
+        )
+        if not isinstance(height_resp, GetBlockHeightResp):
+            raise Exception(f"getBlockHeight failed: {height_resp}")
+        if not isinstance(statuses_resp, GetSignatureStatusesResp):
+            raise Exception(f"getSignatureStatuses failed: {statuses_resp}")
+        return height_resp.value, statuses_resp.value
+
+    def _resolve(self, key, status):
+        with self.lock:
+            entry = self.pending.get(key)
+            if entry is None:
+                return
+            reached = [
+                future
+                for level, future in entry.futures.items()
+                if level <= status.level
+            ]
+            entry.futures = {
+                level: future
+                for level, future in entry.futures.items()
+                if level > status.level
+            }
+            if not entry.futures:
+                del self.pending[key]
+        for future in reached:
+            if not future.done():
+                future.set_result(status)
+
+    def _expire(self, key):
+        with self.lock:
+            entry = self.pending.pop(key, None)
+        if entry is None:
+            return
+        for future in entry.futures.values():
+            if not future.done():
+                future.set_exception(
+                    BlockhashExpired(f"Blockhash of {key} expired before it landed")
+                )
+
+    # signatureSubscribe, one websocket for every signature
+
+    def _subscribe(self, key, level):
+        with self.lock:
+            if self.ws_loop is None:
+                ready = threading.Event()
+                threading.Thread(
+                    target=self._run_ws, args=(ready,), name="signature-ws", daemon=True
+                ).start()
+                ready.wait()
+        self.ws_loop.call_soon_threadsafe(self.ws_queue.put_nowait, (key, level))
+
+    def _run_ws(self, ready):
+        self.ws_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.ws_loop)
+        self.ws_queue = asyncio.Queue()
+        ready.set()
+        self.ws_loop.run_until_complete(self._ws_main())
+
+    async def _ws_main(self):
+        import websockets
+
+        while True:
+            try:
+                async with websockets.connect(self.ws_url) as websocket:
+                    await self._ws_session(websocket)
+            except Exception as e:
+                print(f"Signature websocket failed, reconnecting: {str(e)}")
+                await asyncio.sleep(1)
+
+    async def _ws_session(self, websocket):
+        request_ids = itertools.count(1)
+        # request id -> (signature, level), then subscription id -> (signature, level)
+        requested = {}
+        subscriptions = {}
+
+        # Everything tracked so far, the queue only holds what is tracked later
+        while not self.ws_queue.empty():
+            self.ws_queue.get_nowait()
+        with self.lock:
+            backlog = [
+                (key, LEVELS[level])
+                for key, entry in self.pending.items()
+                for level in entry.futures
+            ]
+
+        async def send_subscriptions():
+            while True:
+                while backlog:
+                    key, level = backlog[0]
+                    request_id = next(request_ids)
+                    requested[request_id] = (key, level)
+                    await websocket.send(
+                        json.dumps(
+                            {
+                                "jsonrpc": "2.0",
+                                "id": request_id,
+                                "method": "signatureSubscribe",
+                                "params": [key, {"commitment": level}],
+                            }
+                        )
+                    )
+                    backlog.pop(0)
+                backlog.append(await self.ws_queue.get())
+
+        sender = asyncio.ensure_future(send_subscriptions())
+        try:
+            async for raw in websocket:
+                message = json.loads(raw)
+                if "id" in message:
+                    subscription = requested.pop(message["id"], None)
+                    if subscription is not None and "result" in message:
+                        subscriptions[message["result"]] = subscription
+                elif message.get("method") == "signatureNotification":
+                    params = message["params"]
+                    subscription = subscriptions.pop(params["subscription"], None)
+                    if subscription is None:
+                        continue
+                    key, level = subscription
+                    result = params["result"]
+                    self._resolve(
+                        key,
+                        SignatureStatus(
+                            key,
+                            result["context"]["slot"],
+                            result["value"].get("err"),
+                            LEVELS.index(level),
+                        ),
+                    )
+        finally:
+            sender.cancel()
+
+
+def send_and_confirm(
+    client,
+    cache,
+    poller,
+    keypairs,
+    instructions,
+    payer,
+    level="confirmed",
+    timeout=120,
+):
+    """Sign with the cached blockhash, send, and re-sign when it expires unlanded
+
+    Signing and sending need no RPC besides sendTransaction, and waiting
+    shares the poller's batched status reads. A signature can never land
+    once its blockhash expired, so sending a re-signed copy can not pay twice.
+
+    Args:
+        client: solana.rpc.api.Client
+        cache: BlockhashCache of the same cluster
+        poller: SignaturePoller of the same cluster
+        keypairs: Signers, the fee payer first
+        instructions: Instructions of the transaction
+        payer: Fee payer Pubkey
+        level: "processed", "confirmed" or "finalized"
+        timeout: Seconds until giving up
+
+    Returns:
+        SignatureStatus of the transaction that landed
+
+    Raises:
+        Exception: when it failed on chain or did not land within timeout
+    """
+    message = Message(instructions, payer)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with span("sign"):
+            blockhash = cache.latest()
+            tx = Transaction(keypairs, message, blockhash.blockhash)
+        with span("send"):
+            client.send_raw_transaction(bytes(tx), opts=TxOpts(skip_preflight=True))
+        try:
+            with span("confirm"):
+                status = poller.wait(
+                    tx.signatures[0],
+                    level,
+                    blockhash.last_valid_block_height,
+                    max(deadline - time.time(), 0),
+                )
+        except BlockhashExpired:
+            print(f"Blockhash of {tx.signatures[0]} expired, signing again")
+            continue
+        if status.err is not None:
+            raise Exception(f"Transaction {tx.signatures[0]} failed: {status.err}")
+        return status
+    raise Exception(f"Transaction did not land within {timeout} seconds")
+
+
+_pollers = {}
+_pollers_lock = threading.Lock()
+
+
+def get_signature_poller(rpc_url, ws_url=None):
+    """Process wide poller of an RPC endpoint, shared by every script
+
+    The poller has its own sync Client, async callers use wait_async().
+    ws_url only applies when the poller of an endpoint is created.
+    """
+    with _pollers_lock:
+        poller = _pollers.get(rpc_url)
+        if poller is None:
+            poller = _pollers[rpc_url] = SignaturePoller(
+                instrument_solana_client(solana_client(rpc_url)),
+                ws_url=ws_url,
+            )
+        return poller
@@ -1,12 +1,15 @@
-from solana.rpc.api import Client
-from solana.rpc.types import TokenAccountOpts
+from decimal import Decimal
+
 from solders.pubkey import Pubkey
 import base58
 from loguru import logger
 
+from rpc_router import solana_client
+from sol_token_portfolio import get_token_balance
+
 # Mainnet RPC URL
 rpc_url = "https://api.mainnet-beta.solana.com"
-client = Client(rpc_url)
+client = solana_client(rpc_url)
 
 # Replace with your address
 address = ""
@@ -15,12 +18,10 @@ token_mint_address = "EG1Y8goUGa7y4iRYRgLgwBmSHc4Lxc91qL35cdDNBiRc"
 
 pubkey = Pubkey(base58.b58decode(address))
 
-data = client.get_token_accounts_by_owner_json_parsed(
-    pubkey,
-    TokenAccountOpts(
-        mint=Pubkey(base58.b58decode(token_mint_address)),
-    ),
+# Exact integer amount over all token accounts of the mint
+amount, decimals = get_token_balance(
+    client, pubkey, Pubkey(base58.b58decode(token_mint_address))
 )
 
-balance = data.value[0].account.data.parsed['info']['tokenAmount']['uiAmount']
+balance = Decimal(amount).scaleb(-decimals)
 logger.info(f"Balance of token {token_mint_address} is {balance}")
@@ -0,0 +1,180 @@
+"""SPL token holdings of a wallet, decoded from raw account data
+
+getTokenAccountsByOwner with jsonParsed makes the node render every account
+as nested JSON and hands back float uiAmounts. Here the accounts are requested
+as base64, cut to the 165 byte base layout (Token-2022 extensions are left on
+the node), joined into one buffer and viewed as a NumPy structured array, so
+mint, owner, amount and state are read without a Python object per field.
+Amounts stay exact integers, decimals are read from the mints in one request.
+Both the Token and the Token-2022 program are queried.
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+import numpy as np
+from loguru import logger
+from solana.rpc.types import DataSliceOpts, TokenAccountOpts
+from solders.pubkey import Pubkey
+
+from rpc_metrics import instrument_solana_client
+from rpc_router import solana_client
+
+TOKEN_PROGRAM_ID = Pubkey.from_string("TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA")
+TOKEN_2022_PROGRAM_ID = Pubkey.from_string("TokenzQdBNbLqP5VEhdkAS6EPFLC1PHnBqCXEpPxuEb")
+TOKEN_PROGRAM_IDS = (TOKEN_PROGRAM_ID, TOKEN_2022_PROGRAM_ID)
+
+# spl_token::state::Account, packed little endian, COption = u32 tag + value
+TOKEN_ACCOUNT_DTYPE = np.dtype(
+    [
+        ("mint", "V32"),
+        ("owner", "V32"),
+        ("amount", "<u8"),
+        ("delegate_option", "<u4"),
+        ("delegate", "V32"),
+        ("state", "u1"),
+        ("is_native_option", "<u4"),
+        ("is_native", "<u8"),
+        ("delegated_amount", "<u8"),
+        ("close_authority_option", "<u4"),
+        ("close_authority", "V32"),
+    ]
+)
+TOKEN_ACCOUNT_SIZE = TOKEN_ACCOUNT_DTYPE.itemsize  # 165
+ACCOUNT_STATE_UNINITIALIZED = 0
+ACCOUNT_STATE_FROZEN = 2
+
+# Base layout only, Token-2022 accounts may carry extensions after it
+TOKEN_ACCOUNT_SLICE = DataSliceOpts(offset=0, length=TOKEN_ACCOUNT_SIZE)
+# spl_token::state::Mint.decimals (after mint_authority and supply)
+MINT_DECIMALS_SLICE = DataSliceOpts(offset=44, length=1)
+# Most keys getMultipleAccounts accepts per request
+MAX_MULTIPLE_ACCOUNTS = 100
+
+# amount is the exact integer in base units, ui_amount() scales it
+Holding = namedtuple("Holding", ["mint", "amount", "decimals", "accounts", "program_id"])
+
+
+def ui_amount(holding):
+    """Decimal amount in token units (exact, unlike jsonParsed's uiAmount)"""
+    return Decimal(holding.amount).scaleb(-holding.decimals)
+
+
+def decode_token_accounts(data):
+    """Structured array over concatenated 165 byte token accounts (no copy)"""
+    if len(data) % TOKEN_ACCOUNT_SIZE:
+        raise Exception(f"{len(data)} bytes is not a whole number of token accounts")
+    return np.frombuffer(data, dtype=TOKEN_ACCOUNT_DTYPE)
+
+
+def fetch_token_accounts(client, owner, program_id=None, mint=None):
+    """Token accounts of owner as (account pubkeys, structured array)
+
+    Args:
+        client: solana.rpc.api.Client
+        owner: Wallet Pubkey
+        program_id: Token program to query (one of program_id or mint is required)
+        mint: Only accounts of this mint
+    """
+    resp = client.get_token_accounts_by_owner(
+        owner,
+        TokenAccountOpts(
+            mint=mint,
+            program_id=program_id,
+            encoding="base64",
+            data_slice=TOKEN_ACCOUNT_SLICE,
+        ),
+    )
+    pubkeys = [keyed.pubkey for keyed in resp.value]
+    # A node ignoring the slice returns the extensions too, cut them off
+    data = b"".join(keyed.account.data[:TOKEN_ACCOUNT_SIZE] for keyed in resp.value)
+    return pubkeys, decode_token_accounts(data)
+
+
+def fetch_mint_decimals(client, mints):
+    """{mint Pubkey: decimals}, one getMultipleAccounts per 100 mints"""
+    decimals = {}
+    for start in range(0, len(mints), MAX_MULTIPLE_ACCOUNTS):
+        chunk = mints[start : start + MAX_MULTIPLE_ACCOUNTS]
+        resp = client.get_multiple_accounts(chunk, data_slice=MINT_DECIMALS_SLICE)
+        for mint, account in zip(chunk, resp.value):
+            if account is None or len(account.data) < 1:
+                raise Exception(f"Mint {mint} not found")
+            decimals[mint] = account.data[0]
+    return decimals
+
+
+def sum_by_mint(accounts):
+    """(mints as raw 32 byte values, amount per mint, accounts per mint)
+
+    A mint's supply is a u64, so the sum over its accounts can not overflow.
+    """
+    mints, inverse, counts = np.unique(
+        accounts["mint"], return_inverse=True, return_counts=True
+    )
+    amounts = np.zeros(len(mints), dtype=np.uint64)
+    np.add.at(amounts, inverse, accounts["amount"])
+    return mints, amounts, counts
+
+
+def get_portfolio(client, owner, include_empty=False):
+    """Holdings of a wallet over the Token and Token-2022 programs
+
+    Args:
+        client: solana.rpc.api.Client
+        owner: Wallet Pubkey
+        include_empty: Keep mints whose accounts are all empty
+
+    Returns:
+        List of Holding, Token program mints first
+    """
+    grouped = []
+    for program_id in TOKEN_PROGRAM_IDS:
+        _, accounts = fetch_token_accounts(client, owner, program_id=program_id)
+        accounts = accounts[accounts["state"] != ACCOUNT_STATE_UNINITIALIZED]
+        if not include_empty:
+            accounts = accounts[accounts["amount"] > 0]
+        if len(accounts):
+            grouped.append((program_id, sum_by_mint(accounts)))
+
+    mint_pubkeys = [
+        Pubkey(bytes(mint)) for _, (mints, _, _) in grouped for mint in mints
+    ]
+    decimals = fetch_mint_decimals(client, mint_pubkeys)
+
+    holdings = []
+    index = 0
+    for program_id, (mints, amounts, counts) in grouped:
+        for amount, count in zip(amounts.tolist(), counts.tolist()):
+            mint = mint_pubkeys[index]
+            holdings.append(Holding(mint, amount, decimals[mint], count, program_id))
+            index += 1
+    return holdings
+
+
+def get_token_balance(client, owner, mint):
+    """Exact balance of one mint over all of the owner's accounts of it
+
+    Returns:
+        (amount in base units, decimals)
+    """
+    _, accounts = fetch_token_accounts(client, owner, mint=mint)
+    amount = int(accounts["amount"].sum(dtype=np.uint64))
+    decimals = fetch_mint_decimals(client, [mint])[mint]
+    return amount, decimals
+
+
+if __name__ == "__main__":
+    # Mainnet RPC URL
+    rpc_url = "https://api.mainnet-beta.solana.com"
+    client = instrument_solana_client(solana_client(rpc_url))
+
+    # Replace with your address
+    address = ""
+
+    holdings = get_portfolio(client, Pubkey.from_string(address))
+    logger.info(f"Token count: {len(holdings)}")
+    for holding in holdings:
+        logger.info(
+            f"{holding.mint}: {ui_amount(holding)} "
+            f"({holding.accounts} accounts, program {holding.program_id})"
+        )
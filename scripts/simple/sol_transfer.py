@@ -3,44 +3,61 @@ import time
 import base58
 from solders.keypair import Keypair
 from solders.pubkey import Pubkey
-from solders.message import Message
-from solders.transaction import Transaction
-from solana.rpc.api import Client
 from solders.system_program import TransferParams, transfer
-from solana.rpc.types import TxOpts
 from loguru import logger
 
-rpc_url = "https://api.mainnet-beta.solana.com"
-client = Client(rpc_url)
-
-# Sender and recipient
-sender_private_key = ""
-recipient_address = ""
-
-sender: Keypair = Keypair.from_base58_string(sender_private_key)
-recipient_pubkey = Pubkey(base58.b58decode(recipient_address))
+from rpc_metrics import instrument_solana_client
+from rpc_router import solana_client
+from sol_blockhash_cache import get_blockhash_cache
+from sol_signature_poller import get_signature_poller, send_and_confirm
 
-# Set amount to transfer
-sol_amount = Decimal("0.001")
+rpc_url = "https://api.mainnet-beta.solana.com"
 sol_lamports = Decimal("1e+9")
 
-latest_blockhash = client.get_latest_blockhash()
-recent_blockhash = latest_blockhash.value.blockhash
 
-tx = Transaction(
-    from_keypairs=[sender],
-    message=Message(
-        instructions=[
+def transfer_sol(rpc_url, sender, recipient_pubkey, sol_amount, client=None):
+    """Send SOL and wait until it is confirmed
+
+    Args:
+        rpc_url: Solana RPC endpoint
+        sender: Sending Keypair, pays the fee
+        recipient_pubkey: Recipient Pubkey
+        sol_amount: Amount in SOL (Decimal)
+        client: solana.rpc.api.Client of rpc_url (default: a new one)
+
+    Returns:
+        SignatureStatus of the landed transaction
+    """
+    client = client or instrument_solana_client(solana_client(rpc_url))
+
+    # Blockhash comes from the background cache, no RPC round trip before sending
+    blockhash_cache = get_blockhash_cache(rpc_url)
+    # Statuses are read in batches shared with every other pending transaction
+    signature_poller = get_signature_poller(rpc_url)
+
+    # Re-signed with a fresh blockhash if it expires before landing
+    return send_and_confirm(
+        client,
+        blockhash_cache,
+        signature_poller,
+        [sender],
+        [
             transfer(TransferParams(from_pubkey=sender.pubkey(), to_pubkey=recipient_pubkey, lamports=int(sol_amount * sol_lamports))),
         ],
-        payer=sender.pubkey(),
-    ),
-    recent_blockhash=recent_blockhash,
-)
+        sender.pubkey(),
+    )
+
 
-tx_resp = client.send_transaction(tx, opts=TxOpts(skip_preflight=True))
-logger.info(f"Transaction signature: {tx_resp.value}")
+if __name__ == "__main__":
+    # Sender and recipient
+    sender_private_key = ""
+    recipient_address = ""
 
-client.confirm_transaction(tx_resp.value)
+    sender: Keypair = Keypair.from_base58_string(sender_private_key)
+    recipient_pubkey = Pubkey(base58.b58decode(recipient_address))
 
+    # Set amount to transfer
+    sol_amount = Decimal("0.001")
 
+    status = transfer_sol(rpc_url, sender, recipient_pubkey, sol_amount)
+    logger.info(f"Transaction signature: {status.signature}, slot {status.slot}")
@@ -0,0 +1,290 @@
+"""Decode raw Solana transactions in bulk
+
+Reads one base64 (or base58) encoded transaction per line from files or
+stdin, decodes chunks of lines on a process pool and writes two tables in
+input order:
+
+    transactions: index, signature, fee_payer, signers, program_ids, error
+    transfers:    tx_index, signature, instruction, program, source,
+                  destination, mint, amount
+
+Transfers are System Transfer (lamports) and SPL Token / Token-2022
+Transfer and TransferChecked (base units, mint only known for
+TransferChecked). Legacy and v0 transactions are decoded; accounts a v0
+transaction loads from an address lookup table can not be resolved offline
+and are left empty. A line that does not decode gets a row with its error.
+
+Output format follows the extension: .csv, .parquet or .arrow (the last two
+need pyarrow).
+
+Usage:
+    python sol_tx_decoder.py txs.b64 [more files] -o txs.parquet --transfers transfers.parquet
+    cat txs.b58 | python sol_tx_decoder.py - --encoding base58 -o txs.csv
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import base64
+import csv
+import fileinput
+import os
+import time
+
+import base58
+from loguru import logger
+from solders.transaction import VersionedTransaction
+
+SYSTEM_PROGRAM_ID = "11111111111111111111111111111111"
+TOKEN_PROGRAM_ID = "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA"
+TOKEN_2022_PROGRAM_ID = "TokenzQdBNbLqP5VEhdkAS6EPFLC1PHnBqCXEpPxuEb"
+TOKEN_PROGRAM_NAMES = {TOKEN_PROGRAM_ID: "spl-token", TOKEN_2022_PROGRAM_ID: "token-2022"}
+
+# Instruction discriminators
+SYSTEM_TRANSFER = 2  # u32 LE, then lamports u64 LE
+TOKEN_TRANSFER = 3  # u8, then amount u64 LE
+TOKEN_TRANSFER_CHECKED = 12  # u8, then amount u64 LE and decimals u8
+
+TRANSACTION_COLUMNS = ["index", "signature", "fee_payer", "signers", "program_ids", "error"]
+TRANSFER_COLUMNS = [
+    "tx_index",
+    "signature",
+    "instruction",
+    "program",
+    "source",
+    "destination",
+    "mint",
+    "amount",
+]
+
+
+def _u64(data, offset):
+    return int.from_bytes(data[offset : offset + 8], "little")
+
+
+def decode_transfers(keys, instructions):
+    """Yield (instruction index, program, source, destination, mint, amount)
+
+    Args:
+        keys: Static account keys of the message as strings
+        instructions: CompiledInstructions of the message
+    """
+
+    def key(index):
+        # Past the static keys: loaded from an address lookup table
+        return keys[index] if index < len(keys) else ""
+
+    for position, instruction in enumerate(instructions):
+        program_id = key(instruction.program_id_index)
+        data = instruction.data
+        accounts = instruction.accounts
+        if program_id == SYSTEM_PROGRAM_ID:
+            if (
+                len(data) >= 12
+                and int.from_bytes(data[:4], "little") == SYSTEM_TRANSFER
+                and len(accounts) >= 2
+            ):
+                yield position, "system", key(accounts[0]), key(accounts[1]), "", _u64(data, 4)
+        elif program_id in TOKEN_PROGRAM_NAMES and len(data) >= 9:
+            program = TOKEN_PROGRAM_NAMES[program_id]
+            if data[0] == TOKEN_TRANSFER and len(accounts) >= 2:
+                yield position, program, key(accounts[0]), key(accounts[1]), "", _u64(data, 1)
+            elif data[0] == TOKEN_TRANSFER_CHECKED and len(accounts) >= 3:
+                yield (
+                    position,
+                    program,
+                    key(accounts[0]),
+                    key(accounts[2]),
+                    key(accounts[1]),
+                    _u64(data, 1),
+                )
+
+
+def decode_chunk(lines, start_index, encoding="base64"):
+    """Decode a chunk of encoded transactions into column lists
+
+    Runs in the worker processes, columns pickle much smaller than objects.
+
+    Returns:
+        (transaction columns, transfer columns), dicts of column -> list
+    """
+    decode_text = base64.b64decode if encoding == "base64" else base58.b58decode
+    txs = {column: [] for column in TRANSACTION_COLUMNS}
+    transfers = {column: [] for column in TRANSFER_COLUMNS}
+    for index, line in enumerate(lines, start=start_index):
+        try:
+            tx = VersionedTransaction.from_bytes(decode_text(line))
+            message = tx.message
+            keys = [str(key) for key in message.account_keys]
+            signature = str(tx.signatures[0])
+            program_ids = []
+            for instruction in message.instructions:
+                index_key = instruction.program_id_index
+                program_id = keys[index_key] if index_key < len(keys) else ""
+                if program_id not in program_ids:
+                    program_ids.append(program_id)
+            found = list(decode_transfers(keys, message.instructions))
+        except Exception as e:
+            row = (index, "", "", [], [], f"{type(e).__name__}: {e}")
+        else:
+            signers = keys[: message.header.num_required_signatures]
+            row = (index, signature, keys[0], signers, program_ids, "")
+            for transfer in found:
+                for column, value in zip(TRANSFER_COLUMNS, (index, signature) + transfer):
+                    transfers[column].append(value)
+        for column, value in zip(TRANSACTION_COLUMNS, row):
+            txs[column].append(value)
+    return txs, transfers
+
+
+def read_lines(paths):
+    """Non-empty stripped lines of the files, "-" is stdin"""
+    with fileinput.input(files=paths or ["-"]) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def read_chunks(lines, chunk_size):
+    """Yield (index of the first line, lines)"""
+    chunk = []
+    start = 0
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == chunk_size:
+            yield start, chunk
+            start += chunk_size
+            chunk = []
+    if chunk:
+        yield start, chunk
+
+
+class CsvTableWriter:
+    def __init__(self, path, columns):
+        """CSV table, list values are joined with ";" """
+        self.columns = columns
+        self.file = open(path, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, table):
+        rows = zip(*(table[column] for column in self.columns))
+        self.writer.writerows(
+            [";".join(value) if isinstance(value, list) else value for value in row]
+            for row in rows
+        )
+
+    def close(self):
+        self.file.close()
+
+
+class ArrowTableWriter:
+    def __init__(self, path, schema):
+        """Parquet (.parquet) or Arrow IPC file (.arrow), one row group per chunk"""
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception("Parquet and Arrow output need pyarrow: pip install pyarrow")
+        self.pa = pyarrow
+        self.schema = pyarrow.schema(schema)
+        if path.endswith(".arrow"):
+            self.writer = pyarrow.ipc.new_file(path, self.schema)
+        else:
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, table):
+        if table[self.schema.names[0]]:
+            self.writer.write_table(self.pa.Table.from_pydict(table, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def open_table(path, kind):
+    """Writer for the transactions or transfers table, picked by extension"""
+    columns = TRANSACTION_COLUMNS if kind == "transactions" else TRANSFER_COLUMNS
+    if path.endswith(".parquet") or path.endswith(".arrow"):
+        import pyarrow as pa
+
+        if kind == "transactions":
+            types = [pa.int64(), pa.string(), pa.string(), pa.list_(pa.string()), pa.list_(pa.string()), pa.string()]
+        else:
+            types = [pa.int64(), pa.string(), pa.int32(), pa.string(), pa.string(), pa.string(), pa.string(), pa.uint64()]
+        return ArrowTableWriter(path, list(zip(columns, types)))
+    return CsvTableWriter(path, columns)
+
+
+def decode_stream(lines, encoding="base64", workers=None, chunk_size=1000):
+    """Yield (transaction columns, transfer columns) per chunk, in input order
+
+    Chunks go to a process pool with a bounded number in flight, so memory
+    stays flat however long the input is. workers=1 decodes in this process.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = read_chunks(lines, chunk_size)
+    if workers == 1:
+        for start, chunk in chunks:
+            yield decode_chunk(chunk, start, encoding)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for start, chunk in chunks:
+            in_flight.append(executor.submit(decode_chunk, chunk, start, encoding))
+            if len(in_flight) >= workers * 2:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def decode_files(paths, output, transfers_output=None, encoding="base64", workers=None, chunk_size=1000):
+    """Decode the transactions of paths into output (and transfers_output)
+
+    Returns:
+        dict of counters (transactions, failed, transfers, seconds)
+    """
+    stats = {"transactions": 0, "failed": 0, "transfers": 0}
+    tx_writer = open_table(output, "transactions")
+    transfer_writer = open_table(transfers_output, "transfers") if transfers_output else None
+    started = time.time()
+    try:
+        for txs, transfers in decode_stream(read_lines(paths), encoding, workers, chunk_size):
+            tx_writer.write(txs)
+            if transfer_writer is not None:
+                transfer_writer.write(transfers)
+            stats["transactions"] += len(txs["index"])
+            stats["failed"] += sum(1 for error in txs["error"] if error)
+            stats["transfers"] += len(transfers["tx_index"])
+    finally:
+        tx_writer.close()
+        if transfer_writer is not None:
+            transfer_writer.close()
+    stats["seconds"] = time.time() - started
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode raw Solana transactions in bulk")
+    parser.add_argument("paths", nargs="*", help='files with one transaction per line, "-" or none reads stdin')
+    parser.add_argument("-o", "--output", default="transactions.csv", help=".csv, .parquet or .arrow")
+    parser.add_argument("--transfers", help="transfers table (.csv, .parquet or .arrow)")
+    parser.add_argument("--encoding", choices=["base64", "base58"], default="base64")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="decoder processes")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="transactions per task")
+    args = parser.parse_args()
+
+    stats = decode_files(
+        args.paths, args.output, args.transfers, args.encoding, args.workers, args.chunk_size
+    )
+    rate = stats["transactions"] / stats["seconds"] if stats["seconds"] else 0
+    logger.info(
+        f"{stats['transactions']} transactions ({stats['failed']} failed), "
+        f"{stats['transfers']} transfers in {stats['seconds']:.1f}s: "
+        f"{rate:.0f} tx/s, {rate / args.workers:.0f} tx/s per worker"
+    )
+
+
+if __name__ == "__main__":
+    main()
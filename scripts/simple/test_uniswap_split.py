@@ -0,0 +1,61 @@
+"""plan_split over a fake pool graph of constant product pools
+
+A -> WETH goes through P1 only, WETH -> B through P2 (shallow, better price
+for a small amount) or P3 (deep). Both routes share P1, so the first chunk
+used to lock the order onto P2 and the split came out far below the best
+single route.
+"""
+from uniswap_route_finder import Route
+from uniswap_split import plan_legs, plan_split
+
+TOKEN_A = "0x" + "a" * 40
+WETH = "0x" + "e" * 40
+TOKEN_B = "0x" + "b" * 40
+# pool -> reserves per token
+POOLS = {
+    "P1": {TOKEN_A: 10**12, WETH: 10**12},
+    "P2": {WETH: 10**7, TOKEN_B: 15 * 10**6},
+    "P3": {WETH: 10**12, TOKEN_B: 10**12},
+}
+PATHS = [
+    Route((TOKEN_A, WETH, TOKEN_B), (3000, 500), ("P1", "P2"), None, None),
+    Route((TOKEN_A, WETH, TOKEN_B), (3000, 3000), ("P1", "P3"), None, None),
+]
+
+
+class FakeGraph:
+    def paths(self, token_in, token_out, max_hops):
+        return list(PATHS)
+
+    def quote_route(self, route, amount_in):
+        amount = amount_in
+        for token, neighbor, pool in zip(route.tokens, route.tokens[1:], route.pools):
+            reserve_in, reserve_out = POOLS[pool][token], POOLS[pool][neighbor]
+            amount = reserve_out * amount // (reserve_in + amount)
+        return route._replace(amount_out=amount, ticks_crossed=0)
+
+    def routes(self, token_in, token_out, amount_in, max_hops):
+        quoted = [self.quote_route(route, amount_in) for route in PATHS]
+        return sorted(quoted, key=lambda route: route.amount_out, reverse=True)
+
+
+def test_shared_pool_does_not_lock_in_the_first_chunk_route():
+    graph = FakeGraph()
+    amount_in = 10**7
+    # P2 is the better route for one chunk, P3 for the whole amount
+    assert graph.quote_route(PATHS[0], amount_in // 20).amount_out > graph.quote_route(
+        PATHS[1], amount_in // 20
+    ).amount_out
+    plan = plan_split(graph, TOKEN_A, TOKEN_B, amount_in)
+    assert plan.best_route.pools == ("P1", "P3")
+    assert plan.amount_out >= plan.baseline
+    assert [leg.route.pools for leg in plan.legs] == [("P1", "P3")]
+
+
+def test_plan_legs_falls_back_to_the_best_single_route():
+    plan = plan_split(FakeGraph(), TOKEN_A, TOKEN_B, 10**7)
+    worse = plan._replace(amount_out=plan.baseline - 1)
+    (leg,) = plan_legs(worse)
+    assert leg.route is plan.best_route
+    assert leg.amount_in == plan.amount_in
+    assert leg.amount_out == plan.baseline
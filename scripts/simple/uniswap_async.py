@@ -0,0 +1,572 @@
+from web3 import AsyncWeb3, Web3
+from eth_account import Account
+import asyncio
+
+from eth_abi_codec import (
+    decode_uint,
+    encode_approve,
+    encode_balance_of,
+    encode_exact_input_single,
+)
+from eth_confirmation_tracker import get_confirmation_tracker
+from eth_fee_oracle import get_fee_oracle
+from eth_gas_model import get_default_gas_model
+from eth_nonce_manager import get_nonce_manager, send_with_nonce_async
+from eth_token_cache import FALLBACK_TOKEN_METADATA, get_default_cache
+from rpc_metrics import instrument_web3, span
+from rpc_router import async_web3_provider
+from uniswap_multicall import fetch_swap_context_async
+from uniswap_fee_probe import rank_fee_tiers_async
+from uniswap_pool_index import get_default_index
+from uniswap_route_finder import MAX_HOPS, describe_route, get_pool_graph
+from uniswap_split import (
+    DEFAULT_MAX_LEGS,
+    DEFAULT_SWAP_GAS,
+    SplitLeg,
+    apply_slippage,
+    default_swap_gas,
+    describe_split,
+    encode_split_swap,
+    plan_legs,
+    plan_split,
+    split_gas_key_parts,
+)
+from uniswap_eth_for_token import FEE_TIERS as ETH_FEE_TIERS
+from uniswap_token_to_token import FEE_TIERS as TOKEN_FEE_TIERS
+from uniswap_token_to_token import FACTORY_ADDRESS, SWAP_ROUTER_ADDRESS
+
+class _AsyncSwapClient:
+    fee_tiers = TOKEN_FEE_TIERS
+
+    def __init__(
+        self,
+        rpc_url,
+        chain_id,
+        private_key,
+        token_cache=None,
+        pool_index=None,
+        receipt_poll_latency=1.0,
+        w3=None,
+        urgency="standard",
+        gas_model=None,
+    ):
+        # One AsyncWeb3 (and its HTTP session) can be shared by every client of
+        # the event loop, pass it as w3 to avoid a connection pool per wallet
+        self.w3 = w3 or instrument_web3(AsyncWeb3(async_web3_provider(rpc_url)))
+        self.account = Account.from_key(private_key)
+        self.chain_id = chain_id
+        self.token_cache = token_cache or get_default_cache()
+        self.pool_index = pool_index or get_default_index()
+        self.nonce_manager = get_nonce_manager(self.w3, self.account.address)
+        self.confirmation_tracker = get_confirmation_tracker(
+            self.w3, poll_interval=receipt_poll_latency
+        )
+        self.fee_oracle = get_fee_oracle(self.w3)
+        self.urgency = urgency
+        self.gas_model = gas_model or get_default_gas_model()
+
+    def _log(self, message):
+        # Many swaps share one stdout, tag every line with the wallet
+        print(f"[{self.account.address[:10]}] {message}")
+
+    async def get_token_name_and_decimals(self, token_address, allow_fallback=True):
+        """Get token name and decimals, see UniswapV3.get_token_name_and_decimals"""
+        token_address = Web3.to_checksum_address(token_address)
+        metadata = await self.token_cache.fetch_async(
+            self.w3, self.chain_id, [token_address]
+        )
+        if token_address in metadata:
+            return metadata[token_address]
+        if not allow_fallback:
+            raise Exception(f"Failed to get token info of {token_address}")
+        return FALLBACK_TOKEN_METADATA  # Default values
+
+    async def rank_pool_fees(self, token_in, token_out, amount_in, deadline=3.0):
+        """Quote every fee tier concurrently, see UniswapV3.rank_pool_fees"""
+        return await rank_fee_tiers_async(
+            self.w3,
+            self.pool_index,
+            FACTORY_ADDRESS,
+            token_in,
+            token_out,
+            amount_in,
+            self.fee_tiers,
+            deadline,
+        )
+
+    async def find_best_pool_fee(self, token_in, token_out, amount_in, deadline=3.0):
+        """Try to find the best pool fee rate
+
+        Returns:
+            (best fee, expected output in Wei of token_out)
+        """
+        ranking = await self.rank_pool_fees(token_in, token_out, amount_in, deadline)
+        for quote in ranking:
+            if quote.amount_out is None:
+                self._log(f"Fee {quote.fee/10000}%: {quote.error}")
+            else:
+                self._log(
+                    f"Fee {quote.fee/10000}%: pool {quote.pool_address}, "
+                    f"expected output {quote.amount_out}, "
+                    f"{quote.ticks_crossed} initialized ticks crossed, "
+                    f"pool state at block {quote.block_number}"
+                )
+
+        best_fee, best_amount_out = ranking[0].fee, ranking[0].amount_out or 0
+        if best_amount_out == 0:
+            raise Exception("No valid liquidity pool found for the token pair")
+        self._log(f"Selected best fee: {best_fee/10000}%")
+        return best_fee, best_amount_out
+
+    async def _send(self, transaction):
+        return await send_with_nonce_async(
+            self.nonce_manager, transaction, self.account.key
+        )
+
+    async def _wait_for_receipt(self, tx_hash, timeout=180):
+        # Awaiting the receipt only parks this coroutine, the loop keeps
+        # driving the other swaps meanwhile, and the shared tracker reads each
+        # block once for all of them
+        tx_receipt = await self.confirmation_tracker.wait_async(
+            tx_hash, timeout, nonce_manager=self.nonce_manager
+        )
+        self.nonce_manager.mark_confirmed(tx_hash)
+        return tx_receipt
+
+    async def _swap_exact_input_single(
+        self, params, value, symbol_out, decimals_out, approve_tx_hash=None
+    ):
+        gas_key = self.gas_model.key(
+            self.chain_id,
+            SWAP_ROUTER_ADDRESS,
+            "exactInputSingle",
+            params["tokenIn"],
+            params["tokenOut"],
+            params["fee"],
+        )
+        return await self._send_swap(
+            encode_exact_input_single(params),
+            gas_key,
+            value,
+            params["tokenOut"],
+            symbol_out,
+            decimals_out,
+            approve_tx_hash,
+        )
+
+    async def _send_swap(
+        self,
+        swap_data,
+        gas_key,
+        value,
+        token_out,
+        symbol_out,
+        decimals_out,
+        approve_tx_hash=None,
+        default_gas=DEFAULT_SWAP_GAS,
+    ):
+        with span("gas"):
+            fee_fields = await self.fee_oracle.fee_fields_async(self.urgency)
+
+            # Gas limit learned from earlier swaps, estimated only while the key
+            # has too few samples
+            if approve_tx_hash is not None and self.gas_model.suggest(gas_key) is None:
+                # Estimation would revert until the approval is mined
+                self._log("Approval pending, using default gas estimate")
+                gas_estimate = default_gas
+            else:
+                gas_estimate = await self.gas_model.limit_async(
+                    gas_key,
+                    lambda: self.w3.eth.estimate_gas(
+                        {
+                            "from": self.account.address,
+                            "to": SWAP_ROUTER_ADDRESS,
+                            "data": swap_data,
+                            "value": value,
+                        }
+                    ),
+                    default=default_gas,
+                )
+
+        transaction = {
+            "from": self.account.address,
+            "to": SWAP_ROUTER_ADDRESS,
+            "data": swap_data,
+            "nonce": 0,  # filled in by the nonce manager
+            "gas": gas_estimate,
+            **fee_fields,
+            "value": value,
+            "chainId": self.chain_id,
+        }
+        with span("send"):
+            tx_hash = await self._send(transaction)
+        self._log(f"Transaction submitted, hash: {tx_hash.hex()}")
+
+        try:
+            with span("confirm"):
+                tx_receipt = await self._wait_for_receipt(tx_hash)
+            if approve_tx_hash is not None:
+                # Mined before the swap (lower nonce)
+                self.nonce_manager.mark_confirmed(approve_tx_hash)
+        except Exception as e:
+            self._log(f"Error waiting for transaction confirmation: {str(e)}")
+            self._log(
+                f"You can check transaction status at: https://basescan.org/tx/{tx_hash.hex()}"
+            )
+            return None
+
+        self.gas_model.record(gas_key, tx_receipt, gas_estimate)
+        if tx_receipt["status"] != 1:
+            self._log("Transaction execution failed!")
+            return tx_receipt
+
+        balance = decode_uint(
+            await self.w3.eth.call(
+                {
+                    "to": token_out,
+                    "data": encode_balance_of(self.account.address),
+                }
+            )
+        )
+        self._log(
+            f"Transaction confirmed in block {tx_receipt['blockNumber']}, "
+            f"current {symbol_out} balance: {balance / (10 ** decimals_out)}"
+        )
+        return tx_receipt
+
+
+class AsyncUniswapV3(_AsyncSwapClient):
+    fee_tiers = ETH_FEE_TIERS
+
+    def __init__(
+        self,
+        rpc_url,
+        chain_id,
+        eth_token_address,
+        private_key,
+        token_cache=None,
+        pool_index=None,
+        receipt_poll_latency=1.0,
+        w3=None,
+        urgency="standard",
+        gas_model=None,
+    ):
+        """asyncio counterpart of UniswapV3
+
+        Args:
+            rpc_url: RPC URL of the blockchain node, for example: https://mainnet.base.org
+            chain_id: Chain ID (e.g. Base chain is 8453)
+            eth_token_address: ETH token address (e.g. 0x4200000000000000000000000000000000000006 for WETH)
+            private_key: User wallet private key
+            token_cache: TokenMetadataCache (default: the process wide cache)
+            pool_index: PoolIndex (default: the process wide index)
+            receipt_poll_latency: Seconds between block polls of the shared
+                confirmation tracker (only when this client creates it)
+            w3: AsyncWeb3 to share between clients (default: a new one for rpc_url)
+            urgency: Fee level of the swaps, "slow", "standard" or "fast"
+            gas_model: GasModel (default: the process wide model)
+        """
+        super().__init__(
+            rpc_url,
+            chain_id,
+            private_key,
+            token_cache,
+            pool_index,
+            receipt_poll_latency,
+            w3,
+            urgency,
+            gas_model,
+        )
+        self.eth_token_address = Web3.to_checksum_address(eth_token_address)
+
+    async def swap_eth_for_token(
+        self, eth_amount, target_token_address, slippage_percent=1.0
+    ):
+        """
+        Swap ETH for target token, same semantics as UniswapV3.swap_eth_for_token
+
+        Args:
+            eth_amount: Amount of ETH to swap (in ETH units, not Wei)
+            slippage_percent: Slippage percentage (default 1%)
+
+        Returns:
+            Transaction receipt, None when it was not confirmed
+        """
+        target_token_address = Web3.to_checksum_address(target_token_address)
+        cached_metadata = self.token_cache.get(self.chain_id, target_token_address)
+        with span("metadata"):
+            context = await fetch_swap_context_async(
+                self.w3,
+                self.account.address,
+                self.eth_token_address,
+                target_token_address,
+                SWAP_ROUTER_ADDRESS,
+                FACTORY_ADDRESS,
+                [],  # pool addresses come from the pool index
+                native_in=True,
+                metadata_tokens=[] if cached_metadata else [target_token_address],
+            )
+        try:
+            token_name, token_symbol, token_decimals = self.token_cache.resolve(
+                self.chain_id, target_token_address, context
+            )
+        except Exception as e:
+            self._log(f"Failed to get token info: {str(e)}")
+            token_name, token_symbol, token_decimals = FALLBACK_TOKEN_METADATA
+
+        eth_balance_result = context[("eth_balance", self.account.address)]
+        if eth_balance_result.success:
+            eth_balance = eth_balance_result.value
+        else:
+            eth_balance = await self.w3.eth.get_balance(self.account.address)
+        eth_balance_formatted = self.w3.from_wei(eth_balance, "ether")
+        if eth_balance_formatted < eth_amount:
+            raise Exception(
+                f"Warning: Insufficient ETH balance! Current balance: {eth_balance_formatted} ETH"
+            )
+
+        amount_in_wei = self.w3.to_wei(eth_amount, "ether")
+        with span("quote"):
+            best_fee, amount_out_quote = await self.find_best_pool_fee(
+                self.eth_token_address, target_token_address, amount_in_wei
+            )
+        min_amount_out = amount_out_quote * int((100 - slippage_percent) * 100) // 10000
+
+        self._log(
+            f"Swapping {eth_amount} ETH for at least "
+            f"{min_amount_out / (10 ** token_decimals)} {token_symbol}"
+        )
+        params = {
+            "tokenIn": self.eth_token_address,
+            "tokenOut": target_token_address,
+            "fee": best_fee,
+            "recipient": self.account.address,
+            "amountIn": amount_in_wei,
+            "amountOutMinimum": min_amount_out,
+            "sqrtPriceLimitX96": 0,
+        }
+        return await self._swap_exact_input_single(
+            params, amount_in_wei, token_symbol, token_decimals
+        )
+
+
+class AsyncBaseUniswapV3(_AsyncSwapClient):
+    def __init__(
+        self,
+        rpc_url,
+        chain_id,
+        private_key,
+        token_cache=None,
+        pool_index=None,
+        receipt_poll_latency=1.0,
+        w3=None,
+        urgency="standard",
+        gas_model=None,
+        pool_graph=None,
+        max_hops=MAX_HOPS,
+        max_legs=DEFAULT_MAX_LEGS,
+    ):
+        """asyncio counterpart of BaseUniswapV3, arguments as AsyncUniswapV3"""
+        super().__init__(
+            rpc_url,
+            chain_id,
+            private_key,
+            token_cache,
+            pool_index,
+            receipt_poll_latency,
+            w3,
+            urgency,
+            gas_model,
+        )
+        self.pool_graph = pool_graph or get_pool_graph(
+            self.w3, self.pool_index, FACTORY_ADDRESS, self.fee_tiers
+        )
+        self.max_hops = max_hops
+        self.max_legs = max_legs
+
+    def _symbols(self, tokens):
+        symbols = {}
+        for token in tokens:
+            metadata = self.token_cache.get(self.chain_id, token)
+            if metadata is not None:
+                symbols[token] = metadata[1]
+        return symbols
+
+    async def find_best_route(self, token_in, token_out, amount_in):
+        """Find the route with the best output, see BaseUniswapV3.find_best_route"""
+        routes = await self.pool_graph.find_routes_async(
+            self.w3, token_in, token_out, amount_in, self.max_hops
+        )
+        if not routes:
+            raise Exception("No valid liquidity pool found for the token pair")
+        self._log(
+            f"Selected route {describe_route(routes[0], self._symbols(routes[0].tokens))} "
+            f"of {len(routes)}, expected output {routes[0].amount_out}"
+        )
+        return routes[0]
+
+    async def plan_split_swap(self, token_in, token_out, amount_in):
+        """Split an order over fee tiers and routes, see BaseUniswapV3.plan_split_swap"""
+        await self.pool_graph.load_async(self.w3, [token_in, token_out])
+        plan = plan_split(
+            self.pool_graph, token_in, token_out, amount_in, self.max_hops, max_legs=self.max_legs
+        )
+        symbols = self._symbols({token for leg in plan.legs for token in leg.route.tokens})
+        metadata_out = self.token_cache.get(self.chain_id, token_out)
+        decimals_out = metadata_out[2] if metadata_out is not None else None
+        for line in describe_split(plan, symbols, decimals_out):
+            self._log(line)
+        return plan
+
+    async def swap(
+        self,
+        source_token_address,
+        target_token_address,
+        source_token_amount,
+        slippage_percent=1.0,
+        split=False,
+    ):
+        """
+        Swap source token for target token, same semantics as BaseUniswapV3.swap
+
+        Parameters:
+            source_token_address: Source token address
+            target_token_address: Target token address
+            source_token_amount: Amount of source token to swap (in source token units, not Wei)
+            slippage_percent: Slippage percentage (default 1%)
+            split: Spread a large order over fee tiers and routes (one transaction)
+
+        Returns:
+            Transaction receipt, None when it was not confirmed
+        """
+        source_token_address = Web3.to_checksum_address(source_token_address)
+        target_token_address = Web3.to_checksum_address(target_token_address)
+
+        with span("metadata"):
+            context = await fetch_swap_context_async(
+                self.w3,
+                self.account.address,
+                source_token_address,
+                target_token_address,
+                SWAP_ROUTER_ADDRESS,
+                FACTORY_ADDRESS,
+                [],  # pool addresses come from the pool index
+                metadata_tokens=[
+                    token_address
+                    for token_address in (source_token_address, target_token_address)
+                    if self.token_cache.get(self.chain_id, token_address) is None
+                ],
+            )
+        source_token_name, source_token_symbol, source_token_decimals = (
+            self.token_cache.resolve(self.chain_id, source_token_address, context)
+        )
+        target_token_name, target_token_symbol, target_token_decimals = (
+            self.token_cache.resolve(self.chain_id, target_token_address, context)
+        )
+
+        balance_result = context[("balance", source_token_address)]
+        if not balance_result.success:
+            raise Exception(
+                f"Failed to read {source_token_symbol} balance: {balance_result.error}"
+            )
+        source_token_balance = balance_result.value
+        amount_in_wei = int(source_token_amount * (10**source_token_decimals))
+        if source_token_balance < amount_in_wei:
+            raise Exception(
+                f"Insufficient {source_token_symbol} balance. Required: {source_token_amount}, "
+                f"Current balance: {source_token_balance / (10**source_token_decimals)}"
+            )
+
+        # The swap takes the next nonce, so it is sent right behind the approval
+        # instead of waiting for the approval to be mined
+        allowance_result = context[("allowance", source_token_address)]
+        allowance = allowance_result.value if allowance_result.success else 0
+        approve_tx_hash = None
+        if allowance < amount_in_wei:
+            with span("approve"):
+                approve_tx_hash = await self._approve(
+                    source_token_address, source_token_symbol, amount_in_wei
+                )
+        with span("quote"):
+            if split:
+                legs = plan_legs(
+                    await self.plan_split_swap(
+                        source_token_address, target_token_address, amount_in_wei
+                    )
+                )
+            else:
+                route = await self.find_best_route(
+                    source_token_address, target_token_address, amount_in_wei
+                )
+                legs = [SplitLeg(route, amount_in_wei, route.amount_out)]
+        min_amount_out = sum(apply_slippage(leg.amount_out, slippage_percent) for leg in legs)
+
+        self._log(
+            f"Swapping {source_token_amount} {source_token_symbol} for at least "
+            f"{min_amount_out / (10 ** target_token_decimals)} {target_token_symbol}"
+        )
+        gas_key = self.gas_model.key(
+            self.chain_id, SWAP_ROUTER_ADDRESS, *split_gas_key_parts(legs)
+        )
+        return await self._send_swap(
+            encode_split_swap(legs, self.account.address, slippage_percent),
+            gas_key,
+            0,
+            target_token_address,
+            target_token_symbol,
+            target_token_decimals,
+            approve_tx_hash,
+            default_gas=default_swap_gas(legs),
+        )
+
+    async def _approve(self, token_address, token_symbol, amount):
+        self._log(f"Need to approve {token_symbol}...")
+        approve_key = self.gas_model.key(self.chain_id, token_address, "approve")
+        approve_gas = self.gas_model.suggest(approve_key) or 100000
+        approve_txn = {
+            "from": self.account.address,
+            "to": token_address,
+            # Only approve the amount needed
+            "data": encode_approve(SWAP_ROUTER_ADDRESS, amount),
+            "nonce": 0,  # filled in by the nonce manager
+            "gas": approve_gas,
+            **await self.fee_oracle.fee_fields_async(self.urgency),
+            "chainId": self.chain_id,
+        }
+        approve_tx_hash = await self._send(approve_txn)
+        self._log(f"Approval transaction sent, hash: {approve_tx_hash.hex()}")
+        self.gas_model.record_when_mined(
+            self.confirmation_tracker, approve_tx_hash, approve_key, approve_gas
+        )
+        return approve_tx_hash
+
+
+async def main():
+    rpc_url = "https://mainnet.base.org"  # Base chain RPC URL
+    chain_id = 8453
+    private_keys = []  # Replace with your private keys, one swap per wallet
+    source_token_address = "0x4200000000000000000000000000000000000006"  # WETH
+    target_token_address = "0x833589fCD6eDb6E08f4c7C32D4f71b54bdA02913"  # USDC
+
+    w3 = instrument_web3(AsyncWeb3(async_web3_provider(rpc_url)))
+    clients = [
+        AsyncUniswapV3(rpc_url, chain_id, source_token_address, private_key, w3=w3)
+        for private_key in private_keys
+    ]
+    results = await asyncio.gather(
+        *(
+            client.swap_eth_for_token(
+                eth_amount=0.000001,
+                target_token_address=target_token_address,
+                slippage_percent=1.0,
+            )
+            for client in clients
+        ),
+        return_exceptions=True,
+    )
+    for client, result in zip(clients, results):
+        print(f"{client.account.address}: {result}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
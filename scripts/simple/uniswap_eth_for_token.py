@@ -1,11 +1,40 @@
 from web3 import Web3
 from eth_account import Account
-import json
 import time
 
+from eth_abi_codec import decode_uint, encode_balance_of, encode_exact_input_single
+from eth_batching_provider import get_batching_web3
+from eth_confirmation_tracker import get_confirmation_tracker
+from eth_fee_oracle import describe_fees, get_fee_oracle
+from eth_gas_model import get_default_gas_model
+from eth_nonce_manager import get_nonce_manager, send_with_nonce
+from eth_token_cache import FALLBACK_TOKEN_METADATA, get_default_cache
+from rpc_metrics import span
+from uniswap_multicall import fetch_swap_context
+from uniswap_fee_probe import rank_fee_tiers
+from uniswap_pool_index import get_default_index
+
+# Uniswap V3 Factory address
+FACTORY_ADDRESS = Web3.to_checksum_address("0x33128a8fC17869897dcE68Ed026d694621f6FDfD")
+# Uniswap V3 SwapRouter address
+SWAP_ROUTER_ADDRESS = Web3.to_checksum_address(
+    "0x2626664c2603336E57B271c5C0b26F421741e481"
+)
+FEE_TIERS = [100, 500, 2500, 10000]  # 0.01%, 0.05%, 0.25%, 1%
+
 
 class UniswapV3:
-    def __init__(self, rpc_url, chain_id, eth_token_address, private_key):
+    def __init__(
+        self,
+        rpc_url,
+        chain_id,
+        eth_token_address,
+        private_key,
+        token_cache=None,
+        pool_index=None,
+        urgency="standard",
+        gas_model=None,
+    ):
         """Initialize UniswapV3 trading class
 
         Args:
@@ -13,129 +42,98 @@ class UniswapV3:
             chain_id: Chain ID (e.g. Base chain is 8453)
             eth_token_address: ETH token address (e.g. 0x4200000000000000000000000000000000000006 for WETH)
             private_key: User wallet private key
+            token_cache: TokenMetadataCache (default: the process wide cache)
+            pool_index: PoolIndex (default: the process wide index)
+            urgency: Fee level of the swaps, "slow", "standard" or "fast"
+            gas_model: GasModel (default: the process wide model)
         """
         # Initialize Web3 connection to Base chain
-        self.w3 = Web3(Web3.HTTPProvider(rpc_url))
+        self.w3 = get_batching_web3(rpc_url)
         self.account = Account.from_key(private_key)
         self.chain_id = chain_id
         self.eth_token_address = Web3.to_checksum_address(eth_token_address)
+        self.token_cache = token_cache or get_default_cache()
+        # Pool address index shared with the other swap class
+        self.pool_index = pool_index or get_default_index()
+        # Local nonce sequence, lets transactions go out without waiting for
+        # the previous receipt
+        self.nonce_manager = get_nonce_manager(self.w3, self.account.address)
+        # Follows blocks once for every pending transaction of this endpoint
+        self.confirmation_tracker = get_confirmation_tracker(self.w3)
+        # EIP-1559 fees from the endpoint's cached fee history
+        self.fee_oracle = get_fee_oracle(self.w3)
+        self.urgency = urgency
+        # Gas limits learned from earlier receipts
+        self.gas_model = gas_model or get_default_gas_model()
+
+    def get_token_name_and_decimals(self, token_address, allow_fallback=True):
+        """Get token name and decimals
+
+        Metadata comes from the shared token cache, a miss is read in a single
+        Multicall3 round trip and cached.
 
-    def get_token_name_and_decimals(self, token_address):
-        """Get token name and decimals"""
-        try:
-            # Basic ERC20 ABI
-            erc20_abi = json.loads(
-                """[
-                {"constant":true,"inputs":[],"name":"name","outputs":[{"name":"","type":"string"}],"payable":false,"stateMutability":"view","type":"function"},
-                {"constant":true,"inputs":[],"name":"decimals","outputs":[{"name":"","type":"uint8"}],"payable":false,"stateMutability":"view","type":"function"},
-                {"constant":true,"inputs":[],"name":"symbol","outputs":[{"name":"","type":"string"}],"payable":false,"stateMutability":"view","type":"function"}
-            ]"""
-            )
+        Args:
+            token_address: Token address
+            allow_fallback: Return FALLBACK_TOKEN_METADATA instead of raising
+                when the metadata can not be read
+        """
+        token_address = Web3.to_checksum_address(token_address)
+        metadata = self.token_cache.fetch(self.w3, self.chain_id, [token_address])
+        if token_address in metadata:
+            return metadata[token_address]
+        if not allow_fallback:
+            raise Exception(f"Failed to get token info of {token_address}")
+        return FALLBACK_TOKEN_METADATA  # Default values
+
+    def rank_pool_fees(self, token_in, token_out, amount_in, deadline=3.0):
+        """Quote every fee tier concurrently
+
+        Pool addresses come from the pool index and only live pool state is
+        read from chain, all tiers in parallel. Pools quoted before are kept
+        current from their logs (uniswap_pool_state.py) and cost no RPC. The
+        output of each pool is quoted exactly by simulating the swap over its
+        initialized ticks.
 
-            token_contract = self.w3.eth.contract(address=token_address, abi=erc20_abi)
-            name = token_contract.functions.name().call()
-            symbol = token_contract.functions.symbol().call()
-            decimals = token_contract.functions.decimals().call()
-            return name, symbol, decimals
-        except Exception as e:
-            print(f"Failed to get token info: {str(e)}")
-            return "Unknown", "???", 18  # Default values
-
-    def find_best_pool_fee(self, token_in, token_out, amount_in):
-        """Try to find the best pool fee rate"""
-        fee_tiers = [100, 500, 2500, 10000]  # 0.01%, 0.05%, 0.25%, 1%
-        best_fee = 2500  # Default fee 0.25%
-        best_amount_out = 0
-
-        # Uniswap V3 Factory address
-        factory_address = "0x33128a8fC17869897dcE68Ed026d694621f6FDfD"
-
-        # Factory ABI
-        factory_abi = """[{
-            "inputs": [
-                {"internalType": "address", "name": "tokenA", "type": "address"},
-                {"internalType": "address", "name": "tokenB", "type": "address"},
-                {"internalType": "uint24", "name": "fee", "type": "uint24"}
-            ],
-            "name": "getPool",
-            "outputs": [{"internalType": "address", "name": "", "type": "address"}],
-            "stateMutability": "view",
-            "type": "function"
-        }]"""
-
-        # Pool ABI
-        pool_abi = """[{
-            "inputs": [],
-            "name": "slot0",
-            "outputs": [
-                {"internalType": "uint160", "name": "sqrtPriceX96", "type": "uint160"},
-                {"internalType": "int24", "name": "tick", "type": "int24"},
-                {"internalType": "uint16", "name": "observationIndex", "type": "uint16"},
-                {"internalType": "uint16", "name": "observationCardinality", "type": "uint16"},
-                {"internalType": "uint16", "name": "observationCardinalityNext", "type": "uint16"},
-                {"internalType": "uint8", "name": "feeProtocol", "type": "uint8"},
-                {"internalType": "bool", "name": "unlocked", "type": "bool"}
-            ],
-            "stateMutability": "view",
-            "type": "function"
-        }, {
-            "inputs": [],
-            "name": "liquidity",
-            "outputs": [{"internalType": "uint128", "name": "", "type": "uint128"}],
-            "stateMutability": "view",
-            "type": "function"
-        }]"""
-
-        factory = self.w3.eth.contract(
-            address=Web3.to_checksum_address(factory_address), abi=factory_abi
+        Args:
+            token_in: Source token address
+            token_out: Target token address
+            amount_in: Input amount in Wei
+            deadline: Seconds to wait for the slowest tier
+
+        Returns:
+            List of FeeTierQuote for every tier, best expected output first
+        """
+        return rank_fee_tiers(
+            self.w3,
+            self.pool_index,
+            FACTORY_ADDRESS,
+            token_in,
+            token_out,
+            amount_in,
+            FEE_TIERS,
+            deadline,
         )
 
+    def find_best_pool_fee(self, token_in, token_out, amount_in, deadline=3.0):
+        """Try to find the best pool fee rate
+
+        Returns:
+            (best fee, expected output in Wei of token_out)
+        """
         print("\nStarting to find best liquidity pool...")
-        for fee in fee_tiers:
-            try:
-                # Get pool address
-                pool_address = factory.functions.getPool(
-                    Web3.to_checksum_address(token_in),
-                    Web3.to_checksum_address(token_out),
-                    fee,
-                ).call()
-                if pool_address == "0x0000000000000000000000000000000000000000":
-                    print(f"Fee {fee/10000}% has no liquidity pool")
-                    continue
-
-                pool = self.w3.eth.contract(
-                    address=Web3.to_checksum_address(pool_address), abi=pool_abi
-                )
-                # Get pool liquidity
-                liquidity = pool.functions.liquidity().call()
-
-                # Get current price
-                slot0 = pool.functions.slot0().call()
-                sqrt_price_x96 = slot0[0]
-                # If pool has liquidity, calculate expected output
-                if liquidity > 0:
-                    # Use simple price calculation (this is an approximation)
-                    price = (sqrt_price_x96**2) / (2**192)
-                    amount_out = (amount_in * price) * (
-                        1 - fee / 1000000
-                    )  # Consider fee
-
-                    print(f"Fee {fee/10000}%:")
-                    print(f"- Pool address: {pool_address}")
-                    print(f"- Liquidity: {liquidity}")
-                    print(f"- Expected output: {amount_out}")
-
-                    if amount_out > best_amount_out:
-                        best_amount_out = amount_out
-                        best_fee = fee
-                        break
-                else:
-                    print(f"Fee {fee/10000}% has no liquidity")
-
-            except Exception as e:
-                print(f"Error querying fee {fee/10000}%: {str(e)}")
+        ranking = self.rank_pool_fees(token_in, token_out, amount_in, deadline)
+        for quote in ranking:
+            if quote.amount_out is None:
+                print(f"Fee {quote.fee/10000}%: {quote.error}")
                 continue
-
+            print(f"Fee {quote.fee/10000}%:")
+            print(f"- Pool address: {quote.pool_address}")
+            print(f"- Liquidity: {quote.liquidity}")
+            print(f"- Expected output: {quote.amount_out}")
+            print(f"- Initialized ticks crossed: {quote.ticks_crossed}")
+            print(f"- Pool state at block: {quote.block_number}")
+
+        best_fee, best_amount_out = ranking[0].fee, ranking[0].amount_out or 0
         if best_amount_out == 0:
             print("\nWarning: Could not find any valid liquidity pool")
             print("Please check:")
@@ -159,13 +157,36 @@ class UniswapV3:
             slippage_percent: Slippage percentage (default 1%)
         """
         target_token_address = Web3.to_checksum_address(target_token_address)
+        # Read token info, ETH balance and pools of every fee tier in one round trip,
+        # token info is skipped when already cached
+        cached_metadata = self.token_cache.get(self.chain_id, target_token_address)
+        with span("metadata"):
+            context = fetch_swap_context(
+                self.w3,
+                self.account.address,
+                self.eth_token_address,
+                target_token_address,
+                SWAP_ROUTER_ADDRESS,
+                FACTORY_ADDRESS,
+                [],  # pool addresses come from the pool index
+                native_in=True,
+                metadata_tokens=[] if cached_metadata else [target_token_address],
+            )
         # Get target token info
-        token_name, token_symbol, _ = self.get_token_name_and_decimals(
-            target_token_address
-        )
+        try:
+            token_name, token_symbol, token_decimals = self.token_cache.resolve(
+                self.chain_id, target_token_address, context
+            )
+        except Exception as e:
+            print(f"Failed to get token info: {str(e)}")
+            token_name, token_symbol, token_decimals = FALLBACK_TOKEN_METADATA
         print(f"Target token: {token_name} ({token_symbol})")
         # Check ETH balance
-        eth_balance = self.w3.eth.get_balance(self.account.address)
+        eth_balance_result = context[("eth_balance", self.account.address)]
+        if eth_balance_result.success:
+            eth_balance = eth_balance_result.value
+        else:
+            eth_balance = self.w3.eth.get_balance(self.account.address)
         eth_balance_formatted = self.w3.from_wei(eth_balance, "ether")
         print(f"Current account ETH balance: {eth_balance_formatted} ETH")
         # Ensure sufficient balance
@@ -177,86 +198,16 @@ class UniswapV3:
         # Convert ETH to Wei
         amount_in_wei = self.w3.to_wei(eth_amount, "ether")
 
-        # Get token info
-        _, token_symbol, token_decimals = self.get_token_name_and_decimals(
-            target_token_address
-        )
-
         # Find best fee rate
-        best_fee, amount_out_quote = self.find_best_pool_fee(
-            self.eth_token_address, target_token_address, amount_in_wei
-        )
+        with span("quote"):
+            best_fee, amount_out_quote = self.find_best_pool_fee(
+                self.eth_token_address,
+                target_token_address,
+                amount_in_wei,
+            )
 
         # Calculate minimum output considering slippage
-        min_amount_out = int(amount_out_quote * (100 - slippage_percent) / 100)
-
-        # Use SwapRouter
-        swap_router_address = Web3.to_checksum_address(
-            "0x2626664c2603336E57B271c5C0b26F421741e481"
-        )
-        swap_router_abi = json.loads(
-            """[
-            {
-                "inputs": [
-                    {
-                        "components": [
-                            {
-                                "internalType": "address",
-                                "name": "tokenIn",
-                                "type": "address"
-                            },
-                            {
-                                "internalType": "address",
-                                "name": "tokenOut",
-                                "type": "address"
-                            },
-                            {
-                                "internalType": "uint24",
-                                "name": "fee",
-                                "type": "uint24"
-                            },
-                            {
-                                "internalType": "address",
-                                "name": "recipient",
-                                "type": "address"
-                            },
-                            {
-                                "internalType": "uint256",
-                                "name": "amountIn",
-                                "type": "uint256"
-                            },
-                            {
-                                "internalType": "uint256",
-                                "name": "amountOutMinimum",
-                                "type": "uint256"
-                            },
-                            {
-                                "internalType": "uint160",
-                                "name": "sqrtPriceLimitX96",
-                                "type": "uint160"
-                            }
-                        ],
-                        "internalType": "struct ISwapRouter.ExactInputSingleParams",
-                        "name": "params",
-                        "type": "tuple"
-                    }
-                ],
-                "name": "exactInputSingle",
-                "outputs": [
-                    {
-                        "internalType": "uint256",
-                        "name": "amountOut",
-                        "type": "uint256"
-                    }
-                ],
-                "stateMutability": "payable",
-                "type": "function"
-            }
-        ]"""
-        )
-        swap_router = self.w3.eth.contract(
-            address=swap_router_address, abi=swap_router_abi
-        )
+        min_amount_out = amount_out_quote * int((100 - slippage_percent) * 100) // 10000
 
         # Build transaction parameters
         params = {
@@ -268,32 +219,47 @@ class UniswapV3:
             "amountOutMinimum": min_amount_out,
             "sqrtPriceLimitX96": 0,
         }
-
-        # Get current gas price
-        gas_price = self.w3.eth.gas_price
-        gas_price_adjusted = int(gas_price * 1.2)
-
-        # Estimate gas usage
-        gas_estimate = 400000  # Default estimate
-        try:
-            gas_estimate = swap_router.functions.exactInputSingle(params).estimate_gas(
-                {"from": self.account.address, "value": amount_in_wei}
+        # Precompiled calldata, no ABI parsing or contract object per swap
+        swap_data = encode_exact_input_single(params)
+
+        # Get current fees
+        with span("gas"):
+            fee_fields = self.fee_oracle.fee_fields(self.urgency)
+
+            # Gas limit learned from earlier swaps of this pair and fee tier, the
+            # node only estimates a key without enough samples
+            gas_key = self.gas_model.key(
+                self.chain_id,
+                SWAP_ROUTER_ADDRESS,
+                "exactInputSingle",
+                self.eth_token_address,
+                target_token_address,
+                best_fee,
+            )
+            gas_estimate = self.gas_model.limit(
+                gas_key,
+                lambda: self.w3.eth.estimate_gas(
+                    {
+                        "from": self.account.address,
+                        "to": SWAP_ROUTER_ADDRESS,
+                        "data": swap_data,
+                        "value": amount_in_wei,
+                    }
+                ),
+                default=400000,  # Default estimate
             )
-            gas_estimate = int(gas_estimate * 1.2)
-        except Exception as e:
-            print(f"Gas estimation failed, using default value: {str(e)}")
 
         # Build transaction
-        transaction = swap_router.functions.exactInputSingle(params).build_transaction(
-            {
-                "from": self.account.address,
-                "nonce": self.w3.eth.get_transaction_count(self.account.address),
-                "gas": gas_estimate,
-                "gasPrice": gas_price_adjusted,
-                "value": amount_in_wei,  # Send ETH
-                "chainId": self.chain_id,
-            }
-        )
+        transaction = {
+            "from": self.account.address,
+            "to": SWAP_ROUTER_ADDRESS,
+            "data": swap_data,
+            "nonce": 0,  # filled in by the nonce manager
+            "gas": gas_estimate,
+            **fee_fields,
+            "value": amount_in_wei,  # Send ETH
+            "chainId": self.chain_id,
+        }
 
         # Output transaction info
         print(f"Preparing to swap {eth_amount} ETH for {token_symbol}")
@@ -301,34 +267,35 @@ class UniswapV3:
             f"Expected minimum: {min_amount_out / (10 ** token_decimals)} {token_symbol}"
         )
         print(f"Gas estimate: {gas_estimate} units")
-        print(f"Gas price: {self.w3.from_wei(gas_price_adjusted, 'gwei')} Gwei")
+        print(f"Gas price: {describe_fees(self.w3, fee_fields)}")
 
         # Sign and send transaction
-        signed_txn = self.w3.eth.account.sign_transaction(transaction, self.account.key)
-
-        print("Transaction signed, sending...")
-        tx_hash = self.w3.eth.send_raw_transaction(signed_txn.raw_transaction)
+        print("Signing and sending transaction...")
+        with span("send"):
+            tx_hash = send_with_nonce(self.nonce_manager, transaction, self.account.key)
         print(f"Transaction submitted, hash: {tx_hash.hex()}")
 
         try:
             print("Waiting for transaction confirmation...")
-            tx_receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash, timeout=180)
+            with span("confirm"):
+                tx_receipt = self.confirmation_tracker.wait(
+                    tx_hash, timeout=180, nonce_manager=self.nonce_manager
+                )
+            self.nonce_manager.mark_confirmed(tx_hash)
+            self.gas_model.record(gas_key, tx_receipt, gas_estimate)
             print(f"Transaction confirmed in block {tx_receipt['blockNumber']}")
 
             if tx_receipt["status"] == 1:
                 print("Transaction executed successfully!")
                 # Query received token amount
-                erc20_abi = json.loads(
-                    """[
-                    {"constant":true,"inputs":[{"name":"_owner","type":"address"}],"name":"balanceOf","outputs":[{"name":"balance","type":"uint256"}],"payable":false,"stateMutability":"view","type":"function"}
-                ]"""
-                )
-                token_contract = self.w3.eth.contract(
-                    address=target_token_address, abi=erc20_abi
+                balance = decode_uint(
+                    self.w3.eth.call(
+                        {
+                            "to": target_token_address,
+                            "data": encode_balance_of(self.account.address),
+                        }
+                    )
                 )
-                balance = token_contract.functions.balanceOf(
-                    self.account.address
-                ).call()
                 print(
                     f"Current {token_symbol} balance: {balance / (10 ** token_decimals)}"
                 )
@@ -0,0 +1,184 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+import asyncio
+import threading
+
+from web3 import Web3
+
+from uniswap_pool_index import load_pool_states, load_pool_states_async
+from uniswap_pool_state import get_pool_state_tracker
+from uniswap_v3_math import (
+    load_pool_snapshots,
+    load_pool_snapshots_async,
+    quote_exact_input,
+)
+
+# Result of probing one fee tier; amount_out is None when the tier can not be used,
+# block_number is the block the pool state was valid at
+FeeTierQuote = namedtuple(
+    "FeeTierQuote",
+    ["fee", "pool_address", "liquidity", "amount_out", "ticks_crossed", "error", "block_number"],
+    defaults=[None],
+)
+
+# Shared by every probe so concurrent swaps don't each spin up threads
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="fee-probe")
+
+# Last seen tick of each pool, lets a warm probe skip the slot0 round trip
+_tick_hints = {}
+_tick_hints_lock = threading.Lock()
+
+
+def probe_fee_tier(w3, pool_index, factory, token_in, token_out, fee, amount_in):
+    """Quote one fee tier exactly
+
+    A pool the endpoint's pool state tracker follows is quoted from memory
+    without RPC. Otherwise a pool seen before is quoted in two round trips
+    (snapshot), an unknown one needs one more to read its current tick
+    first, and the snapshot is handed to the tracker.
+    """
+    pool_address = pool_index.get(factory, token_in, token_out, fee)
+    if pool_address is None:
+        return FeeTierQuote(fee, None, 0, None, 0, "no liquidity pool")
+    tracker = get_pool_state_tracker(w3)
+    state = tracker.get(pool_address)
+    if state is not None:
+        return _quote_snapshot(fee, pool_address, *state, token_in, token_out, amount_in)
+
+    with _tick_hints_lock:
+        tick_hint = _tick_hints.get(pool_address)
+    if tick_hint is None:
+        pool_address, state = load_pool_states(
+            w3, pool_index, factory, token_in, token_out, [fee]
+        )[fee]
+        if pool_address is None:
+            return FeeTierQuote(fee, None, 0, None, 0, "no liquidity pool")
+        if isinstance(state, str):
+            return FeeTierQuote(fee, pool_address, 0, None, 0, state)
+        tick_hint = state[1][1]
+
+    snapshot = load_pool_snapshots(w3, [(pool_address, fee, tick_hint)])[pool_address]
+    tracker.add({pool_address: snapshot})
+    return _quote_snapshot(fee, pool_address, snapshot, None, token_in, token_out, amount_in)
+
+
+async def probe_fee_tier_async(w3, pool_index, factory, token_in, token_out, fee, amount_in):
+    """Same as probe_fee_tier() for an AsyncWeb3 instance"""
+    pool_address = pool_index.get(factory, token_in, token_out, fee)
+    if pool_address is None:
+        return FeeTierQuote(fee, None, 0, None, 0, "no liquidity pool")
+    tracker = get_pool_state_tracker(w3)
+    state = tracker.get(pool_address)
+    if state is not None:
+        return _quote_snapshot(fee, pool_address, *state, token_in, token_out, amount_in)
+
+    with _tick_hints_lock:
+        tick_hint = _tick_hints.get(pool_address)
+    if tick_hint is None:
+        pool_address, state = (
+            await load_pool_states_async(w3, pool_index, factory, token_in, token_out, [fee])
+        )[fee]
+        if pool_address is None:
+            return FeeTierQuote(fee, None, 0, None, 0, "no liquidity pool")
+        if isinstance(state, str):
+            return FeeTierQuote(fee, pool_address, 0, None, 0, state)
+        tick_hint = state[1][1]
+
+    snapshot = (
+        await load_pool_snapshots_async(w3, [(pool_address, fee, tick_hint)])
+    )[pool_address]
+    tracker.add({pool_address: snapshot})
+    return _quote_snapshot(fee, pool_address, snapshot, None, token_in, token_out, amount_in)
+
+
+def _quote_snapshot(fee, pool_address, snapshot, block_number, token_in, token_out, amount_in):
+    if isinstance(snapshot, str):
+        return FeeTierQuote(fee, pool_address, 0, None, 0, snapshot)
+    with _tick_hints_lock:
+        _tick_hints[pool_address] = snapshot.tick
+    if block_number is None:
+        block_number = snapshot.block_number
+
+    if snapshot.liquidity == 0:
+        return FeeTierQuote(fee, pool_address, 0, None, 0, "no liquidity", block_number)
+
+    zero_for_one = int(token_in, 16) < int(token_out, 16)
+    quote = quote_exact_input(snapshot, amount_in, zero_for_one)
+    if not quote.complete:
+        return FeeTierQuote(
+            fee, pool_address, snapshot.liquidity, None, quote.ticks_crossed,
+            "not enough liquidity for this amount", block_number,
+        )
+    return FeeTierQuote(
+        fee, pool_address, snapshot.liquidity, quote.amount_out, quote.ticks_crossed, None,
+        block_number,
+    )
+
+
+def rank_fee_tiers(
+    w3, pool_index, factory, token_in, token_out, amount_in, fee_tiers, deadline=3.0
+):
+    """Probe every fee tier concurrently and rank them by exact expected output
+
+    Args:
+        w3: Web3 instance
+        pool_index: PoolIndex
+        factory: Uniswap V3 factory address
+        token_in: Source token address
+        token_out: Target token address
+        amount_in: Input amount in Wei
+        fee_tiers: Fee tiers to probe
+        deadline: Seconds to wait for all tiers, a tier that is not done by
+            then is reported as timed out instead of stalling the swap
+
+    Returns:
+        List of FeeTierQuote, usable tiers first ordered by amount_out
+        (highest first), then the failed tiers
+    """
+    token_in = Web3.to_checksum_address(token_in)
+    token_out = Web3.to_checksum_address(token_out)
+    futures = {
+        fee: _executor.submit(
+            probe_fee_tier, w3, pool_index, factory, token_in, token_out, fee, amount_in
+        )
+        for fee in fee_tiers
+    }
+    wait(futures.values(), timeout=deadline)
+
+    return _rank(futures, deadline)
+
+
+async def rank_fee_tiers_async(
+    w3, pool_index, factory, token_in, token_out, amount_in, fee_tiers, deadline=3.0
+):
+    """Same as rank_fee_tiers() for an AsyncWeb3 instance, tiers run as tasks"""
+    token_in = Web3.to_checksum_address(token_in)
+    token_out = Web3.to_checksum_address(token_out)
+    futures = {
+        fee: asyncio.ensure_future(
+            probe_fee_tier_async(
+                w3, pool_index, factory, token_in, token_out, fee, amount_in
+            )
+        )
+        for fee in fee_tiers
+    }
+    await asyncio.wait(futures.values(), timeout=deadline)
+    return _rank(futures, deadline)
+
+
+def _rank(futures, deadline):
+    quotes = []
+    for fee, future in futures.items():
+        if not future.done():
+            future.cancel()
+            quotes.append(FeeTierQuote(fee, None, 0, None, 0, f"timed out after {deadline}s"))
+        elif future.exception() is not None:
+            quotes.append(FeeTierQuote(fee, None, 0, None, 0, str(future.exception())))
+        else:
+            quotes.append(future.result())
+
+    return sorted(
+        quotes,
+        key=lambda quote: (quote.amount_out is not None, quote.amount_out or 0),
+        reverse=True,
+    )
@@ -0,0 +1,399 @@
+from collections import namedtuple
+
+from eth_abi import decode
+from web3 import Web3
+
+from eth_abi_codec import (
+    ERC20_ABI,
+    decode_address,
+    decode_aggregate3,
+    decode_slot0,
+    decode_uint,
+    encode_aggregate3,
+    encode_allowance,
+    encode_balance_of,
+    encode_get_pool,
+    encode_liquidity,
+    encode_slot0,
+    get_contract,
+    get_output_types,
+)
+
+# Multicall3 is deployed at the same address on Base and most EVM chains
+MULTICALL3_ADDRESS = Web3.to_checksum_address(
+    "0xcA11bde05977b3631167028862bE2a173976CA11"
+)
+
+MULTICALL3_ABI = [
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"internalType": "address", "name": "target", "type": "address"},
+                    {"internalType": "bool", "name": "allowFailure", "type": "bool"},
+                    {"internalType": "bytes", "name": "callData", "type": "bytes"},
+                ],
+                "internalType": "struct Multicall3.Call3[]",
+                "name": "calls",
+                "type": "tuple[]",
+            }
+        ],
+        "name": "aggregate3",
+        "outputs": [
+            {
+                "components": [
+                    {"internalType": "bool", "name": "success", "type": "bool"},
+                    {"internalType": "bytes", "name": "returnData", "type": "bytes"},
+                ],
+                "internalType": "struct Multicall3.Result[]",
+                "name": "returnData",
+                "type": "tuple[]",
+            }
+        ],
+        "stateMutability": "payable",
+        "type": "function",
+    },
+    {
+        "inputs": [],
+        "name": "getBlockNumber",
+        "outputs": [{"internalType": "uint256", "name": "blockNumber", "type": "uint256"}],
+        "stateMutability": "view",
+        "type": "function",
+    },
+    {
+        "inputs": [{"internalType": "address", "name": "addr", "type": "address"}],
+        "name": "getEthBalance",
+        "outputs": [{"internalType": "uint256", "name": "balance", "type": "uint256"}],
+        "stateMutability": "view",
+        "type": "function",
+    },
+]
+
+# ERC20 reads needed before a trade, the full ERC20 ABI of the registry
+ERC20_READ_ABI = ERC20_ABI
+
+FACTORY_ABI = [
+    {
+        "inputs": [
+            {"internalType": "address", "name": "tokenA", "type": "address"},
+            {"internalType": "address", "name": "tokenB", "type": "address"},
+            {"internalType": "uint24", "name": "fee", "type": "uint24"},
+        ],
+        "name": "getPool",
+        "outputs": [{"internalType": "address", "name": "", "type": "address"}],
+        "stateMutability": "view",
+        "type": "function",
+    }
+]
+
+POOL_STATE_ABI = [
+    {
+        "inputs": [],
+        "name": "slot0",
+        "outputs": [
+            {"internalType": "uint160", "name": "sqrtPriceX96", "type": "uint160"},
+            {"internalType": "int24", "name": "tick", "type": "int24"},
+            {"internalType": "uint16", "name": "observationIndex", "type": "uint16"},
+            {"internalType": "uint16", "name": "observationCardinality", "type": "uint16"},
+            {"internalType": "uint16", "name": "observationCardinalityNext", "type": "uint16"},
+            {"internalType": "uint8", "name": "feeProtocol", "type": "uint8"},
+            {"internalType": "bool", "name": "unlocked", "type": "bool"},
+        ],
+        "stateMutability": "view",
+        "type": "function",
+    },
+    {
+        "inputs": [],
+        "name": "liquidity",
+        "outputs": [{"internalType": "uint128", "name": "", "type": "uint128"}],
+        "stateMutability": "view",
+        "type": "function",
+    },
+]
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+# Error of a call that succeeded without returning data, i.e. the target has no code
+EMPTY_RETURN_DATA = "empty return data"
+
+# Result of a single call inside an aggregate3 batch
+CallResult = namedtuple("CallResult", ["success", "value", "error"])
+
+
+class Multicall3:
+    def __init__(self, w3, address=MULTICALL3_ADDRESS):
+        """Collect contract reads and send them as one Multicall3 aggregate3 call
+
+        Args:
+            w3: Web3 instance
+            address: Multicall3 contract address
+        """
+        self.w3 = w3
+        self.contract = get_contract(w3, address, MULTICALL3_ABI)
+        self.calls = []
+
+    def add(self, key, contract, fn_name, args=(), allow_failure=True):
+        """Queue a read of `contract.fn_name(*args)`, its result is stored under `key`"""
+        output_types = get_output_types(contract.abi, fn_name)
+        calldata = bytes.fromhex(contract.encode_abi(fn_name, args=list(args))[2:])
+        self.add_call(
+            key,
+            contract.address,
+            calldata,
+            _abi_decoder(output_types) if output_types else None,
+            allow_failure,
+        )
+
+    def add_call(self, key, target, calldata, decoder, allow_failure=True):
+        """Queue a read with precompiled calldata, skipping web3's ABI machinery
+
+        Args:
+            key: Key of the result
+            target: Contract address
+            calldata: Encoded call (bytes), e.g. from eth_abi_codec
+            decoder: Turns the return data into the value (e.g.
+                eth_abi_codec.decode_uint), None when nothing is returned
+            allow_failure: Let the batch succeed when this call reverts
+        """
+        self.calls.append((key, target, calldata, decoder, allow_failure))
+
+    def add_eth_balance(self, key, address, allow_failure=True):
+        """Queue a native balance read through Multicall3.getEthBalance"""
+        self.add(key, self.contract, "getEthBalance", (address,), allow_failure)
+
+    def add_block_number(self, key):
+        """Queue a read of the block number the batch executes at"""
+        self.add(key, self.contract, "getBlockNumber")
+
+    def _take_calls(self):
+        calls, self.calls = self.calls, []
+        request = {
+            "to": self.contract.address,
+            "data": encode_aggregate3(
+                [
+                    (target, allow_failure, calldata)
+                    for _, target, calldata, _, allow_failure in calls
+                ]
+            ),
+        }
+        return calls, request
+
+    @staticmethod
+    def _decode_results(calls, data):
+        raw_results = decode_aggregate3(data)
+        results = {}
+        for (key, target, _, decoder, _), (success, return_data) in zip(
+            calls, raw_results
+        ):
+            if not success:
+                results[key] = CallResult(False, None, f"call to {target} reverted")
+                continue
+            if decoder is None:
+                results[key] = CallResult(True, None, None)
+                continue
+            if not return_data:
+                results[key] = CallResult(False, None, EMPTY_RETURN_DATA)
+                continue
+            try:
+                value = decoder(return_data)
+            except Exception as e:
+                results[key] = CallResult(False, None, f"failed to decode result: {str(e)}")
+                continue
+            results[key] = CallResult(True, value, None)
+        return results
+
+    def execute(self, block_identifier="latest"):
+        """Send all queued calls in one eth_call
+
+        Returns:
+            dict mapping each key to a CallResult(success, value, error). A
+            reverted or undecodable call only fails its own entry.
+        """
+        if not self.calls:
+            return {}
+        calls, request = self._take_calls()
+        return self._decode_results(calls, self.w3.eth.call(request, block_identifier))
+
+    async def execute_async(self, block_identifier="latest"):
+        """Same as execute() for an AsyncWeb3 instance"""
+        if not self.calls:
+            return {}
+        calls, request = self._take_calls()
+        return self._decode_results(
+            calls, await self.w3.eth.call(request, block_identifier)
+        )
+
+
+def _abi_decoder(output_types):
+    def decode_output(return_data):
+        values = decode(output_types, return_data)
+        return values[0] if len(values) == 1 else tuple(values)
+
+    return decode_output
+
+
+def add_token_metadata(multicall, token_contract):
+    """Queue name, symbol and decimals reads for a token"""
+    address = token_contract.address
+    multicall.add(("name", address), token_contract, "name")
+    multicall.add(("symbol", address), token_contract, "symbol")
+    multicall.add(("decimals", address), token_contract, "decimals")
+
+
+def read_token_metadata(results, token_address):
+    """Pick (name, symbol, decimals) for a token out of multicall results
+
+    Raises:
+        Exception: if any of the three reads failed
+    """
+    token_address = Web3.to_checksum_address(token_address)
+    values = []
+    for field in ("name", "symbol", "decimals"):
+        result = results[(field, token_address)]
+        if not result.success:
+            raise Exception(f"Failed to read {field} of {token_address}: {result.error}")
+        values.append(result.value)
+    return tuple(values)
+
+
+def build_swap_context(
+    w3,
+    account_address,
+    token_in,
+    token_out,
+    spender,
+    factory_address,
+    fee_tiers,
+    native_in=False,
+    metadata_tokens=None,
+):
+    """Queue everything a swap needs before quoting into one Multicall3
+
+    Args:
+        w3: Web3 instance
+        account_address: Trading wallet address
+        token_in: Source token address
+        token_out: Target token address
+        spender: Router address the source token must be approved to
+        factory_address: Uniswap V3 factory address
+        fee_tiers: Fee tiers to look pools up for
+        native_in: Pay with native ETH, read the ETH balance instead of the
+            token balance and skip the allowance
+        metadata_tokens: Tokens to read name/symbol/decimals for (default:
+            both), pass only the ones missing from a metadata cache
+
+    Returns:
+        Multicall3 whose results are keyed by ("name"|"symbol"|"decimals", token),
+        ("balance", token_in) or ("eth_balance", account), ("allowance", token_in)
+        and ("pool", fee)
+    """
+    token_in = Web3.to_checksum_address(token_in)
+    token_out = Web3.to_checksum_address(token_out)
+    account_address = Web3.to_checksum_address(account_address)
+
+    multicall = Multicall3(w3)
+
+    if metadata_tokens is None:
+        metadata_tokens = [token_in, token_out]
+    for token_address in set(Web3.to_checksum_address(t) for t in metadata_tokens):
+        add_token_metadata(
+            multicall, get_contract(w3, token_address, ERC20_READ_ABI)
+        )
+
+    if native_in:
+        multicall.add_eth_balance(("eth_balance", account_address), account_address)
+    else:
+        multicall.add_call(
+            ("balance", token_in), token_in, encode_balance_of(account_address), decode_uint
+        )
+        multicall.add_call(
+            ("allowance", token_in),
+            token_in,
+            encode_allowance(account_address, spender),
+            decode_uint,
+        )
+
+    factory_address = Web3.to_checksum_address(factory_address)
+    for fee in fee_tiers:
+        multicall.add_call(
+            ("pool", fee),
+            factory_address,
+            encode_get_pool(token_in, token_out, fee),
+            decode_address,
+        )
+
+    return multicall
+
+
+def report_failed_calls(results):
+    for key, result in results.items():
+        if not result.success:
+            print(f"Multicall read {key} failed: {result.error}")
+    return results
+
+
+def fetch_swap_context(w3, *args, **kwargs):
+    """Read everything a swap needs before quoting in one round trip
+
+    Takes the arguments of build_swap_context and returns the CallResult dict.
+    """
+    return report_failed_calls(build_swap_context(w3, *args, **kwargs).execute())
+
+
+async def fetch_swap_context_async(w3, *args, **kwargs):
+    """Same as fetch_swap_context() for an AsyncWeb3 instance"""
+    return report_failed_calls(
+        await build_swap_context(w3, *args, **kwargs).execute_async()
+    )
+
+
+def pools_from_context(results, fee_tiers):
+    """Map fee tier -> pool address (None when the pool does not exist or the read failed)"""
+    pools = {}
+    for fee in fee_tiers:
+        result = results.get(("pool", fee))
+        if result is None or not result.success or result.value == ZERO_ADDRESS:
+            pools[fee] = None
+        else:
+            pools[fee] = Web3.to_checksum_address(result.value)
+    return pools
+
+
+def queue_pool_states(multicall, w3, pool_addresses):
+    """Queue liquidity and slot0 reads of several pools"""
+    for pool_address in pool_addresses:
+        multicall.add_call(
+            ("liquidity", pool_address), pool_address, encode_liquidity(), decode_uint
+        )
+        multicall.add_call(("slot0", pool_address), pool_address, encode_slot0(), decode_slot0)
+
+
+def read_pool_states(results, pool_addresses):
+    """Map pool address -> (liquidity, slot0) or an error string"""
+    states = {}
+    for pool_address in pool_addresses:
+        liquidity = results[("liquidity", pool_address)]
+        slot0 = results[("slot0", pool_address)]
+        if liquidity.success and slot0.success:
+            states[pool_address] = (liquidity.value, slot0.value)
+        else:
+            states[pool_address] = liquidity.error or slot0.error
+    return states
+
+
+def fetch_pool_states(w3, pool_addresses):
+    """Read liquidity and slot0 of several pools in one round trip
+
+    Returns:
+        dict mapping pool address -> (liquidity, slot0) or an error string
+    """
+    multicall = Multicall3(w3)
+    queue_pool_states(multicall, w3, pool_addresses)
+    return read_pool_states(multicall.execute(), pool_addresses)
+
+
+async def fetch_pool_states_async(w3, pool_addresses):
+    """Same as fetch_pool_states() for an AsyncWeb3 instance"""
+    multicall = Multicall3(w3)
+    queue_pool_states(multicall, w3, pool_addresses)
+    return read_pool_states(await multicall.execute_async(), pool_addresses)
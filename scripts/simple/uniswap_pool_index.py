@@ -0,0 +1,216 @@
+import json
+import os
+import threading
+import time
+
+from eth_abi import encode
+from web3 import Web3
+
+from eth_token_cache import cache_path
+from uniswap_multicall import (
+    EMPTY_RETURN_DATA,
+    fetch_pool_states,
+    fetch_pool_states_async,
+)
+
+DEFAULT_INDEX_FILE = "pool_index.json"
+
+# keccak256 of the UniswapV3Pool creation code, shared by every canonical deployment
+POOL_INIT_CODE_HASH = bytes.fromhex(
+    "e34f199b19b2b4f47f68442619d555527d244f78a3297ea89325f843f87b8b54"
+)
+
+
+def sort_tokens(token_a, token_b):
+    """Return (token0, token1) the way the factory orders them"""
+    token_a = Web3.to_checksum_address(token_a)
+    token_b = Web3.to_checksum_address(token_b)
+    if int(token_a, 16) < int(token_b, 16):
+        return token_a, token_b
+    return token_b, token_a
+
+
+def compute_pool_address(factory, token_a, token_b, fee, init_code_hash=POOL_INIT_CODE_HASH):
+    """Compute a Uniswap V3 pool address locally (CREATE2), no RPC needed"""
+    token0, token1 = sort_tokens(token_a, token_b)
+    salt = Web3.keccak(encode(["address", "address", "uint24"], [token0, token1, fee]))
+    raw = Web3.keccak(
+        b"\xff"
+        + bytes.fromhex(Web3.to_checksum_address(factory)[2:])
+        + salt
+        + init_code_hash
+    )
+    return Web3.to_checksum_address(raw[12:])
+
+
+class PoolIndex:
+    def __init__(self, path=None, missing_ttl=24 * 3600):
+        """Index of pool addresses keyed by (factory, tokenA, tokenB, fee)
+
+        Addresses are computed locally, the index only remembers which pools are
+        known to exist and which are known not to exist, and persists both to a
+        JSON file so a fresh process starts warm.
+
+        Args:
+            path: JSON file path, None keeps the index in memory only
+                (get_default_index() uses cache_path())
+            missing_ttl: Seconds a "pool does not exist" entry stays valid,
+                pools can be created later so these entries expire
+        """
+        self.path = path
+        self.missing_ttl = missing_ttl
+        self.lock = threading.Lock()
+        self.pools = {}
+        self.missing = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.pools = data.get("pools", {})
+            self.missing = data.get("missing", {})
+
+    @staticmethod
+    def _key(factory, token_a, token_b, fee):
+        token0, token1 = sort_tokens(token_a, token_b)
+        return f"{Web3.to_checksum_address(factory)}:{token0}:{token1}:{fee}"
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"pools": self.pools, "missing": self.missing}, f)
+        os.replace(tmp_path, self.path)
+
+    def is_missing(self, factory, token_a, token_b, fee):
+        """True while the pool is known not to exist"""
+        checked_at = self.missing.get(self._key(factory, token_a, token_b, fee))
+        return checked_at is not None and time.time() - checked_at < self.missing_ttl
+
+    def get(self, factory, token_a, token_b, fee):
+        """Return the pool address, or None when the pool is known not to exist"""
+        if self.is_missing(factory, token_a, token_b, fee):
+            return None
+        key = self._key(factory, token_a, token_b, fee)
+        address = self.pools.get(key)
+        if address is None:
+            address = compute_pool_address(factory, token_a, token_b, fee)
+        return address
+
+    def record_existing(self, factory, token_a, token_b, fee, address):
+        key = self._key(factory, token_a, token_b, fee)
+        with self.lock:
+            if self.pools.get(key) == address and key not in self.missing:
+                return
+            self.pools[key] = address
+            self.missing.pop(key, None)
+            self._save()
+
+    def record_missing(self, factory, token_a, token_b, fee):
+        key = self._key(factory, token_a, token_b, fee)
+        with self.lock:
+            self.pools.pop(key, None)
+            self.missing[key] = time.time()
+            self._save()
+
+    def candidate_pools(self, factory, token_a, token_b, fee_tiers):
+        """Map fee tier -> pool address, None for pools known not to exist"""
+        return {fee: self.get(factory, token_a, token_b, fee) for fee in fee_tiers}
+
+
+def _classify_pool_states(pool_index, factory, token_in, token_out, pools, pool_states):
+    states = {}
+    for fee, pool_address in pools.items():
+        if pool_address is None:
+            states[fee] = (None, None)
+            continue
+        state = pool_states[pool_address]
+        if state == EMPTY_RETURN_DATA:
+            pool_index.record_missing(factory, token_in, token_out, fee)
+            states[fee] = (None, None)
+            continue
+        if not isinstance(state, str):
+            pool_index.record_existing(factory, token_in, token_out, fee, pool_address)
+        states[fee] = (pool_address, state)
+    return states
+
+
+def load_pool_states(w3, pool_index, factory, token_in, token_out, fee_tiers):
+    """Read liquidity and slot0 of every candidate pool in one round trip
+
+    Pool addresses come from the index, so only live state goes to the network.
+    A call to an address without code means the pool was never created, which
+    is remembered in the index.
+
+    Returns:
+        dict mapping fee tier -> (pool address, state), state is
+        (liquidity, slot0), an error string, or None when there is no pool
+    """
+    pools = pool_index.candidate_pools(factory, token_in, token_out, fee_tiers)
+    pool_states = fetch_pool_states(
+        w3, [pool for pool in pools.values() if pool is not None]
+    )
+    return _classify_pool_states(
+        pool_index, factory, token_in, token_out, pools, pool_states
+    )
+
+
+async def load_pool_states_async(w3, pool_index, factory, token_in, token_out, fee_tiers):
+    """Same as load_pool_states() for an AsyncWeb3 instance"""
+    pools = pool_index.candidate_pools(factory, token_in, token_out, fee_tiers)
+    pool_states = await fetch_pool_states_async(
+        w3, [pool for pool in pools.values() if pool is not None]
+    )
+    return _classify_pool_states(
+        pool_index, factory, token_in, token_out, pools, pool_states
+    )
+
+
+def _pair_pools(pool_index, factory, pair_fee_tiers):
+    pools = {
+        pair: pool_index.candidate_pools(factory, pair[0], pair[1], fee_tiers)
+        for pair, fee_tiers in pair_fee_tiers.items()
+    }
+    addresses = list(
+        {address for tiers in pools.values() for address in tiers.values() if address is not None}
+    )
+    return pools, addresses
+
+
+def load_pair_pool_states(w3, pool_index, factory, pair_fee_tiers):
+    """load_pool_states() of several token pairs in one round trip
+
+    Args:
+        pair_fee_tiers: dict mapping (token_a, token_b) -> fee tiers to read
+
+    Returns:
+        dict mapping (token_a, token_b) -> {fee tier: (pool address, state)}
+    """
+    pools, addresses = _pair_pools(pool_index, factory, pair_fee_tiers)
+    pool_states = fetch_pool_states(w3, addresses)
+    return {
+        pair: _classify_pool_states(pool_index, factory, pair[0], pair[1], tiers, pool_states)
+        for pair, tiers in pools.items()
+    }
+
+
+async def load_pair_pool_states_async(w3, pool_index, factory, pair_fee_tiers):
+    """Same as load_pair_pool_states() for an AsyncWeb3 instance"""
+    pools, addresses = _pair_pools(pool_index, factory, pair_fee_tiers)
+    pool_states = await fetch_pool_states_async(w3, addresses)
+    return {
+        pair: _classify_pool_states(pool_index, factory, pair[0], pair[1], tiers, pool_states)
+        for pair, tiers in pools.items()
+    }
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_default_index():
+    """Process wide pool index shared by UniswapV3 and BaseUniswapV3"""
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = PoolIndex(cache_path(DEFAULT_INDEX_FILE))
+        return _default_index
@@ -0,0 +1,470 @@
+from collections import namedtuple
+import threading
+import time
+
+from web3 import Web3
+
+from eth_abi_codec import BURN_EVENT, MINT_EVENT, SWAP_EVENT, decode_pool_log
+from rpc_metrics import instrument_web3, span
+from rpc_router import web3_provider
+from uniswap_v3_math import (
+    MAX_TICK,
+    MIN_TICK,
+    PoolSnapshot,
+    load_pool_snapshots,
+    quote_exact_input,
+)
+
+# A quote served from the tracked state, valid at block_number
+PoolQuote = namedtuple("PoolQuote", ["pool_address", "quote", "block_number"])
+
+
+def _word(snapshot, tick):
+    return (tick // snapshot.tick_spacing) >> 8
+
+
+def _copy(snapshot, block_number):
+    return PoolSnapshot(
+        snapshot.sqrt_price_x96,
+        snapshot.tick,
+        snapshot.liquidity,
+        snapshot.fee,
+        snapshot.tick_spacing,
+        dict(snapshot.bitmap),
+        dict(snapshot.ticks),
+        block_number,
+    )
+
+
+def _liquidity_at(snapshot, tick):
+    """Active liquidity after moving from the snapshot's tick to tick
+
+    Crosses the tracked initialized ticks in between like the pool does,
+    None when the ticks in between are not loaded.
+    """
+    low, high = sorted((snapshot.tick, tick))
+    if any(word not in snapshot.bitmap for word in range(_word(snapshot, low), _word(snapshot, high) + 1)):
+        return None
+    liquidity = snapshot.liquidity
+    for initialized, (_, liquidity_net) in snapshot.ticks.items():
+        if low < initialized <= high:
+            liquidity += liquidity_net if tick > snapshot.tick else -liquidity_net
+    return liquidity
+
+
+def _apply_swap(snapshot, sqrt_price_x96, liquidity, tick):
+    """Apply a Swap event
+
+    Returns:
+        False when the pool has to be loaded again: the reported liquidity
+        does not match the tracked ticks (a missed update), or the price
+        moved next to the edge of the loaded bitmap words
+    """
+    consistent = _liquidity_at(snapshot, tick) == liquidity
+    snapshot.sqrt_price_x96 = sqrt_price_x96
+    snapshot.liquidity = liquidity
+    snapshot.tick = tick
+    lowest = _word(snapshot, MIN_TICK)
+    highest = _word(snapshot, MAX_TICK)
+    word = _word(snapshot, tick)
+    near = range(max(word - 1, lowest), min(word + 1, highest) + 1)
+    return consistent and all(word in snapshot.bitmap for word in near)
+
+
+def _apply_position(snapshot, tick_lower, tick_upper, liquidity_delta):
+    """Apply a Mint (positive delta) or Burn (negative delta) event
+
+    Ticks outside the loaded bitmap words are not tracked, like in a fresh
+    snapshot.
+
+    Returns:
+        False when a burn takes more liquidity than the tick has
+    """
+    consistent = True
+    for tick, liquidity_net in ((tick_lower, liquidity_delta), (tick_upper, -liquidity_delta)):
+        compressed = tick // snapshot.tick_spacing
+        word = compressed >> 8
+        if word not in snapshot.bitmap:
+            continue
+        gross, net = snapshot.ticks.get(tick, (0, 0))
+        gross += liquidity_delta
+        if gross <= 0:
+            consistent = consistent and gross == 0
+            snapshot.ticks.pop(tick, None)
+            snapshot.bitmap[word] &= ~(1 << (compressed % 256))
+        else:
+            snapshot.ticks[tick] = (gross, net + liquidity_net)
+            snapshot.bitmap[word] |= 1 << (compressed % 256)
+    if tick_lower <= snapshot.tick < tick_upper:
+        snapshot.liquidity += liquidity_delta
+    return consistent
+
+
+class PoolStateTracker:
+    def __init__(
+        self,
+        w3,
+        poll_interval=1.0,
+        reorg_window=64,
+        max_gap=100,
+        word_radius=2,
+        max_lag=10.0,
+        idle_timeout=60.0,
+    ):
+        """Uniswap V3 pool states kept current from their Swap/Mint/Burn logs
+
+        A pool is snapshotted once (add()), then a background thread follows
+        blocks: every poll reads the latest block header, and when there are
+        new blocks one batch of the headers in between plus one eth_getLogs
+        for every tracked pool. The logs update price, tick, active liquidity
+        and tick liquidity in memory, so quoting a tracked pool needs no RPC
+        and the RPC load grows with blocks instead of quotes.
+
+        Updates replace a pool's snapshot instead of changing it, readers
+        never see half an update. The snapshots replaced in the last
+        reorg_window blocks are kept to undo a reorg. A pool is snapshotted
+        again when its logs do not add up (a missed update) or its price
+        nears the edge of its loaded ticks, all pools when the tracker falls
+        more than max_gap blocks behind or a reorg is deeper than the window.
+
+        Args:
+            w3: Web3 instance (sync)
+            poll_interval: Seconds between polls of the latest block
+            reorg_window: Blocks whose hashes and replaced snapshots are kept
+            max_gap: Most blocks of logs replayed, a longer gap reloads every pool
+            word_radius: Tick bitmap words loaded on each side of the price
+            max_lag: Seconds without a successful poll after which the
+                states are no longer served
+            idle_timeout: Seconds without reads after which the thread stops
+                and the states are dropped
+        """
+        self.w3 = w3
+        self.poll_interval = poll_interval
+        self.reorg_window = reorg_window
+        self.max_gap = max_gap
+        self.word_radius = word_radius
+        self.max_lag = max_lag
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        # pool address -> PoolSnapshot, replaced on every update
+        self.snapshots = {}
+        # pool address -> block whose logs its snapshot includes
+        self.pool_blocks = {}
+        # pool address -> block it was snapshotted at
+        self.added_at = {}
+        # pool address -> time its state was last known to be current
+        self.updated_at = {}
+        # pools to snapshot again, not served until then
+        self.reload = set()
+        # lower case address of the logs -> pool address
+        self.addresses = {}
+        # block number -> hash of the followed blocks
+        self.block_hashes = {}
+        # block number -> {pool address: snapshot before the block}
+        self.journal = {}
+        self.last_block = None
+        self.used_at = 0
+        self.thread = None
+
+    def add(self, snapshots):
+        """Track pools from snapshots read elsewhere (e.g. load_pool_snapshots)
+
+        Args:
+            snapshots: dict of pool address -> PoolSnapshot (error strings
+                are skipped)
+        """
+        now = time.time()
+        with self.lock:
+            for address, snapshot in snapshots.items():
+                if isinstance(snapshot, str) or snapshot.block_number is None:
+                    continue
+                address = Web3.to_checksum_address(address)
+                if (
+                    address in self.snapshots
+                    and address not in self.reload
+                    and self.pool_blocks[address] >= snapshot.block_number
+                ):
+                    continue
+                self.snapshots[address] = snapshot
+                self.pool_blocks[address] = self.added_at[address] = snapshot.block_number
+                self.updated_at[address] = now
+                self.addresses[address.lower()] = address
+                self.reload.discard(address)
+            self.used_at = now
+        self._ensure_running()
+
+    def get(self, pool_address):
+        """Current state of a tracked pool, no RPC
+
+        Returns:
+            (PoolSnapshot, block number it is valid at), None when the pool is
+            not tracked or its state is not known to be current
+        """
+        pool_address = Web3.to_checksum_address(pool_address)
+        now = time.time()
+        with self.lock:
+            self.used_at = now
+            snapshot = self.snapshots.get(pool_address)
+            if (
+                snapshot is None
+                or pool_address in self.reload
+                or now - self.updated_at[pool_address] > self.max_lag
+            ):
+                return None
+            return snapshot, self.pool_blocks[pool_address]
+
+    def quote(self, pool_address, amount_in, zero_for_one):
+        """Quote an exact input swap over the tracked state of a pool
+
+        Returns:
+            PoolQuote, None when the pool's state is not available (see get())
+        """
+        state = self.get(pool_address)
+        if state is None:
+            return None
+        snapshot, block_number = state
+        return PoolQuote(
+            Web3.to_checksum_address(pool_address),
+            quote_exact_input(snapshot, amount_in, zero_for_one),
+            block_number,
+        )
+
+    def _ensure_running(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self._run, name="pool-state-tracker", daemon=True
+                )
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self.lock:
+                if time.time() - self.used_at > self.idle_timeout:
+                    # Nobody quotes, stop following blocks; the next add()
+                    # starts over from fresh snapshots
+                    self.thread = None
+                    self._clear()
+                    return
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Pool state tracker poll failed: {str(e)}")
+
+    def _clear(self):
+        for state in (
+            self.snapshots,
+            self.pool_blocks,
+            self.added_at,
+            self.updated_at,
+            self.addresses,
+            self.block_hashes,
+            self.journal,
+        ):
+            state.clear()
+        self.reload.clear()
+        self.last_block = None
+
+    def _batch(self, requests):
+        responses = self.w3.provider.make_batch_request(requests)
+        if isinstance(responses, dict):
+            raise Exception(f"Batch rejected: {responses.get('error')}")
+        for (method, _), response in zip(requests, responses):
+            if "error" in response:
+                raise Exception(f"{method} failed: {response['error']}")
+        return [response.get("result") for response in responses]
+
+    def poll(self):
+        """Apply the logs of every new block, then reload the pools that need it"""
+        (latest,) = self._batch([("eth_getBlockByNumber", ["latest", False])])
+        head = int(latest["number"], 16)
+        with self.lock:
+            if self.block_hashes.get(head, latest["hash"]) != latest["hash"]:
+                # The block we followed at this height was replaced
+                head = None
+            pools = [address for address in self.snapshots if address not in self.reload]
+            if pools and self.last_block is None:
+                self.last_block = min(self.pool_blocks[address] for address in pools)
+            last_block = self.last_block
+            # Pools snapshotted before the last followed block catch up in
+            # the same eth_getLogs
+            from_block = min([self.pool_blocks[address] for address in pools] + [last_block or 0]) + 1
+
+        if head is None:
+            self._rewind()
+        elif pools and head - from_block + 1 > self.max_gap:
+            print(f"Pool state tracker is {head - last_block} blocks behind, reloading every pool")
+            with self.lock:
+                self.reload.update(self.snapshots)
+                self.block_hashes.clear()
+                self.journal.clear()
+                self.last_block = None
+        elif pools and head >= from_block:
+            with span("logs"):
+                self._follow(pools, last_block, from_block, latest)
+        elif pools:
+            # No new block (or a node behind the one we followed)
+            now = time.time()
+            with self.lock:
+                for address in pools:
+                    self.updated_at[address] = now
+
+        self._reload()
+
+    def _follow(self, pools, last_block, from_block, latest):
+        head = int(latest["number"], 16)
+        numbers = list(range(last_block + 1, head + 1))
+        results = self._batch(
+            [("eth_getBlockByNumber", [hex(number), False]) for number in numbers[:-1]]
+            + [
+                (
+                    "eth_getLogs",
+                    [
+                        {
+                            "address": pools,
+                            "topics": [[SWAP_EVENT, MINT_EVENT, BURN_EVENT]],
+                            "fromBlock": hex(from_block),
+                            "toBlock": hex(head),
+                        }
+                    ],
+                )
+            ]
+        )
+        headers, logs = results[:-1] + [latest], results[-1]
+
+        hashes = {}
+        parent_hash = self.block_hashes.get(last_block)
+        for number, header in zip(numbers, headers):
+            if header is None:
+                # The node does not have the block yet, try again next poll
+                return
+            if parent_hash is not None and header["parentHash"] != parent_hash:
+                if number == last_block + 1:
+                    self._rewind()
+                # else the chain changed while the batch was answered
+                return
+            hashes[number] = parent_hash = header["hash"]
+        for log in logs:
+            number = int(log["blockNumber"], 16)
+            known = hashes.get(number, self.block_hashes.get(number))
+            if known is not None and log["blockHash"] != known:
+                return
+
+        with self.lock:
+            self._apply(sorted(logs, key=lambda log: (int(log["blockNumber"], 16), int(log["logIndex"], 16))))
+            now = time.time()
+            for address in pools:
+                if address in self.snapshots:
+                    self.pool_blocks[address] = max(self.pool_blocks[address], head)
+                    self.updated_at[address] = now
+            self.block_hashes.update(hashes)
+            self.last_block = head
+            for number in [number for number in self.block_hashes if number <= head - self.reorg_window]:
+                del self.block_hashes[number]
+            for number in [number for number in self.journal if number <= head - self.reorg_window]:
+                del self.journal[number]
+
+    def _apply(self, logs):
+        # pool address -> (block number, snapshot being built for that block)
+        building = {}
+        for log in logs:
+            address = self.addresses.get(log["address"].lower())
+            number = int(log["blockNumber"], 16)
+            if address is None or address in self.reload or number <= self.pool_blocks[address]:
+                continue
+            event = decode_pool_log(log)
+            if event is None:
+                continue
+            if building.get(address, (None,))[0] != number:
+                previous = self.snapshots[address]
+                self.journal.setdefault(number, {}).setdefault(address, previous)
+                self.snapshots[address] = _copy(previous, number)
+                building[address] = (number, self.snapshots[address])
+            snapshot = building[address][1]
+            if event[0] == "swap":
+                consistent = _apply_swap(snapshot, *event[1:])
+            else:
+                tick_lower, tick_upper, amount = event[1:]
+                consistent = _apply_position(
+                    snapshot, tick_lower, tick_upper, amount if event[0] == "mint" else -amount
+                )
+            if not consistent:
+                self.reload.add(address)
+
+    def _rewind(self):
+        """Undo the updates of the blocks a reorg replaced"""
+        with self.lock:
+            numbers = sorted(self.block_hashes, reverse=True)
+        headers = self._batch([("eth_getBlockByNumber", [hex(number), False]) for number in numbers])
+        fork = None
+        for number, header in zip(numbers, headers):
+            if header is not None and header["hash"] == self.block_hashes[number]:
+                fork = number
+                break
+
+        with self.lock:
+            if fork is None:
+                print("Chain reorganization deeper than the followed blocks, reloading every pool")
+                self.reload.update(self.snapshots)
+                self.block_hashes.clear()
+                self.journal.clear()
+                self.last_block = None
+                return
+            print(f"Chain reorganization detected, undoing pool updates after block {fork}")
+            for number in sorted(self.journal, reverse=True):
+                if number <= fork:
+                    break
+                for address, snapshot in self.journal.pop(number).items():
+                    if address in self.snapshots:
+                        self.snapshots[address] = snapshot
+            for address in self.snapshots:
+                # Snapshots read on the replaced blocks can not be undone
+                if self.added_at[address] > fork:
+                    self.reload.add(address)
+                self.pool_blocks[address] = min(self.pool_blocks[address], fork)
+            for number in [number for number in self.block_hashes if number > fork]:
+                del self.block_hashes[number]
+            self.last_block = fork
+
+    def _reload(self):
+        with self.lock:
+            pools = [
+                (address, self.snapshots[address].fee, self.snapshots[address].tick)
+                for address in self.reload
+            ]
+        if not pools:
+            return
+        snapshots = load_pool_snapshots(self.w3, pools, self.word_radius)
+        failed = {address: snapshot for address, snapshot in snapshots.items() if isinstance(snapshot, str)}
+        with self.lock:
+            for address, error in failed.items():
+                print(f"Pool state tracker dropped {address}: {error}")
+                for state in (self.snapshots, self.pool_blocks, self.added_at, self.updated_at):
+                    state.pop(address, None)
+                self.addresses.pop(address.lower(), None)
+                self.reload.discard(address)
+        self.add(snapshots)
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def get_pool_state_tracker(w3):
+    """Process wide pool state tracker of an RPC endpoint, shared by every script
+
+    Works for Web3 and AsyncWeb3 instances, an AsyncWeb3 gets a tracker with
+    its own sync Web3 on the same endpoint.
+    """
+    endpoint = getattr(w3.provider, "endpoint_uri", None)
+    key = str(endpoint or id(w3.provider))
+    with _trackers_lock:
+        tracker = _trackers.get(key)
+        if tracker is None:
+            if isinstance(w3, Web3):
+                tracker_w3 = w3
+            else:
+                tracker_w3 = instrument_web3(Web3(web3_provider(endpoint)))
+            tracker = _trackers[key] = PoolStateTracker(tracker_w3)
+        return tracker
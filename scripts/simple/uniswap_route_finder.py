@@ -0,0 +1,319 @@
+from collections import namedtuple
+import itertools
+import threading
+import time
+
+from web3 import Web3
+
+from uniswap_pool_index import load_pair_pool_states, load_pair_pool_states_async
+from uniswap_pool_state import get_pool_state_tracker
+from uniswap_v3_math import (
+    load_pool_snapshots,
+    load_pool_snapshots_async,
+    quote_exact_input,
+)
+
+# Tokens a route may pass through besides its own two (Base: WETH, USDC)
+DEFAULT_CONNECTORS = (
+    Web3.to_checksum_address("0x4200000000000000000000000000000000000006"),
+    Web3.to_checksum_address("0x833589fCD6eDb6E08f4c7C32D4f71b54bdA02913"),
+)
+MAX_HOPS = 3
+
+# A swap path: tokens[0] -> tokens[-1] through one pool (fee tier) per hop
+Route = namedtuple("Route", ["tokens", "fees", "pools", "amount_out", "ticks_crossed"])
+
+
+def describe_route(route, symbols=None):
+    """"WETH -(0.05%)-> USDC" style text of a route, symbols maps address -> symbol"""
+    symbols = symbols or {}
+    text = symbols.get(route.tokens[0], route.tokens[0][:10])
+    for fee, token in zip(route.fees, route.tokens[1:]):
+        text += f" -({fee / 10000}%)-> {symbols.get(token, token[:10])}"
+    return text
+
+
+class PoolGraph:
+    def __init__(
+        self,
+        pool_index,
+        factory,
+        fee_tiers,
+        connectors=DEFAULT_CONNECTORS,
+        ttl=2.0,
+        word_radius=2,
+        state_tracker=None,
+    ):
+        """Known Uniswap V3 pools as a graph, tokens are nodes and pools are edges
+
+        load() reads every pool between the given tokens and the connector
+        tokens (all fee tiers) as a PoolSnapshot, in two multicall round trips
+        (three while a pool's tick is unknown). Snapshots are reused for ttl
+        seconds, so routes() searches every path of up to N hops with local
+        swap math only, in milliseconds. Pools the state tracker follows are
+        taken from it instead of being read again.
+
+        Args:
+            pool_index: PoolIndex the pool addresses (and missing pools) come from
+            factory: Uniswap V3 factory address
+            fee_tiers: Fee tiers of the edges between two tokens
+            connectors: Tokens every route may pass through
+            ttl: Seconds a loaded pair of tokens is served before it is read again
+            word_radius: Tick bitmap words loaded on each side of the price
+            state_tracker: Optional PoolStateTracker of the endpoint, serves
+                the pools it follows and is handed the ones read
+        """
+        self.pool_index = pool_index
+        self.factory = factory
+        self.fee_tiers = list(fee_tiers)
+        self.connectors = [Web3.to_checksum_address(token) for token in connectors]
+        self.ttl = ttl
+        self.word_radius = word_radius
+        self.state_tracker = state_tracker
+        self.lock = threading.Lock()
+        # (token0, token1) -> (loaded at, {fee: pool address}) of pools with liquidity
+        self.pairs = {}
+        # pool address -> PoolSnapshot
+        self.snapshots = {}
+        # pool address -> last seen tick, centers the bitmap words of a reload
+        self.tick_hints = {}
+
+    def _plan(self, tokens):
+        """Stale pairs among tokens and connectors, split by whether their ticks are known"""
+        tokens = sorted(
+            {Web3.to_checksum_address(token) for token in tokens} | set(self.connectors),
+            key=lambda token: int(token, 16),
+        )
+        now = time.time()
+        with self.lock:
+            stale = [
+                pair
+                for pair in itertools.combinations(tokens, 2)
+                if now - self.pairs.get(pair, (0, None))[0] > self.ttl
+            ]
+            # pair -> fee tiers whose pool state is read first
+            unknown = {}
+            # (pair, fee, pool address, tick hint) ready for a snapshot
+            known = []
+            for pair in stale:
+                candidates = self.pool_index.candidate_pools(
+                    self.factory, pair[0], pair[1], self.fee_tiers
+                )
+                for fee, address in candidates.items():
+                    if address is None:
+                        continue
+                    hint = self.tick_hints.get(address)
+                    if hint is None:
+                        unknown.setdefault(pair, []).append(fee)
+                    else:
+                        known.append((pair, fee, address, hint))
+        return stale, unknown, known
+
+    @staticmethod
+    def _with_states(known, states):
+        pools = list(known)
+        for pair, tiers in states.items():
+            for fee, (address, state) in tiers.items():
+                if address is None or isinstance(state, str) or state[0] == 0:
+                    continue
+                pools.append((pair, fee, address, state[1][1]))
+        return pools
+
+    def _tracked(self, pools):
+        """Snapshots of the pools the state tracker serves, and the pools left to read"""
+        if self.state_tracker is None:
+            return {}, pools
+        snapshots = {}
+        missing = []
+        for pool in pools:
+            state = self.state_tracker.get(pool[2])
+            if state is None:
+                missing.append(pool)
+            else:
+                snapshots[pool[2]] = state[0]
+        return snapshots, missing
+
+    def _store(self, stale, pools, snapshots):
+        now = time.time()
+        edges = {pair: {} for pair in stale}
+        with self.lock:
+            for pair, fee, address, _ in pools:
+                snapshot = snapshots.get(address)
+                if snapshot is None or isinstance(snapshot, str):
+                    continue
+                self.tick_hints[address] = snapshot.tick
+                self.snapshots[address] = snapshot
+                if snapshot.liquidity > 0:
+                    edges[pair][fee] = address
+            for pair, pair_edges in edges.items():
+                self.pairs[pair] = (now, pair_edges)
+
+    def load(self, w3, tokens):
+        """Make sure the pools among tokens and the connectors are loaded and fresh"""
+        stale, unknown, known = self._plan(tokens)
+        if not stale:
+            return
+        states = (
+            load_pair_pool_states(w3, self.pool_index, self.factory, unknown) if unknown else {}
+        )
+        pools = self._with_states(known, states)
+        snapshots, missing = self._tracked(pools)
+        if missing:
+            loaded = load_pool_snapshots(
+                w3, [(address, fee, hint) for _, fee, address, hint in missing], self.word_radius
+            )
+            snapshots.update(loaded)
+            if self.state_tracker is not None:
+                self.state_tracker.add(loaded)
+        self._store(stale, pools, snapshots)
+
+    async def load_async(self, w3, tokens):
+        """Same as load() for an AsyncWeb3 instance"""
+        stale, unknown, known = self._plan(tokens)
+        if not stale:
+            return
+        states = (
+            await load_pair_pool_states_async(w3, self.pool_index, self.factory, unknown)
+            if unknown
+            else {}
+        )
+        pools = self._with_states(known, states)
+        snapshots, missing = self._tracked(pools)
+        if missing:
+            loaded = await load_pool_snapshots_async(
+                w3, [(address, fee, hint) for _, fee, address, hint in missing], self.word_radius
+            )
+            snapshots.update(loaded)
+            if self.state_tracker is not None:
+                self.state_tracker.add(loaded)
+        self._store(stale, pools, snapshots)
+
+    def _adjacency(self):
+        """token -> neighbor token -> [(fee, pool address, snapshot)] of the loaded pools"""
+        with self.lock:
+            adjacency = {}
+            for (token0, token1), (_, edges) in self.pairs.items():
+                for fee, address in edges.items():
+                    edge = (fee, address, self.snapshots[address])
+                    adjacency.setdefault(token0, {}).setdefault(token1, []).append(edge)
+                    adjacency.setdefault(token1, {}).setdefault(token0, []).append(edge)
+        return adjacency
+
+    def routes(self, token_in, token_out, amount_in, max_hops=MAX_HOPS):
+        """Every route of up to max_hops over the loaded pools, best output first
+
+        Each hop takes the fee tier with the best exact output for the amount
+        reaching it, which is the best choice for the path since a hop's
+        output only grows with its input. Hops that would run past the
+        loaded ticks are left out. No RPC.
+
+        Returns:
+            List of Route, highest amount_out first, fewer hops on a tie
+        """
+        token_in = Web3.to_checksum_address(token_in)
+        token_out = Web3.to_checksum_address(token_out)
+        adjacency = self._adjacency()
+        routes = []
+
+        def walk(token, amount, tokens, fees, pools, ticks_crossed):
+            for neighbor, edges in adjacency.get(token, {}).items():
+                if neighbor in tokens:
+                    continue
+                zero_for_one = int(token, 16) < int(neighbor, 16)
+                best = None
+                for fee, address, snapshot in edges:
+                    quote = quote_exact_input(snapshot, amount, zero_for_one)
+                    if not quote.complete or quote.amount_out == 0:
+                        continue
+                    if best is None or quote.amount_out > best[0].amount_out:
+                        best = (quote, fee, address)
+                if best is None:
+                    continue
+                quote, fee, address = best
+                hop = (
+                    tokens + [neighbor],
+                    fees + [fee],
+                    pools + [address],
+                    ticks_crossed + quote.ticks_crossed,
+                )
+                if neighbor == token_out:
+                    routes.append(Route(hop[0], hop[1], hop[2], quote.amount_out, hop[3]))
+                elif len(fees) + 1 < max_hops:
+                    walk(neighbor, quote.amount_out, *hop)
+
+        walk(token_in, amount_in, [token_in], [], [], 0)
+        return sorted(routes, key=lambda route: (-route.amount_out, len(route.fees)))
+
+    def paths(self, token_in, token_out, max_hops=MAX_HOPS):
+        """Every pool path of up to max_hops, one Route per choice of fee tier at each hop
+
+        The routes are not quoted (amount_out None), see quote_route().
+        """
+        token_in = Web3.to_checksum_address(token_in)
+        token_out = Web3.to_checksum_address(token_out)
+        adjacency = self._adjacency()
+        paths = []
+
+        def walk(token, tokens, fees, pools):
+            for neighbor, edges in adjacency.get(token, {}).items():
+                if neighbor in tokens:
+                    continue
+                for fee, address, _ in edges:
+                    hop = (tokens + [neighbor], fees + [fee], pools + [address])
+                    if neighbor == token_out:
+                        paths.append(Route(hop[0], hop[1], hop[2], None, 0))
+                    elif len(fees) + 1 < max_hops:
+                        walk(neighbor, *hop)
+
+        walk(token_in, [token_in], [], [])
+        return paths
+
+    def quote_route(self, route, amount_in):
+        """Quote a route for amount_in over the loaded snapshots
+
+        Returns:
+            The route with amount_out and ticks_crossed filled in, None when
+            a hop runs past the loaded ticks
+        """
+        amount = amount_in
+        ticks_crossed = 0
+        for token, neighbor, address in zip(route.tokens, route.tokens[1:], route.pools):
+            with self.lock:
+                snapshot = self.snapshots[address]
+            quote = quote_exact_input(snapshot, amount, int(token, 16) < int(neighbor, 16))
+            if not quote.complete:
+                return None
+            amount = quote.amount_out
+            ticks_crossed += quote.ticks_crossed
+        return route._replace(amount_out=amount, ticks_crossed=ticks_crossed)
+
+    def find_routes(self, w3, token_in, token_out, amount_in, max_hops=MAX_HOPS):
+        """load() the pools of the two tokens, then routes()"""
+        self.load(w3, [token_in, token_out])
+        return self.routes(token_in, token_out, amount_in, max_hops)
+
+    async def find_routes_async(self, w3, token_in, token_out, amount_in, max_hops=MAX_HOPS):
+        """Same as find_routes() for an AsyncWeb3 instance"""
+        await self.load_async(w3, [token_in, token_out])
+        return self.routes(token_in, token_out, amount_in, max_hops)
+
+
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+
+def get_pool_graph(w3, pool_index, factory, fee_tiers):
+    """Process wide pool graph of an RPC endpoint, shared by every swap client
+
+    Works for Web3 and AsyncWeb3 instances. The pool index only applies when
+    the graph of an endpoint is created.
+    """
+    endpoint = getattr(w3.provider, "endpoint_uri", None)
+    key = (str(endpoint or id(w3.provider)), factory, tuple(fee_tiers))
+    with _graphs_lock:
+        graph = _graphs.get(key)
+        if graph is None:
+            graph = _graphs[key] = PoolGraph(
+                pool_index, factory, fee_tiers, state_tracker=get_pool_state_tracker(w3)
+            )
+        return graph
@@ -0,0 +1,221 @@
+from collections import namedtuple
+
+from eth_abi_codec import (
+    encode_exact_input,
+    encode_exact_input_single,
+    encode_multicall,
+    encode_path,
+)
+from uniswap_route_finder import MAX_HOPS, describe_route
+
+# Part of an order sent along one route
+SplitLeg = namedtuple("SplitLeg", ["route", "amount_in", "amount_out"])
+# An order split over legs; best_route is the best single route for the whole
+# amount (None when none can take it), baseline its output and
+# improvement_bps the gain of the split over it
+SplitPlan = namedtuple(
+    "SplitPlan",
+    ["legs", "amount_in", "amount_out", "best_route", "baseline", "improvement_bps"],
+)
+
+# Parts the order is cut into, each goes to the leg with the best marginal output
+DEFAULT_CHUNKS = 20
+DEFAULT_MAX_LEGS = 4
+# Gas limit of a one-hop swap when it can not be estimated (e.g. while its
+# approval is pending), and what every further hop over all legs adds to it
+DEFAULT_SWAP_GAS = 400000
+DEFAULT_HOP_GAS = 150000
+
+
+def apply_slippage(amount_out, slippage_percent):
+    """Minimum output of a quote, slippage_percent below it"""
+    return amount_out * int((100 - slippage_percent) * 100) // 10000
+
+
+def plan_split(
+    graph,
+    token_in,
+    token_out,
+    amount_in,
+    max_hops=MAX_HOPS,
+    chunks=DEFAULT_CHUNKS,
+    max_legs=DEFAULT_MAX_LEGS,
+):
+    """Split an order over fee tiers and routes to maximize the total output
+
+    Greedy marginal allocation over exact local quotes: the order is cut into
+    `chunks` equal parts and each part goes to the candidate route whose
+    output grows most by taking it. Outputs are concave in the input (price
+    impact only gets worse), so this lands within one chunk of the optimum.
+    Candidates are every pool path of the loaded graph (every fee tier at
+    every hop). Once a route is used, routes sharing a pool with it are left
+    out, so the legs' quotes do not affect each other. As that makes the
+    first chunk decide which of the routes over a shared pool can be used,
+    the allocation is run once per route the first chunk can go to and the
+    best one is kept (quotes are shared between the runs).
+
+    Args:
+        graph: PoolGraph with the pools of both tokens loaded
+        token_in: Source token address
+        token_out: Target token address
+        amount_in: Input amount in Wei
+        max_hops: Longest route
+        chunks: Parts the order is cut into
+        max_legs: Most routes the order is split over
+
+    Returns:
+        SplitPlan, legs largest first; it may not beat the best single route
+        (compare amount_out with baseline)
+
+    Raises:
+        Exception: When the routes together can not take the whole amount
+    """
+    candidates = graph.paths(token_in, token_out, max_hops)
+    sizes = [amount_in // chunks + (1 if i < amount_in % chunks else 0) for i in range(chunks)]
+    sizes = [size for size in sizes if size > 0]
+
+    # (candidate index, amount in) -> output, None when it can not take it
+    quotes = {}
+
+    def quote(index, amount):
+        if (index, amount) not in quotes:
+            route = graph.quote_route(candidates[index], amount)
+            quotes[(index, amount)] = (
+                None if route is None or route.amount_out == 0 else route.amount_out
+            )
+        return quotes[(index, amount)]
+
+    def allocate(first):
+        """Greedy allocation with the first chunk on candidate `first`,
+        None when the routes can not take the whole amount"""
+        allocated = {first: (sizes[0], quote(first, sizes[0]))}  # index -> (in, out)
+        used_pools = set(candidates[first].pools)
+        for size in sizes[1:]:
+            best = None
+            for index in range(len(candidates)):
+                if index not in allocated and (
+                    len(allocated) >= max_legs
+                    or any(pool in used_pools for pool in candidates[index].pools)
+                ):
+                    continue
+                amount, out = allocated.get(index, (0, 0))
+                gained = quote(index, amount + size)
+                if gained is None:
+                    continue
+                if best is None or gained - out > best[1]:
+                    best = (index, gained - out, gained)
+            if best is None:
+                return None
+            index, _, gained = best
+            amount, _ = allocated.get(index, (0, 0))
+            allocated[index] = (amount + size, gained)
+            used_pools.update(candidates[index].pools)
+        return allocated
+
+    starts = [index for index in range(len(candidates)) if quote(index, sizes[0]) is not None]
+    if not starts:
+        raise Exception("No valid liquidity pool found for the token pair")
+    allocations = [
+        allocation for allocation in map(allocate, starts) if allocation is not None
+    ]
+    if not allocations:
+        raise Exception("Not enough liquidity for this amount in the loaded pools")
+    allocated = max(
+        allocations, key=lambda allocation: sum(out for _, out in allocation.values())
+    )
+
+    legs = sorted(
+        (
+            SplitLeg(candidates[index]._replace(amount_out=out), amount, out)
+            for index, (amount, out) in allocated.items()
+        ),
+        key=lambda leg: leg.amount_in,
+        reverse=True,
+    )
+    amount_out = sum(leg.amount_out for leg in legs)
+    single = graph.routes(token_in, token_out, amount_in, max_hops)
+    best_route = single[0] if single else None
+    baseline = best_route.amount_out if best_route is not None else 0
+    improvement_bps = (amount_out - baseline) * 10000 / baseline if baseline else None
+    return SplitPlan(legs, amount_in, amount_out, best_route, baseline, improvement_bps)
+
+
+def plan_legs(plan):
+    """Legs to send for a plan: the split, or the best single route when the
+    split does not beat it (a multicall over several legs costs more gas)"""
+    if plan.best_route is not None and plan.amount_out <= plan.baseline:
+        return [SplitLeg(plan.best_route, plan.amount_in, plan.baseline)]
+    return plan.legs
+
+
+def leg_calldata(route, amount_in, amount_out_minimum, recipient):
+    """exactInputSingle (one pool) or exactInput (a path) calldata of one route"""
+    if len(route.fees) == 1:
+        return encode_exact_input_single(
+            {
+                "tokenIn": route.tokens[0],
+                "tokenOut": route.tokens[1],
+                "fee": route.fees[0],
+                "recipient": recipient,
+                "amountIn": amount_in,
+                "amountOutMinimum": amount_out_minimum,
+                "sqrtPriceLimitX96": 0,
+            }
+        )
+    return encode_exact_input(
+        {
+            "path": encode_path(route.tokens, route.fees),
+            "recipient": recipient,
+            "amountIn": amount_in,
+            "amountOutMinimum": amount_out_minimum,
+        }
+    )
+
+
+def encode_split_swap(legs, recipient, slippage_percent):
+    """Router calldata of the legs, one multicall transaction when there are several
+
+    Every leg gets its own minimum output, slippage_percent below its quote.
+    """
+    calls = [
+        leg_calldata(
+            leg.route, leg.amount_in, apply_slippage(leg.amount_out, slippage_percent), recipient
+        )
+        for leg in legs
+    ]
+    if len(calls) == 1:
+        return calls[0]
+    return encode_multicall(calls)
+
+
+def split_gas_key_parts(legs):
+    """Function and parts of the gas model key of a swap over these legs"""
+    route = legs[0].route
+    if len(legs) > 1:
+        return ("multicall", route.tokens[0], route.tokens[-1], len(legs))
+    if len(route.fees) == 1:
+        return ("exactInputSingle", route.tokens[0], route.tokens[1], route.fees[0])
+    return ("exactInput", *route.tokens, *route.fees)
+
+
+def default_swap_gas(legs):
+    """Gas limit for a swap over these legs when it can not be estimated"""
+    hops = sum(len(leg.route.fees) for leg in legs)
+    return DEFAULT_SWAP_GAS + DEFAULT_HOP_GAS * (hops - 1)
+
+
+def describe_split(plan, symbols=None, decimals_out=None):
+    """Lines describing a split plan and its gain over the best single route"""
+    scale = 10**decimals_out if decimals_out is not None else 1
+    lines = []
+    for leg in plan.legs:
+        lines.append(
+            f"- {leg.amount_in * 100 / plan.amount_in:5.1f}% via {describe_route(leg.route, symbols)}:"
+            f" {leg.amount_out / scale}"
+        )
+    lines.append(f"Split output: {plan.amount_out / scale}, best single route: {plan.baseline / scale}")
+    if plan.improvement_bps is not None:
+        lines.append(f"Improvement over the single route: {plan.improvement_bps:+.1f} bps")
+    if plan_legs(plan) is not plan.legs:
+        lines.append("The split does not beat the single route, the single route is used")
+    return lines
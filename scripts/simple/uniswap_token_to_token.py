@@ -1,134 +1,152 @@
 from web3 import Web3
 from eth_account import Account
-import json
 import time
 
+from eth_abi_codec import (
+    decode_uint,
+    encode_approve,
+    encode_balance_of,
+)
+from eth_batching_provider import get_batching_web3
+from eth_confirmation_tracker import get_confirmation_tracker
+from eth_fee_oracle import describe_fees, get_fee_oracle
+from eth_gas_model import get_default_gas_model
+from eth_nonce_manager import get_nonce_manager, send_with_nonce
+from eth_token_cache import FALLBACK_TOKEN_METADATA, get_default_cache
+from rpc_metrics import span
+from uniswap_multicall import fetch_swap_context
+from uniswap_fee_probe import rank_fee_tiers
+from uniswap_pool_index import get_default_index
+from uniswap_route_finder import MAX_HOPS, describe_route, get_pool_graph
+from uniswap_split import (
+    DEFAULT_MAX_LEGS,
+    SplitLeg,
+    apply_slippage,
+    default_swap_gas,
+    describe_split,
+    encode_split_swap,
+    plan_legs,
+    plan_split,
+    split_gas_key_parts,
+)
+
+# Uniswap V3 Factory address
+FACTORY_ADDRESS = Web3.to_checksum_address("0x33128a8fC17869897dcE68Ed026d694621f6FDfD")
+# Uniswap V3 SwapRouter address
+SWAP_ROUTER_ADDRESS = Web3.to_checksum_address(
+    "0x2626664c2603336E57B271c5C0b26F421741e481"
+)
+FEE_TIERS = [100, 500, 3000, 10000]  # 0.01%, 0.05%, 0.3%, 1%
+
 
 class BaseUniswapV3:
     def __init__(
-        self, rpc_url, chain_id, private_key
+        self,
+        rpc_url,
+        chain_id,
+        private_key,
+        token_cache=None,
+        pool_index=None,
+        urgency="standard",
+        gas_model=None,
+        pool_graph=None,
+        max_hops=MAX_HOPS,
+        max_legs=DEFAULT_MAX_LEGS,
     ):
         # Initialize Web3 connection to Base chain
-        self.w3 = Web3(Web3.HTTPProvider(rpc_url))
+        self.w3 = get_batching_web3(rpc_url)
         self.account = Account.from_key(private_key)
         self.chain_id = chain_id
-
-    def get_token_name_and_decimals(self, token_address):
-        """Get token name and decimals"""
-        try:
-            # Basic ERC20 ABI
-            erc20_abi = json.loads(
-                """[
-                {"constant":true,"inputs":[],"name":"name","outputs":[{"name":"","type":"string"}],"payable":false,"stateMutability":"view","type":"function"},
-                {"constant":true,"inputs":[],"name":"decimals","outputs":[{"name":"","type":"uint8"}],"payable":false,"stateMutability":"view","type":"function"},
-                {"constant":true,"inputs":[],"name":"symbol","outputs":[{"name":"","type":"string"}],"payable":false,"stateMutability":"view","type":"function"}
-            ]"""
-            )
-
-            token_contract = self.w3.eth.contract(address=token_address, abi=erc20_abi)
-            name = token_contract.functions.name().call()
-            symbol = token_contract.functions.symbol().call()
-            decimals = token_contract.functions.decimals().call()
-            return name, symbol, decimals
-        except Exception as e:
-            print(f"Failed to get token info: {str(e)}")
-            return "Unknown", "???", 18  # Default values
-
-    def find_best_pool_fee(self, token_in, token_out, amount_in):
-        """Try to find the best pool fee rate"""
-        fee_tiers = [100, 500, 3000, 10000]  # 0.01%, 0.05%, 0.3%, 1%
-        best_fee = 3000  # Default fee rate 0.3%
-        best_amount_out = 0
-
-        # Uniswap V3 Factory address
-        factory_address = "0x33128a8fC17869897dcE68Ed026d694621f6FDfD"
-
-        # Factory ABI
-        factory_abi = """[{
-            "inputs": [
-                {"internalType": "address", "name": "tokenA", "type": "address"},
-                {"internalType": "address", "name": "tokenB", "type": "address"},
-                {"internalType": "uint24", "name": "fee", "type": "uint24"}
-            ],
-            "name": "getPool",
-            "outputs": [{"internalType": "address", "name": "", "type": "address"}],
-            "stateMutability": "view",
-            "type": "function"
-        }]"""
-
-        # Pool ABI
-        pool_abi = """[{
-            "inputs": [],
-            "name": "slot0",
-            "outputs": [
-                {"internalType": "uint160", "name": "sqrtPriceX96", "type": "uint160"},
-                {"internalType": "int24", "name": "tick", "type": "int24"},
-                {"internalType": "uint16", "name": "observationIndex", "type": "uint16"},
-                {"internalType": "uint16", "name": "observationCardinality", "type": "uint16"},
-                {"internalType": "uint16", "name": "observationCardinalityNext", "type": "uint16"},
-                {"internalType": "uint8", "name": "feeProtocol", "type": "uint8"},
-                {"internalType": "bool", "name": "unlocked", "type": "bool"}
-            ],
-            "stateMutability": "view",
-            "type": "function"
-        }, {
-            "inputs": [],
-            "name": "liquidity",
-            "outputs": [{"internalType": "uint128", "name": "", "type": "uint128"}],
-            "stateMutability": "view",
-            "type": "function"
-        }]"""
-
-        factory = self.w3.eth.contract(
-            address=Web3.to_checksum_address(factory_address), abi=factory_abi
+        # Token metadata cache shared with UniswapV3
+        self.token_cache = token_cache or get_default_cache()
+        # Pool address index shared with the other swap class
+        self.pool_index = pool_index or get_default_index()
+        # Local nonce sequence, lets transactions go out without waiting for
+        # the previous receipt
+        self.nonce_manager = get_nonce_manager(self.w3, self.account.address)
+        # Follows blocks once for every pending transaction of this endpoint
+        self.confirmation_tracker = get_confirmation_tracker(self.w3)
+        # EIP-1559 fees from the endpoint's cached fee history
+        self.fee_oracle = get_fee_oracle(self.w3)
+        self.urgency = urgency
+        # Gas limits learned from earlier receipts
+        self.gas_model = gas_model or get_default_gas_model()
+        # Pools of the endpoint as a graph, routes are searched in memory
+        self.pool_graph = pool_graph or get_pool_graph(
+            self.w3, self.pool_index, FACTORY_ADDRESS, FEE_TIERS
         )
+        self.max_hops = max_hops
+        # Most pools/routes a split order is spread over
+        self.max_legs = max_legs
 
-        print("\nStarting to find best liquidity pool...")
-        for fee in fee_tiers:
-            try:
-                # Get pool address
-                pool_address = factory.functions.getPool(
-                    Web3.to_checksum_address(token_in),
-                    Web3.to_checksum_address(token_out),
-                    fee,
-                ).call()
-
-                if pool_address == "0x0000000000000000000000000000000000000000":
-                    print(f"Fee {fee/10000}% has no liquidity pool")
-                    continue
-
-                pool = self.w3.eth.contract(
-                    address=Web3.to_checksum_address(pool_address), abi=pool_abi
-                )
-
-                # Get pool liquidity
-                liquidity = pool.functions.liquidity().call()
+    def get_token_name_and_decimals(self, token_address, allow_fallback=True):
+        """Get token name and decimals
 
-                # Get current price
-                slot0 = pool.functions.slot0().call()
-                sqrt_price_x96 = slot0[0]
+        Metadata comes from the shared token cache, a miss is read in a single
+        Multicall3 round trip and cached.
 
-                # If pool has liquidity, calculate expected output
-                if liquidity > 0:
-                    # Use simple price calculation (this is an approximation)
-                    price = (sqrt_price_x96**2) / (2**192)
-                    amount_out = (amount_in * price) * (
-                        1 - fee / 1000000
-                    )  # Consider fee
-
-                    print(f"Fee {fee/10000}%:")
-                    print(f"- Pool address: {pool_address}")
-                    print(f"- Liquidity: {liquidity}")
-                    print(f"- Expected output: {amount_out}")
+        Args:
+            token_address: Token address
+            allow_fallback: Return FALLBACK_TOKEN_METADATA instead of raising
+                when the metadata can not be read
+        """
+        token_address = Web3.to_checksum_address(token_address)
+        metadata = self.token_cache.fetch(self.w3, self.chain_id, [token_address])
+        if token_address in metadata:
+            return metadata[token_address]
+        if not allow_fallback:
+            raise Exception(f"Failed to get token info of {token_address}")
+        return FALLBACK_TOKEN_METADATA  # Default values
+
+    def rank_pool_fees(self, token_in, token_out, amount_in, deadline=3.0):
+        """Quote every fee tier concurrently
+
+        Pool addresses come from the pool index and only live pool state is
+        read from chain, all tiers in parallel. Pools quoted before are kept
+        current from their logs (uniswap_pool_state.py) and cost no RPC. The
+        output of each pool is quoted exactly by simulating the swap over its
+        initialized ticks.
+
+        Args:
+            token_in: Source token address
+            token_out: Target token address
+            amount_in: Input amount in Wei
+            deadline: Seconds to wait for the slowest tier
+
+        Returns:
+            List of FeeTierQuote for every tier, best expected output first
+        """
+        return rank_fee_tiers(
+            self.w3,
+            self.pool_index,
+            FACTORY_ADDRESS,
+            token_in,
+            token_out,
+            amount_in,
+            FEE_TIERS,
+            deadline,
+        )
 
-                    if amount_out > best_amount_out:
-                        best_amount_out = amount_out
-                        best_fee = fee
+    def find_best_pool_fee(self, token_in, token_out, amount_in, deadline=3.0):
+        """Try to find the best pool fee rate
 
-            except Exception as e:
-                print(f"Error querying fee {fee/10000}%: {str(e)}")
+        Returns:
+            (best fee, expected output in Wei of token_out)
+        """
+        print("\nStarting to find best liquidity pool...")
+        ranking = self.rank_pool_fees(token_in, token_out, amount_in, deadline)
+        for quote in ranking:
+            if quote.amount_out is None:
+                print(f"Fee {quote.fee/10000}%: {quote.error}")
                 continue
-
+            print(f"Fee {quote.fee/10000}%:")
+            print(f"- Pool address: {quote.pool_address}")
+            print(f"- Liquidity: {quote.liquidity}")
+            print(f"- Expected output: {quote.amount_out}")
+            print(f"- Initialized ticks crossed: {quote.ticks_crossed}")
+            print(f"- Pool state at block: {quote.block_number}")
+
+        best_fee, best_amount_out = ranking[0].fee, ranking[0].amount_out or 0
         if best_amount_out == 0:
             print("\nWarning: Could not find any valid liquidity pool")
             print("Please check:")
@@ -141,12 +159,70 @@ class BaseUniswapV3:
         print(f"Expected output: {best_amount_out}")
         return best_fee, best_amount_out
 
+    def _symbols(self, tokens):
+        symbols = {}
+        for token in tokens:
+            metadata = self.token_cache.get(self.chain_id, token)
+            if metadata is not None:
+                symbols[token] = metadata[1]
+        return symbols
+
+    def find_best_route(self, token_in, token_out, amount_in):
+        """Find the route with the best output, direct or through WETH/USDC
+
+        Pools between the two tokens and the connector tokens are read in at
+        most three round trips (cached for a block), then every route of up
+        to max_hops pools is quoted exactly in memory.
+
+        Returns:
+            Route (tokens, fees, pools, amount_out, ticks_crossed)
+        """
+        print("\nSearching swap routes...")
+        routes = self.pool_graph.find_routes(
+            self.w3, token_in, token_out, amount_in, self.max_hops
+        )
+        symbols = self._symbols({token for route in routes for token in route.tokens})
+        for route in routes[:5]:
+            print(f"- {describe_route(route, symbols)}: expected output {route.amount_out}")
+
+        if not routes:
+            print("\nWarning: Could not find any valid liquidity pool")
+            print("Please check:")
+            print("1. Token addresses are correct")
+            print("2. Trading pair exists")
+            print("3. Sufficient liquidity exists")
+            raise Exception("No valid liquidity pool found for the token pair")
+
+        best = routes[0]
+        print(f"\nSelected route: {describe_route(best, symbols)}")
+        print(f"Expected output: {best.amount_out}")
+        return best
+
+    def plan_split_swap(self, token_in, token_out, amount_in):
+        """Split an order over fee tiers and routes, see uniswap_split.plan_split
+
+        Returns:
+            SplitPlan, its improvement over the best single route is printed
+        """
+        print("\nSplitting the order over pools and routes...")
+        self.pool_graph.load(self.w3, [token_in, token_out])
+        plan = plan_split(
+            self.pool_graph, token_in, token_out, amount_in, self.max_hops, max_legs=self.max_legs
+        )
+        symbols = self._symbols({token for leg in plan.legs for token in leg.route.tokens})
+        metadata_out = self.token_cache.get(self.chain_id, token_out)
+        decimals_out = metadata_out[2] if metadata_out is not None else None
+        for line in describe_split(plan, symbols, decimals_out):
+            print(line)
+        return plan
+
     def swap(
         self,
         source_token_address,
         target_token_address,
         source_token_amount,
         slippage_percent=1.0,
+        split=False,
     ):
         """
         Swap source token for target token
@@ -156,213 +232,163 @@ class BaseUniswapV3:
             target_token_address: Target token address
             source_token_amount: Amount of source token to swap (in source token units, not Wei)
             slippage_percent: Slippage percentage (default 1%)
+            split: Spread a large order over fee tiers and routes (one transaction)
         """
         source_token_address = Web3.to_checksum_address(source_token_address)
         target_token_address = Web3.to_checksum_address(target_token_address)
 
-        # Get source token info
+        # Read both tokens' info, balance, allowance and pools of every fee tier
+        # in one round trip, token info is skipped when already cached
+        with span("metadata"):
+            context = fetch_swap_context(
+                self.w3,
+                self.account.address,
+                source_token_address,
+                target_token_address,
+                SWAP_ROUTER_ADDRESS,
+                FACTORY_ADDRESS,
+                [],  # pool addresses come from the pool index
+                metadata_tokens=[
+                    token_address
+                    for token_address in (source_token_address, target_token_address)
+                    if self.token_cache.get(self.chain_id, token_address) is None
+                ],
+            )
+
+        # Get source token info, decimals must be real so there is no fallback
         source_token_name, source_token_symbol, source_token_decimals = (
-            self.get_token_name_and_decimals(source_token_address)
+            self.token_cache.resolve(self.chain_id, source_token_address, context)
         )
         print(f"Source token: {source_token_name} ({source_token_symbol})")
 
         # Get target token info
         target_token_name, target_token_symbol, target_token_decimals = (
-            self.get_token_name_and_decimals(target_token_address)
+            self.token_cache.resolve(self.chain_id, target_token_address, context)
         )
         print(f"Target token: {target_token_name} ({target_token_symbol})")
 
-        # Check USDC balance
-        source_token_contract = self.w3.eth.contract(
-            address=source_token_address,
-            abi=json.loads(
-                """[
-                {"constant":true,"inputs":[{"name":"_owner","type":"address"}],"name":"balanceOf","outputs":[{"name":"balance","type":"uint256"}],"payable":false,"stateMutability":"view","type":"function"},
-                {"constant":true,"inputs":[],"name":"decimals","outputs":[{"name":"","type":"uint8"}],"payable":false,"stateMutability":"view","type":"function"}
-            ]"""
-            ),
-        )
-        source_token_balance = source_token_contract.functions.balanceOf(
-            self.account.address
-        ).call()
-        source_token_decimals = source_token_contract.functions.decimals().call()
+        # Check source token balance
+        balance_result = context[("balance", source_token_address)]
+        if not balance_result.success:
+            raise Exception(
+                f"Failed to read {source_token_symbol} balance: {balance_result.error}"
+            )
+        source_token_balance = balance_result.value
         source_token_balance_formatted = source_token_balance / (
             10**source_token_decimals
         )
         print(
             f"Current account {source_token_symbol} balance: {source_token_balance_formatted} {source_token_symbol}"
         )
-        # Ensure sufficient balance
-        if source_token_balance_formatted < source_token_amount:
-            raise (
-                f"Warning: Insufficient {source_token_symbol} balance! Current balance: {source_token_balance_formatted} {source_token_symbol}"
-            )
 
         amount_in_wei = int(source_token_amount * (10**source_token_decimals))
 
-        # Check and approve USDC
-        erc20_abi = json.loads(
-            """[
-            {"constant":true,"inputs":[{"name":"_owner","type":"address"}],"name":"balanceOf","outputs":[{"name":"balance","type":"uint256"}],"payable":false,"stateMutability":"view","type":"function"},
-            {"constant":false,"inputs":[{"name":"_spender","type":"address"},{"name":"_value","type":"uint256"}],"name":"approve","outputs":[{"name":"success","type":"bool"}],"payable":false,"stateMutability":"nonpayable","type":"function"},
-            {"constant":true,"inputs":[{"name":"_owner","type":"address"},{"name":"_spender","type":"address"}],"name":"allowance","outputs":[{"name":"remaining","type":"uint256"}],"payable":false,"stateMutability":"view","type":"function"}
-        ]"""
-        )
-
-        token_contract = self.w3.eth.contract(
-            address=source_token_address, abi=erc20_abi
-        )
-        swap_router_address = Web3.to_checksum_address(
-            "0x2626664c2603336E57B271c5C0b26F421741e481"
-        )
-
-        # Check balance
-        balance = token_contract.functions.balanceOf(self.account.address).call()
-        if balance < amount_in_wei:
+        # Ensure sufficient balance
+        if source_token_balance < amount_in_wei:
             raise Exception(
-                f"Insufficient {source_token_symbol} balance. Required: {source_token_amount}, Current balance: {balance / (10 ** source_token_decimals)}"
+                f"Insufficient {source_token_symbol} balance. Required: {source_token_amount}, Current balance: {source_token_balance_formatted}"
             )
 
+        # Check and approve source token
+        swap_router_address = SWAP_ROUTER_ADDRESS
+
         # Check allowance
-        allowance = token_contract.functions.allowance(
-            self.account.address, swap_router_address
-        ).call()
+        allowance_result = context[("allowance", source_token_address)]
+        allowance = allowance_result.value if allowance_result.success else 0
         print(f"Current {source_token_symbol} allowance: {allowance}")
+        approve_tx_hash = None
         if allowance < amount_in_wei:
             print(f"Need to approve {source_token_symbol}...")
-            approve_txn = token_contract.functions.approve(
-                swap_router_address, amount_in_wei  # Only approve the amount needed
-            ).build_transaction(
-                {
-                    "from": self.account.address,
-                    "nonce": self.w3.eth.get_transaction_count(self.account.address),
-                    "gas": 100000,
-                    "gasPrice": self.w3.eth.gas_price,
-                }
+            approve_key = self.gas_model.key(
+                self.chain_id, source_token_address, "approve"
             )
+            approve_gas = self.gas_model.suggest(approve_key) or 100000
+            approve_txn = {
+                "from": self.account.address,
+                "to": source_token_address,
+                # Only approve the amount needed
+                "data": encode_approve(swap_router_address, amount_in_wei),
+                "nonce": 0,  # filled in by the nonce manager
+                "gas": approve_gas,
+                **self.fee_oracle.fee_fields(self.urgency),
+                "chainId": self.chain_id,
+            }
 
-            signed_approve_txn = self.w3.eth.account.sign_transaction(
-                approve_txn, self.account.key
-            )
-            approve_tx_hash = self.w3.eth.send_raw_transaction(
-                signed_approve_txn.raw_transaction
-            )
-            print(
-                f"Waiting for approval transaction confirmation... Hash: {approve_tx_hash.hex()}"
+            # The swap takes the next nonce, so it can be sent right behind the
+            # approval instead of waiting for the approval to be mined
+            with span("approve"):
+                approve_tx_hash = send_with_nonce(
+                    self.nonce_manager, approve_txn, self.account.key
+                )
+            print(f"Approval transaction sent, hash: {approve_tx_hash.hex()}")
+            self.gas_model.record_when_mined(
+                self.confirmation_tracker, approve_tx_hash, approve_key, approve_gas
             )
-            self.w3.eth.wait_for_transaction_receipt(approve_tx_hash)
-            print("Approval completed")
 
-        # Find best fee rate
-        best_fee, amount_out_quote = self.find_best_pool_fee(
-            source_token_address, target_token_address, amount_in_wei
-        )
+        # Find the best route, a direct pool or a path through WETH/USDC, or
+        # spread the order over several of them
+        with span("quote"):
+            if split:
+                legs = plan_legs(
+                    self.plan_split_swap(
+                        source_token_address, target_token_address, amount_in_wei
+                    )
+                )
+            else:
+                route = self.find_best_route(
+                    source_token_address,
+                    target_token_address,
+                    amount_in_wei,
+                )
+                legs = [SplitLeg(route, amount_in_wei, route.amount_out)]
 
-        # Calculate minimum output considering slippage
-        min_amount_out = int(amount_out_quote * (100 - slippage_percent) / 100)
+        # Calculate minimum output considering slippage, per leg
+        min_amount_out = sum(apply_slippage(leg.amount_out, slippage_percent) for leg in legs)
         print(f"min_amount_out: {min_amount_out}")
 
-        # Use SwapRouter
-        swap_router_abi = json.loads(
-            """[
-            {
-                "inputs": [
-                    {
-                        "components": [
-                            {
-                                "internalType": "address",
-                                "name": "tokenIn",
-                                "type": "address"
-                            },
-                            {
-                                "internalType": "address",
-                                "name": "tokenOut",
-                                "type": "address"
-                            },
-                            {
-                                "internalType": "uint24",
-                                "name": "fee",
-                                "type": "uint24"
-                            },
-                            {
-                                "internalType": "address",
-                                "name": "recipient",
-                                "type": "address"
-                            },
-                            {
-                                "internalType": "uint256",
-                                "name": "amountIn",
-                                "type": "uint256"
-                            },
-                            {
-                                "internalType": "uint256",
-                                "name": "amountOutMinimum",
-                                "type": "uint256"
-                            },
-                            {
-                                "internalType": "uint160",
-                                "name": "sqrtPriceLimitX96",
-                                "type": "uint160"
-                            }
-                        ],
-                        "internalType": "struct ISwapRouter.ExactInputSingleParams",
-                        "name": "params",
-                        "type": "tuple"
-                    }
-                ],
-                "name": "exactInputSingle",
-                "outputs": [
-                    {
-                        "internalType": "uint256",
-                        "name": "amountOut",
-                        "type": "uint256"
-                    }
-                ],
-                "stateMutability": "payable",
-                "type": "function"
-            }
-        ]"""
+        # Precompiled calldata, no ABI parsing or contract object per swap,
+        # the legs of a split order go out as one router multicall
+        swap_data = encode_split_swap(legs, self.account.address, slippage_percent)
+        # Gas limit learned from earlier swaps of the same pool, path or split
+        gas_key = self.gas_model.key(
+            self.chain_id, swap_router_address, *split_gas_key_parts(legs)
         )
-        swap_router = self.w3.eth.contract(
-            address=swap_router_address, abi=swap_router_abi
-        )
-
-        # Build transaction parameters
-        params = {
-            "tokenIn": source_token_address,
-            "tokenOut": target_token_address,
-            "fee": best_fee,
-            "recipient": self.account.address,
-            "amountIn": amount_in_wei,
-            "amountOutMinimum": min_amount_out,
-            "sqrtPriceLimitX96": 0,
-        }
-
-        # Get current gas price
-        gas_price = self.w3.eth.gas_price
-        gas_price_adjusted = int(gas_price * 1.2)
-
-        # Estimate gas usage
-        gas_estimate = 400000  # Default estimate
-        try:
-            gas_estimate = swap_router.functions.exactInputSingle(params).estimate_gas(
-                {"from": self.account.address}
-            )
-            gas_estimate = int(gas_estimate * 1.2)
-        except Exception as e:
-            print(f"Gas estimation failed, using default value: {str(e)}")
+        # Used when estimation is not possible, grows with legs and hops
+        default_gas = default_swap_gas(legs)
+
+        # Get current fees
+        with span("gas"):
+            fee_fields = self.fee_oracle.fee_fields(self.urgency)
+
+            # The node only estimates a key without enough samples
+            if approve_tx_hash is not None and self.gas_model.suggest(gas_key) is None:
+                # Estimation would revert until the approval is mined
+                print("Approval pending, using default gas estimate")
+                gas_estimate = default_gas
+            else:
+                gas_estimate = self.gas_model.limit(
+                    gas_key,
+                    lambda: self.w3.eth.estimate_gas(
+                        {
+                            "from": self.account.address,
+                            "to": swap_router_address,
+                            "data": swap_data,
+                        }
+                    ),
+                    default=default_gas,
+                )
 
         # Build transaction
-        transaction = swap_router.functions.exactInputSingle(params).build_transaction(
-            {
-                "from": self.account.address,
-                "nonce": self.w3.eth.get_transaction_count(self.account.address),
-                "gas": gas_estimate,
-                "gasPrice": gas_price_adjusted,
-                "value": 0,  # No ETH needed
-                "chainId": 8453,
-            }
-        )
+        transaction = {
+            "from": self.account.address,
+            "to": swap_router_address,
+            "data": swap_data,
+            "nonce": 0,  # filled in by the nonce manager
+            "gas": gas_estimate,
+            **fee_fields,
+            "value": 0,  # No ETH needed
+            "chainId": self.chain_id,
+        }
 
         # Output transaction info
         print(
@@ -372,34 +398,38 @@ class BaseUniswapV3:
             f"Expected minimum output: {min_amount_out / (10 ** target_token_decimals)} {target_token_symbol}"
         )
         print(f"Gas estimate: {gas_estimate} units")
-        print(f"Gas price: {self.w3.from_wei(gas_price_adjusted, 'gwei')} Gwei")
+        print(f"Gas price: {describe_fees(self.w3, fee_fields)}")
 
         # Sign and send transaction
-        signed_txn = self.w3.eth.account.sign_transaction(transaction, self.account.key)
-
-        print("Transaction signed, sending...")
-        tx_hash = self.w3.eth.send_raw_transaction(signed_txn.raw_transaction)
+        print("Signing and sending transaction...")
+        with span("send"):
+            tx_hash = send_with_nonce(self.nonce_manager, transaction, self.account.key)
         print(f"Transaction submitted, hash: {tx_hash.hex()}")
 
         try:
             print("Waiting for transaction confirmation...")
-            tx_receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash, timeout=180)
+            with span("confirm"):
+                tx_receipt = self.confirmation_tracker.wait(
+                    tx_hash, timeout=180, nonce_manager=self.nonce_manager
+                )
+            self.nonce_manager.mark_confirmed(tx_hash)
+            self.gas_model.record(gas_key, tx_receipt, gas_estimate)
+            if approve_tx_hash is not None:
+                # Mined before the swap (lower nonce)
+                self.nonce_manager.mark_confirmed(approve_tx_hash)
             print(f"Transaction confirmed in block {tx_receipt['blockNumber']}")
 
             if tx_receipt["status"] == 1:
                 print("Transaction executed successfully!")
                 # Query received token amount
-                erc20_abi = json.loads(
-                    """[
-                    {"constant":true,"inputs":[{"name":"_owner","type":"address"}],"name":"balanceOf","outputs":[{"name":"balance","type":"uint256"}],"payable":false,"stateMutability":"view","type":"function"}
-                ]"""
-                )
-                token_contract = self.w3.eth.contract(
-                    address=target_token_address, abi=erc20_abi
+                balance = decode_uint(
+                    self.w3.eth.call(
+                        {
+                            "to": target_token_address,
+                            "data": encode_balance_of(self.account.address),
+                        }
+                    )
                 )
-                balance = token_contract.functions.balanceOf(
-                    self.account.address
-                ).call()
                 print(
                     f"Current {target_token_symbol} balance: {balance / (10 ** target_token_decimals)}"
                 )
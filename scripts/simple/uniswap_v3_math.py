@@ -0,0 +1,460 @@
+from collections import namedtuple
+
+from web3 import Web3
+
+from eth_abi_codec import (
+    decode_slot0,
+    decode_ticks,
+    decode_uint,
+    encode_liquidity,
+    encode_slot0,
+    encode_tick_bitmap,
+    encode_ticks,
+)
+from uniswap_multicall import Multicall3
+
+# Integer port of the Uniswap V3 core libraries (TickMath, SqrtPriceMath,
+# SwapMath) plus a tick walking swap simulation over a pool snapshot.
+
+MIN_TICK = -887272
+MAX_TICK = 887272
+MIN_SQRT_RATIO = 4295128739
+MAX_SQRT_RATIO = 1461446703485210103287273052203988822378723970342
+
+# Tick spacing of each fee tier enabled on the canonical factories
+FEE_TICK_SPACING = {100: 1, 500: 10, 2500: 50, 3000: 60, 10000: 200}
+
+Q96 = 1 << 96
+RESOLUTION = 96
+MAX_UINT256 = (1 << 256) - 1
+
+# Pool reads needed for a snapshot
+POOL_SNAPSHOT_ABI = [
+    {"inputs": [{"internalType": "int16", "name": "", "type": "int16"}], "name": "tickBitmap", "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}], "stateMutability": "view", "type": "function"},
+    {
+        "inputs": [{"internalType": "int24", "name": "", "type": "int24"}],
+        "name": "ticks",
+        "outputs": [
+            {"internalType": "uint128", "name": "liquidityGross", "type": "uint128"},
+            {"internalType": "int128", "name": "liquidityNet", "type": "int128"},
+            {"internalType": "uint256", "name": "feeGrowthOutside0X128", "type": "uint256"},
+            {"internalType": "uint256", "name": "feeGrowthOutside1X128", "type": "uint256"},
+            {"internalType": "int56", "name": "tickCumulativeOutside", "type": "int56"},
+            {"internalType": "uint160", "name": "secondsPerLiquidityOutsideX128", "type": "uint160"},
+            {"internalType": "uint32", "name": "secondsOutside", "type": "uint32"},
+            {"internalType": "bool", "name": "initialized", "type": "bool"},
+        ],
+        "stateMutability": "view",
+        "type": "function",
+    },
+]
+
+# Result of a simulated exact input swap
+Quote = namedtuple(
+    "Quote",
+    ["amount_in", "amount_out", "sqrt_price_x96_after", "tick_after", "ticks_crossed", "complete"],
+)
+
+
+def mul_div(a, b, denominator):
+    return a * b // denominator
+
+
+def mul_div_rounding_up(a, b, denominator):
+    return -(-(a * b) // denominator)
+
+
+def div_rounding_up(a, b):
+    return -(-a // b)
+
+
+def get_sqrt_ratio_at_tick(tick):
+    """TickMath.getSqrtRatioAtTick"""
+    abs_tick = abs(tick)
+    if abs_tick > MAX_TICK:
+        raise ValueError(f"Tick {tick} out of range")
+
+    ratio = 0xFFFCB933BD6FAD37AA2D162D1A594001 if abs_tick & 0x1 else 0x100000000000000000000000000000000
+    for bit, factor in (
+        (0x2, 0xFFF97272373D413259A46990580E213A),
+        (0x4, 0xFFF2E50F5F656932EF12357CF3C7FDCC),
+        (0x8, 0xFFE5CACA7E10E4E61C3624EAA0941CD0),
+        (0x10, 0xFFCB9843D60F6159C9DB58835C926644),
+        (0x20, 0xFF973B41FA98C081472E6896DFB254C0),
+        (0x40, 0xFF2EA16466C96A3843EC78B326B52861),
+        (0x80, 0xFE5DEE046A99A2A811C461F1969C3053),
+        (0x100, 0xFCBE86C7900A88AEDCFFC83B479AA3A4),
+        (0x200, 0xF987A7253AC413176F2B074CF7815E54),
+        (0x400, 0xF3392B0822B70005940C7A398E4B70F3),
+        (0x800, 0xE7159475A2C29B7443B29C7FA6E889D9),
+        (0x1000, 0xD097F3BDFD2022B8845AD8F792AA5825),
+        (0x2000, 0xA9F746462D870FDF8A65DC1F90E061E5),
+        (0x4000, 0x70D869A156D2A1B890BB3DF62BAF32F7),
+        (0x8000, 0x31BE135F97D08FD981231505542FCFA6),
+        (0x10000, 0x9AA508B5B7A84E1C677DE54F3E99BC9),
+        (0x20000, 0x5D6AF8DEDB81196699C329225EE604),
+        (0x40000, 0x2216E584F5FA1EA926041BEDFE98),
+        (0x80000, 0x48A170391F7DC42444E8FA2),
+    ):
+        if abs_tick & bit:
+            ratio = (ratio * factor) >> 128
+
+    if tick > 0:
+        ratio = MAX_UINT256 // ratio
+
+    # Round up to Q64.96
+    return (ratio >> 32) + (0 if ratio % (1 << 32) == 0 else 1)
+
+
+def get_tick_at_sqrt_ratio(sqrt_price_x96):
+    """TickMath.getTickAtSqrtRatio, the greatest tick whose ratio is <= the price"""
+    if not MIN_SQRT_RATIO <= sqrt_price_x96 < MAX_SQRT_RATIO:
+        raise ValueError("Sqrt price out of range")
+
+    # Exact integer version of the log2 approximation used on chain
+    low, high = MIN_TICK, MAX_TICK
+    while low < high:
+        mid = (low + high + 1) // 2
+        if get_sqrt_ratio_at_tick(mid) <= sqrt_price_x96:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def get_amount0_delta(sqrt_ratio_a, sqrt_ratio_b, liquidity, round_up):
+    """SqrtPriceMath.getAmount0Delta"""
+    if sqrt_ratio_a > sqrt_ratio_b:
+        sqrt_ratio_a, sqrt_ratio_b = sqrt_ratio_b, sqrt_ratio_a
+    numerator1 = liquidity << RESOLUTION
+    numerator2 = sqrt_ratio_b - sqrt_ratio_a
+    if round_up:
+        return div_rounding_up(
+            mul_div_rounding_up(numerator1, numerator2, sqrt_ratio_b), sqrt_ratio_a
+        )
+    return mul_div(numerator1, numerator2, sqrt_ratio_b) // sqrt_ratio_a
+
+
+def get_amount1_delta(sqrt_ratio_a, sqrt_ratio_b, liquidity, round_up):
+    """SqrtPriceMath.getAmount1Delta"""
+    if sqrt_ratio_a > sqrt_ratio_b:
+        sqrt_ratio_a, sqrt_ratio_b = sqrt_ratio_b, sqrt_ratio_a
+    if round_up:
+        return mul_div_rounding_up(liquidity, sqrt_ratio_b - sqrt_ratio_a, Q96)
+    return mul_div(liquidity, sqrt_ratio_b - sqrt_ratio_a, Q96)
+
+
+def get_next_sqrt_price_from_input(sqrt_price_x96, liquidity, amount_in, zero_for_one):
+    """SqrtPriceMath.getNextSqrtPriceFromInput"""
+    if zero_for_one:
+        # getNextSqrtPriceFromAmount0RoundingUp (add)
+        if amount_in == 0:
+            return sqrt_price_x96
+        numerator1 = liquidity << RESOLUTION
+        product = amount_in * sqrt_price_x96
+        if product > MAX_UINT256:
+            return div_rounding_up(numerator1, numerator1 // sqrt_price_x96 + amount_in)
+        denominator = numerator1 + product
+        if denominator <= MAX_UINT256:
+            # No uint256 overflow on chain either
+            return mul_div_rounding_up(numerator1, sqrt_price_x96, denominator)
+        return div_rounding_up(numerator1, numerator1 // sqrt_price_x96 + amount_in)
+
+    # getNextSqrtPriceFromAmount1RoundingDown (add)
+    return sqrt_price_x96 + (amount_in << RESOLUTION) // liquidity
+
+
+def compute_swap_step(sqrt_price_current, sqrt_price_target, liquidity, amount_remaining, fee_pips):
+    """SwapMath.computeSwapStep for exact input
+
+    Returns:
+        (sqrt_price_next, amount_in, amount_out, fee_amount)
+    """
+    zero_for_one = sqrt_price_current >= sqrt_price_target
+
+    amount_remaining_less_fee = mul_div(amount_remaining, 1_000_000 - fee_pips, 1_000_000)
+    if zero_for_one:
+        amount_in = get_amount0_delta(sqrt_price_target, sqrt_price_current, liquidity, True)
+    else:
+        amount_in = get_amount1_delta(sqrt_price_current, sqrt_price_target, liquidity, True)
+
+    if amount_remaining_less_fee >= amount_in:
+        sqrt_price_next = sqrt_price_target
+    else:
+        sqrt_price_next = get_next_sqrt_price_from_input(
+            sqrt_price_current, liquidity, amount_remaining_less_fee, zero_for_one
+        )
+
+    reached_target = sqrt_price_target == sqrt_price_next
+    if zero_for_one:
+        if not reached_target:
+            amount_in = get_amount0_delta(sqrt_price_next, sqrt_price_current, liquidity, True)
+        amount_out = get_amount1_delta(sqrt_price_next, sqrt_price_current, liquidity, False)
+    else:
+        if not reached_target:
+            amount_in = get_amount1_delta(sqrt_price_current, sqrt_price_next, liquidity, True)
+        amount_out = get_amount0_delta(sqrt_price_current, sqrt_price_next, liquidity, False)
+
+    if not reached_target:
+        # Didn't reach the target, take the remainder of the input as fee
+        fee_amount = amount_remaining - amount_in
+    else:
+        fee_amount = mul_div_rounding_up(amount_in, fee_pips, 1_000_000 - fee_pips)
+
+    return sqrt_price_next, amount_in, amount_out, fee_amount
+
+
+def most_significant_bit(x):
+    return x.bit_length() - 1
+
+
+def least_significant_bit(x):
+    return (x & -x).bit_length() - 1
+
+
+class PoolSnapshot:
+    def __init__(
+        self,
+        sqrt_price_x96,
+        tick,
+        liquidity,
+        fee,
+        tick_spacing,
+        bitmap,
+        ticks,
+        block_number=None,
+    ):
+        """Pool state needed to simulate a swap locally
+
+        Args:
+            sqrt_price_x96: slot0.sqrtPriceX96
+            tick: slot0.tick
+            liquidity: Active liquidity
+            fee: Pool fee in pips (500 = 0.05%)
+            tick_spacing: Pool tick spacing
+            bitmap: dict of loaded tick bitmap word position -> word
+            ticks: dict of initialized tick -> (liquidityGross, liquidityNet)
+            block_number: Block the snapshot was read at
+        """
+        self.sqrt_price_x96 = sqrt_price_x96
+        self.tick = tick
+        self.liquidity = liquidity
+        self.fee = fee
+        self.tick_spacing = tick_spacing
+        self.bitmap = bitmap
+        self.ticks = ticks
+        self.block_number = block_number
+
+    def next_initialized_tick_within_one_word(self, tick, lte):
+        """TickBitmap.nextInitializedTickWithinOneWord over the loaded words
+
+        Returns:
+            (tick_next, initialized), or None when the word is not loaded
+        """
+        compressed = tick // self.tick_spacing  # floors like the contract for negative ticks
+        if lte:
+            word_pos, bit_pos = compressed >> 8, compressed % 256
+            if word_pos not in self.bitmap:
+                return None
+            mask = (1 << bit_pos) - 1 + (1 << bit_pos)
+            masked = self.bitmap[word_pos] & mask
+            if masked:
+                return (compressed - (bit_pos - most_significant_bit(masked))) * self.tick_spacing, True
+            return (compressed - bit_pos) * self.tick_spacing, False
+
+        word_pos, bit_pos = (compressed + 1) >> 8, (compressed + 1) % 256
+        if word_pos not in self.bitmap:
+            return None
+        mask = MAX_UINT256 ^ ((1 << bit_pos) - 1)
+        masked = self.bitmap[word_pos] & mask
+        if masked:
+            return (compressed + 1 + (least_significant_bit(masked) - bit_pos)) * self.tick_spacing, True
+        return (compressed + 1 + (255 - bit_pos)) * self.tick_spacing, False
+
+
+def quote_exact_input(snapshot, amount_in, zero_for_one, sqrt_price_limit_x96=None):
+    """Simulate UniswapV3Pool.swap for an exact input amount
+
+    Steps through the tick bitmap word by word and crosses initialized ticks
+    exactly like the pool contract, so the result matches QuoterV2.
+
+    Args:
+        snapshot: PoolSnapshot
+        amount_in: Input amount (token0 when zero_for_one, else token1)
+        zero_for_one: Swap direction, True sells token0 for token1
+        sqrt_price_limit_x96: Optional price limit, defaults to the extremes
+
+    Returns:
+        Quote; `complete` is False when the swap ran past the loaded bitmap
+        words (or hit the price limit) before using the whole input
+    """
+    if sqrt_price_limit_x96 is None:
+        sqrt_price_limit_x96 = MIN_SQRT_RATIO + 1 if zero_for_one else MAX_SQRT_RATIO - 1
+
+    sqrt_price = snapshot.sqrt_price_x96
+    tick = snapshot.tick
+    liquidity = snapshot.liquidity
+    amount_remaining = amount_in
+    amount_out = 0
+    ticks_crossed = 0
+
+    while amount_remaining != 0 and sqrt_price != sqrt_price_limit_x96:
+        sqrt_price_start = sqrt_price
+        step = snapshot.next_initialized_tick_within_one_word(tick, zero_for_one)
+        if step is None:
+            # Ran out of loaded bitmap words
+            break
+        tick_next, initialized = step
+        tick_next = max(MIN_TICK, min(MAX_TICK, tick_next))
+        sqrt_price_next_tick = get_sqrt_ratio_at_tick(tick_next)
+
+        if zero_for_one:
+            sqrt_price_target = max(sqrt_price_next_tick, sqrt_price_limit_x96)
+        else:
+            sqrt_price_target = min(sqrt_price_next_tick, sqrt_price_limit_x96)
+
+        sqrt_price, step_in, step_out, fee_amount = compute_swap_step(
+            sqrt_price, sqrt_price_target, liquidity, amount_remaining, snapshot.fee
+        )
+        amount_remaining -= step_in + fee_amount
+        amount_out += step_out
+
+        if sqrt_price == sqrt_price_next_tick:
+            if initialized:
+                liquidity_net = snapshot.ticks[tick_next][1]
+                if zero_for_one:
+                    liquidity_net = -liquidity_net
+                liquidity += liquidity_net
+                ticks_crossed += 1
+            tick = tick_next - 1 if zero_for_one else tick_next
+        elif sqrt_price != sqrt_price_start:
+            tick = get_tick_at_sqrt_ratio(sqrt_price)
+
+    return Quote(
+        amount_in - amount_remaining,
+        amount_out,
+        sqrt_price,
+        tick,
+        ticks_crossed,
+        amount_remaining == 0,
+    )
+
+
+def _queue_snapshot_state(multicall, pools, word_radius):
+    """First snapshot round: block number, slot0, liquidity and bitmap words"""
+    multicall.add_block_number("block")
+    word_ranges = {}
+    for pool_address, fee, tick_hint in pools:
+        target = Web3.to_checksum_address(pool_address)
+        tick_spacing = FEE_TICK_SPACING[fee]
+        word = (tick_hint // tick_spacing) >> 8
+        word_ranges[pool_address] = range(
+            max(word - word_radius, (MIN_TICK // tick_spacing) >> 8),
+            min(word + word_radius, (MAX_TICK // tick_spacing) >> 8) + 1,
+        )
+        multicall.add_call(("slot0", pool_address), target, encode_slot0(), decode_slot0)
+        multicall.add_call(
+            ("liquidity", pool_address), target, encode_liquidity(), decode_uint
+        )
+        for word_pos in word_ranges[pool_address]:
+            multicall.add_call(
+                ("bitmap", pool_address, word_pos),
+                target,
+                encode_tick_bitmap(word_pos),
+                decode_uint,
+            )
+    return word_ranges
+
+
+def _read_snapshot_state(multicall, pools, state_results, word_ranges):
+    """Build snapshots without ticks and queue the second round (tick reads)"""
+    block_number = state_results["block"].value
+    snapshots = {}
+    initialized_ticks = {}
+    for pool_address, fee, _ in pools:
+        failed = [
+            result.error
+            for key, result in state_results.items()
+            if key != "block" and key[1] == pool_address and not result.success
+        ]
+        if failed:
+            snapshots[pool_address] = f"Failed to read pool state: {failed[0]}"
+            continue
+
+        tick_spacing = FEE_TICK_SPACING[fee]
+        words = {}
+        initialized_ticks[pool_address] = []
+        for word_pos in word_ranges[pool_address]:
+            words[word_pos] = bits = state_results[("bitmap", pool_address, word_pos)].value
+            while bits:
+                tick = ((word_pos << 8) + least_significant_bit(bits)) * tick_spacing
+                initialized_ticks[pool_address].append(tick)
+                multicall.add_call(
+                    ("tick", pool_address, tick),
+                    Web3.to_checksum_address(pool_address),
+                    encode_ticks(tick),
+                    decode_ticks,
+                )
+                bits &= bits - 1
+
+        slot0 = state_results[("slot0", pool_address)].value
+        snapshots[pool_address] = PoolSnapshot(
+            slot0[0],
+            slot0[1],
+            state_results[("liquidity", pool_address)].value,
+            fee,
+            tick_spacing,
+            words,
+            {},
+            block_number,
+        )
+    return block_number, snapshots, initialized_ticks
+
+
+def _read_snapshot_ticks(snapshots, initialized_ticks, tick_results):
+    for pool_address, ticks in initialized_ticks.items():
+        snapshot = snapshots[pool_address]
+        for tick in ticks:
+            result = tick_results[("tick", pool_address, tick)]
+            if not result.success:
+                snapshots[pool_address] = f"Failed to read tick {tick}: {result.error}"
+                break
+            snapshot.ticks[tick] = (result.value[0], result.value[1])
+    return snapshots
+
+
+def load_pool_snapshots(w3, pools, word_radius=2):
+    """Read snapshots of several pools in two multicall round trips
+
+    The first call reads the block number, slot0, liquidity and the tick bitmap
+    words around each pool's tick hint, the second reads liquidityGross and
+    liquidityNet of every initialized tick in those words at the same block.
+
+    Args:
+        w3: Web3 instance
+        pools: List of (pool address, fee in pips, tick hint), the tick hint
+            (e.g. slot0.tick) is used to center the loaded words
+        word_radius: Bitmap words to load on each side of the current word,
+            each word covers 256 * tick_spacing ticks
+
+    Returns:
+        dict mapping pool address -> PoolSnapshot or an error string
+    """
+    multicall = Multicall3(w3)
+    word_ranges = _queue_snapshot_state(multicall, pools, word_radius)
+    block_number, snapshots, initialized_ticks = _read_snapshot_state(
+        multicall, pools, multicall.execute(), word_ranges
+    )
+    tick_results = multicall.execute(block_identifier=block_number)
+    return _read_snapshot_ticks(snapshots, initialized_ticks, tick_results)
+
+
+async def load_pool_snapshots_async(w3, pools, word_radius=2):
+    """Same as load_pool_snapshots() for an AsyncWeb3 instance"""
+    multicall = Multicall3(w3)
+    word_ranges = _queue_snapshot_state(multicall, pools, word_radius)
+    block_number, snapshots, initialized_ticks = _read_snapshot_state(
+        multicall, pools, await multicall.execute_async(), word_ranges
+    )
+    tick_results = await multicall.execute_async(block_identifier=block_number)
+    return _read_snapshot_ticks(snapshots, initialized_ticks, tick_results)